@@ -0,0 +1,135 @@
+"""Acciones corporativas (splits y dividendos) detectadas en las barras de Yahoo.
+
+Las barras de análisis se descargan ajustadas (`auto_adjust`), así que tras un
+split o un dividendo Yahoo reescribe la historia del ticker y las copias cacheadas
+de antes (disco y memoria) quedan en otra escala que los precios nuevos. Las barras
+del escaneo de Stop/TP (`datos_mercado.barras_desde`) van sin ajustar por dividendos,
+pero Yahoo las ajusta siempre por splits: los niveles de los trades abiertos se
+reescalan por cada split, o el escaneo dispararía stops falsos.
+
+- `datos_mercado.descargar_barras` pide también las acciones y registra las nuevas
+  en `ARCHIVO_ACCIONES`; solo se invalida la caché de los tickers afectados.
+- `ajustar_trades` reescala entrada, stop, objetivos, órdenes y acciones de los
+  trades abiertos antes de cada split. Cada trade recuerda los splits que ya se le
+  aplicaron, así que se puede llamar en cada refresh sin riesgo de doble ajuste.
+- `ajustar_portfolios` lo aplica a todos los portfolios en disco, cada uno en un
+  solo cambio atómico bajo su bloqueo.
+"""
+from almacen_portfolio import (bloqueo, escribir, leer, listar_portfolios, listar_usuarios, modificar,
+                               ruta_portfolio)
+from cache_compartida import CACHE
+from operaciones import ESTADO_ACTIVA, ESTADO_PENDIENTE
+
+ARCHIVO_ACCIONES = 'acciones_corporativas.json'
+
+# Columnas que añade yf.download(actions=True) -> tipo de acción en el registro
+COLUMNAS_ACCIONES = {'Stock Splits': 'splits', 'Dividends': 'dividendos'}
+
+CAMPOS_PRECIO = ('entrada', 'stop_loss', 'stop_inicial', 'tp_1_2', 'tp_1_3', 'precio_actual', 'maximo')
+CAMPOS_PRECIO_ORDEN = ('limite', 'stop')
+CAMPOS_ACCIONES = ('acciones', 'acciones_abiertas')
+ESTADOS_ABIERTOS = (ESTADO_ACTIVA, ESTADO_PENDIENTE)
+
+
+# --- DETECCIÓN Y REGISTRO ---
+def acciones_en(df):
+    """{'splits': {fecha: ratio}, 'dividendos': {fecha: importe}} de las barras de un ticker"""
+    acciones = {}
+    for columna, tipo in COLUMNAS_ACCIONES.items():
+        if columna not in df.columns:
+            continue
+        serie = df[columna]
+        serie = serie[serie.fillna(0) != 0]
+        if not serie.empty:
+            acciones[tipo] = dict(zip(serie.index.strftime('%Y-%m-%d'), serie.astype(float)))
+    return acciones
+
+
+def leer_registro(ruta=ARCHIVO_ACCIONES):
+    """{ticker: {'splits': {...}, 'dividendos': {...}}} de todas las acciones vistas"""
+    return leer(ruta) or {}
+
+
+def _nuevas(registro, eventos):
+    return {ticker for ticker, acciones in eventos.items()
+            if any(fecha not in registro.get(ticker, {}).get(tipo, {})
+                   for tipo, fechas in acciones.items() for fecha in fechas)}
+
+
+def registrar_acciones(eventos, ruta=ARCHIVO_ACCIONES):
+    """Añade al registro las acciones {ticker: acciones_en(df)}; devuelve los tickers con alguna nueva"""
+    eventos = {t: a for t, a in eventos.items() if a}
+    # Lo normal es que ya estén todas: se comprueba sin bloqueo ni escritura
+    if not eventos or not _nuevas(leer_registro(ruta), eventos):
+        return set()
+    with bloqueo(ruta):
+        registro = leer_registro(ruta)
+        nuevas = _nuevas(registro, eventos)
+        for ticker in nuevas:
+            for tipo, fechas in eventos[ticker].items():
+                registro.setdefault(ticker, {}).setdefault(tipo, {}).update(fechas)
+        escribir(ruta, registro)
+    return nuevas
+
+
+def invalidar_cache_ticker(ticker):
+    """Borra de la caché compartida todo lo del ticker (barras, análisis, intradía...) y nada más"""
+    ticker = ticker.upper()
+    CACHE.invalidar(clave=lambda c: c == ticker or (isinstance(c, tuple) and c[:1] == (ticker,)))
+
+
+# --- AJUSTE DE TRADES ---
+def _aplicar_split(trade, ratio):
+    """Un split `ratio`:1 divide los precios y multiplica las acciones (inversión y riesgo no cambian)"""
+    # 4 decimales: redondear a céntimos cambiaría el P/L de la posición
+    for campo in CAMPOS_PRECIO:
+        if trade.get(campo) is not None:
+            trade[campo] = round(trade[campo] / ratio, 4)
+    for campo in CAMPOS_PRECIO_ORDEN:
+        if (trade.get('orden') or {}).get(campo) is not None:
+            trade['orden'][campo] = round(trade['orden'][campo] / ratio, 4)
+    for campo in CAMPOS_ACCIONES:
+        if trade.get(campo) is not None:
+            trade[campo] = round(trade[campo] * ratio, 4)
+
+
+def ajustar_trades(trades, registro=None):
+    """Reescala los trades abiertos por los splits posteriores a su apertura.
+
+    Las salidas ya ejecutadas se quedan como se hicieron. Devuelve un evento por
+    ajuste (mismo formato que los del broker).
+    """
+    registro = leer_registro() if registro is None else registro
+    eventos = []
+    for trade in trades:
+        splits = registro.get(trade['ticker'], {}).get('splits')
+        if not splits or trade['status'] not in ESTADOS_ABIERTOS:
+            continue
+        apertura = (trade.get('barra_entrada') or trade['fecha'])[:10]
+        aplicados = trade.get('splits_aplicados', [])
+        for fecha, ratio in sorted(splits.items()):
+            if fecha > apertura and fecha not in aplicados:
+                _aplicar_split(trade, ratio)
+                trade.setdefault('splits_aplicados', []).append(fecha)
+                eventos.append({'ticker': trade['ticker'], 'evento': f"Split {ratio:g}:1", 'barra': fecha,
+                                'acciones': trade['acciones'], 'precio': trade['entrada']})
+    return eventos
+
+
+def ajustar_portfolios():
+    """Ajusta los trades abiertos de todos los portfolios; devuelve {ruta: eventos} de los que cambiaron"""
+    registro = leer_registro()
+    if not any('splits' in acciones for acciones in registro.values()):
+        return {}
+    ajustados = {}
+    for usuario in listar_usuarios():
+        for nombre in listar_portfolios(usuario):
+            ruta = ruta_portfolio(usuario, nombre)
+            # Primero sobre una copia: solo se reescriben los portfolios que necesitan ajuste
+            if not ajustar_trades((leer(ruta) or {}).get('trades', []), registro):
+                continue
+            with modificar(ruta) as portfolio:
+                eventos = ajustar_trades(portfolio['trades'], registro)
+            if eventos:
+                ajustados[ruta] = eventos
+    return ajustados
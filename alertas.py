@@ -0,0 +1,322 @@
+"""Motor de alertas de Stop Loss / Take Profit indexado por nivel de precio.
+
+Los trades activos se indexan por ticker en arrays ordenados por el precio a
+partir del cual entran en zona de alerta. Una actualización de precio resuelve
+las alertas con una búsqueda binaria en lugar de recorrer todos los trades.
+`sincronizar` solo mueve en los arrays los trades cuyos niveles cambiaron.
+"""
+import abc
+import bisect
+import json
+import logging
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+UMBRAL_ALERTA_PCT = 2.0
+ARCHIVO_LOG_ALERTAS = 'alertas.log'
+WEBHOOK_LOCAL_URL = 'http://127.0.0.1:8765/alertas'
+
+
+def clave_trade(trade):
+    """Identificador estable de un trade (sobrevive a recargas del JSON)"""
+    if trade.get('id'):
+        return trade['id']
+    return f"{trade['ticker']}|{trade['fecha']}|{trade['entrada']}"
+
+
+def objetivo(trade):
+    """Precio objetivo vigente: el TP 1:3 una vez ejecutada la salida parcial en el TP 1:2"""
+    return trade['tp_1_3'] if trade.get('tp1_ejecutado') else trade['tp_1_2']
+
+
+class _NivelesOrdenados:
+    """Array ordenado de (clave de precio, entrada) para un ticker"""
+    __slots__ = ('claves', 'entradas')
+
+    def __init__(self):
+        self.claves = []
+        self.entradas = []
+
+    def insertar(self, clave, entrada):
+        pos = bisect.bisect_right(self.claves, clave)
+        self.claves.insert(pos, clave)
+        self.entradas.insert(pos, entrada)
+
+    def quitar(self, clave, id_trade):
+        pos = bisect.bisect_left(self.claves, clave)
+        while pos < len(self.claves) and self.claves[pos] == clave:
+            if self.entradas[pos][0] == id_trade:
+                del self.claves[pos]
+                del self.entradas[pos]
+                return True
+            pos += 1
+        return False
+
+
+class IndiceAlertas:
+    """Índice por ticker de los niveles de stop y TP de los trades activos.
+
+    Por cada ticker se mantienen dos arrays ordenados:
+      - stops: precio por debajo del cual el trade está cerca del Stop Loss
+        (stop + umbral% de la entrada)
+      - tps: precio por encima del cual el trade está cerca de su objetivo
+        (TP 1:2, o TP 1:3 tras la salida parcial; objetivo - umbral% de la entrada)
+    """
+
+    def __init__(self, umbral_pct=UMBRAL_ALERTA_PCT):
+        self.umbral_pct = umbral_pct
+        self._stops = defaultdict(_NivelesOrdenados)
+        self._tps = defaultdict(_NivelesOrdenados)
+        self._claves = {}       # id -> (ticker, clave_stop, clave_tp)
+        self._entradas = {}     # id -> [id, trade] compartida por los dos arrays
+
+    def __len__(self):
+        return len(self._claves)
+
+    def _niveles(self, trade):
+        colchon = trade['entrada'] * self.umbral_pct / 100
+        return trade['stop_loss'] + colchon, objetivo(trade) - colchon
+
+    def agregar(self, trade, origen='portfolio'):
+        """Indexa un trade activo (los no activos se ignoran)"""
+        if trade.get('status') != 'Activa':
+            return
+        id_trade = (origen, clave_trade(trade))
+        niveles = (trade['ticker'], *self._niveles(trade))
+        if self._claves.get(id_trade) == niveles:
+            # Mismos niveles: basta con apuntar al dict nuevo (p. ej. tras recargar el JSON)
+            self._entradas[id_trade][1] = trade
+            return
+        self._quitar(id_trade)
+        ticker, clave_stop, clave_tp = niveles
+        entrada = [id_trade, trade]
+        self._stops[ticker].insertar(clave_stop, entrada)
+        self._tps[ticker].insertar(clave_tp, entrada)
+        self._claves[id_trade] = niveles
+        self._entradas[id_trade] = entrada
+
+    def _quitar(self, id_trade):
+        niveles = self._claves.pop(id_trade, None)
+        if niveles is None:
+            return
+        del self._entradas[id_trade]
+        ticker, clave_stop, clave_tp = niveles
+        self._stops[ticker].quitar(clave_stop, id_trade)
+        self._tps[ticker].quitar(clave_tp, id_trade)
+
+    def quitar(self, trade, origen='portfolio'):
+        """Elimina un trade del índice (p. ej. al cerrarse)"""
+        self._quitar((origen, clave_trade(trade)))
+
+    def sincronizar(self, trades, origen='portfolio'):
+        """Deja en el índice exactamente los trades activos recibidos de un origen.
+
+        Solo se insertan o quitan de los arrays los trades nuevos, cerrados o con
+        niveles distintos; el resto solo actualiza su referencia.
+        """
+        vigentes = set()
+        for trade in trades:
+            if trade.get('status') == 'Activa':
+                vigentes.add((origen, clave_trade(trade)))
+                self.agregar(trade, origen)
+        for id_trade in [k for k in self._claves if k[0] == origen and k not in vigentes]:
+            self._quitar(id_trade)
+
+    def tickers(self):
+        return [t for t, niveles in self._stops.items() if niveles.claves]
+
+    def evaluar(self, ticker, precio):
+        """Devuelve las alertas de un ticker para un precio (búsqueda binaria)"""
+        alertas = []
+        vistos = set()
+
+        stops = self._stops.get(ticker)
+        if stops is not None:
+            inicio = bisect.bisect_right(stops.claves, precio)
+            for id_trade, trade in stops.entradas[inicio:]:
+                vistos.add(id_trade)
+                dist = ((precio - trade['stop_loss']) / trade['entrada']) * 100
+                alertas.append({
+                    'id': id_trade,
+                    'ticker': ticker,
+                    'tipo': 'stop',
+                    'precio': precio,
+                    'nivel': trade['stop_loss'],
+                    'distancia_pct': dist,
+                    'tocado': precio <= trade['stop_loss'],
+                    'trade': trade
+                })
+
+        tps = self._tps.get(ticker)
+        if tps is not None:
+            fin = bisect.bisect_left(tps.claves, precio)
+            for id_trade, trade in tps.entradas[:fin]:
+                if id_trade in vistos:
+                    continue
+                nivel = objetivo(trade)
+                dist = ((nivel - precio) / trade['entrada']) * 100
+                alertas.append({
+                    'id': id_trade,
+                    'ticker': ticker,
+                    'tipo': 'tp',
+                    'precio': precio,
+                    'nivel': nivel,
+                    'distancia_pct': dist,
+                    'tocado': precio >= nivel,
+                    'trade': trade
+                })
+
+        return alertas
+
+
+# --- SINKS ---
+class SinkAlertas(abc.ABC):
+    """Destino de alertas. `solo_nuevas` evita repetir una alerta ya emitida."""
+    solo_nuevas = True
+
+    @abc.abstractmethod
+    def emitir(self, alertas):
+        """Entrega una lista de alertas al destino"""
+
+
+def formatear_alerta(alerta):
+    if alerta['tipo'] == 'stop':
+        return f"🚨 **{alerta['ticker']}** muy cerca del Stop Loss ({alerta['distancia_pct']:.1f}%)"
+    tp = 'TP 1:3' if alerta['trade'].get('tp1_ejecutado') else 'TP 1:2'
+    return f"🎯 **{alerta['ticker']}** muy cerca del {tp} ({alerta['distancia_pct']:.1f}%)"
+
+
+class SinkUI(SinkAlertas):
+    """Muestra las alertas en Streamlit (inline o como toast)"""
+    solo_nuevas = False
+
+    def __init__(self, toast=False):
+        self.toast = toast
+
+    def emitir(self, alertas):
+        import streamlit as st
+        for alerta in alertas:
+            mensaje = formatear_alerta(alerta)
+            if self.toast:
+                st.toast(mensaje, icon="🚨" if alerta['tipo'] == 'stop' else "🎯")
+            elif alerta['tipo'] == 'stop':
+                st.error(mensaje)
+            else:
+                st.success(mensaje)
+
+
+def _payload(alerta):
+    return {
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'origen': alerta['id'][0],
+        'trade': alerta['id'][1],
+        'ticker': alerta['ticker'],
+        'tipo': alerta['tipo'],
+        'precio': round(alerta['precio'], 2),
+        'nivel': alerta['nivel'],
+        'distancia_pct': round(alerta['distancia_pct'], 2),
+        'tocado': alerta['tocado']
+    }
+
+
+class SinkLog(SinkAlertas):
+    """Registra las alertas en un archivo de log (una línea JSON por alerta)"""
+
+    def __init__(self, archivo=ARCHIVO_LOG_ALERTAS):
+        self.logger = logging.getLogger(f'swing_lab.alertas.{archivo}')
+        if not self.logger.handlers:
+            handler = logging.FileHandler(archivo, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+
+    def emitir(self, alertas):
+        for alerta in alertas:
+            self.logger.info(json.dumps(_payload(alerta), ensure_ascii=False))
+
+
+class SinkWebhook(SinkAlertas):
+    """Envía las alertas por POST JSON a un webhook (por defecto, el stand-in local)"""
+
+    def __init__(self, url=WEBHOOK_LOCAL_URL, timeout=2):
+        self.url = url
+        self.timeout = timeout
+
+    def emitir(self, alertas):
+        if not alertas:
+            return
+        cuerpo = json.dumps([_payload(a) for a in alertas]).encode('utf-8')
+        peticion = urllib.request.Request(self.url, data=cuerpo,
+                                          headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(peticion, timeout=self.timeout).close()
+        except Exception:
+            pass
+
+
+class MotorAlertas:
+    """Evalúa precios contra el índice y reparte las alertas a los sinks"""
+
+    def __init__(self, indice=None, sinks=None):
+        self.indice = indice or IndiceAlertas()
+        self.sinks = list(sinks or [])
+        self._emitidas = set()
+
+    def procesar_precios(self, precios, sinks=None):
+        """Evalúa {ticker: precio} y emite las alertas. Devuelve la lista completa."""
+        alertas = []
+        for ticker, precio in precios.items():
+            if precio is not None:
+                alertas.extend(self.indice.evaluar(ticker, precio))
+
+        activas = {(a['id'], a['tipo']) for a in alertas}
+        nuevas = [a for a in alertas if (a['id'], a['tipo']) not in self._emitidas]
+        self._emitidas = activas
+
+        for sink in (self.sinks if sinks is None else sinks):
+            sink.emitir(nuevas if sink.solo_nuevas else alertas)
+        return alertas
+
+
+def precios_desde_trades(trades):
+    """Precio más fresco por ticker entre sus trades activos.
+
+    Cada `precio_actual` es del cierre de su `ultima_barra` o, si aún no se ha escaneado,
+    el de entrada a su `fecha`. Gana el más reciente; a igual día, el de una barra (cierre)
+    frente al de una entrada, así que un trade recién abierto no tapa un precio más nuevo.
+    """
+    precios, frescura = {}, {}
+    for trade in trades:
+        if trade.get('status') != 'Activa':
+            continue
+        barra = trade.get('ultima_barra')
+        clave = (barra or trade['fecha'][:10], bool(barra))
+        if trade['ticker'] not in frescura or clave > frescura[trade['ticker']]:
+            frescura[trade['ticker']] = clave
+            precios[trade['ticker']] = trade['precio_actual']
+    return precios
+
+
+def servidor_webhook_local(puerto=8765):
+    """Stand-in local de webhook: imprime las alertas recibidas"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            largo = int(self.headers.get('Content-Length', 0))
+            for alerta in json.loads(self.rfile.read(largo) or b'[]'):
+                print(json.dumps(alerta, ensure_ascii=False))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Webhook local escuchando en http://127.0.0.1:{puerto}/alertas")
+    HTTPServer(('127.0.0.1', puerto), _Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    servidor_webhook_local()
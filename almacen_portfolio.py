@@ -0,0 +1,169 @@
+"""Almacenamiento de portfolios de forward testing por usuario, un archivo por portfolio.
+
+    portfolios/<usuario>/<portfolio>.json
+
+Cada carga lee solo el archivo del portfolio seleccionado (con caché por mtime)
+y cada escritura bloquea solo ese archivo, así que portfolios distintos nunca
+compiten entre sí. El JSON solo guarda los trades abiertos: los cerrados pasan al
+archivo frío (`archivo_trades`) en cada escritura.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+
+from archivo_trades import archivar_asientos, archivar_cerrados
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo bloqueo dentro del proceso
+    fcntl = None
+
+DIRECTORIO_PORTFOLIOS = 'portfolios'
+ARCHIVO_LEGACY = 'portfolio_data.json'
+USUARIO_DEFAULT = 'default'
+PORTFOLIO_DEFAULT = 'principal'
+CAPITAL_INICIAL_DEFAULT = 1000.0
+
+_locks = {}
+_locks_guard = threading.Lock()
+_cache = {}
+
+
+def normalizar_nombre(nombre):
+    """Convierte un nombre de usuario/portfolio en un nombre de archivo seguro"""
+    limpio = re.sub(r'[^A-Za-z0-9_-]+', '_', nombre.strip()).strip('_')
+    return limpio.lower() or USUARIO_DEFAULT
+
+
+def ruta_portfolio(usuario, nombre):
+    return os.path.join(DIRECTORIO_PORTFOLIOS, normalizar_nombre(usuario),
+                        f"{normalizar_nombre(nombre)}.json")
+
+
+def portfolio_vacio(capital_inicial=CAPITAL_INICIAL_DEFAULT):
+    return {
+        'capital_inicial': float(capital_inicial),
+        'trades': []
+    }
+
+
+@contextmanager
+def bloqueo(ruta):
+    """Bloqueo exclusivo de un único portfolio (hilos del proceso + otros procesos)"""
+    with _locks_guard:
+        lock = _locks.setdefault(ruta, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        with open(f"{ruta}.lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def firma_archivo(ruta):
+    """Identifica una versión concreta del archivo (None si no existe)"""
+    try:
+        estado = os.stat(ruta)
+    except FileNotFoundError:
+        return None
+    return (estado.st_ino, estado.st_mtime_ns, estado.st_size)
+
+
+def leer(ruta):
+    """Lee un portfolio; si el archivo no cambió no se vuelve a abrir (se guarda su texto).
+
+    El JSON se parsea en cada llamada: cada lector recibe su propia copia, que puede modificar.
+    """
+    firma = firma_archivo(ruta)
+    if firma is None:
+        return None
+    en_cache = _cache.get(ruta)
+    if en_cache is not None and en_cache[0] == firma:
+        return json.loads(en_cache[1])
+    with open(ruta, 'r') as f:
+        texto = f.read()
+    _cache[ruta] = (firma, texto)
+    return json.loads(texto)
+
+
+def escribir(ruta, data):
+    """Escritura atómica (archivo temporal + rename)"""
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporal, ruta)
+
+
+def escribir_portfolio(ruta, data):
+    """Escribe un portfolio (con su bloqueo tomado) tras pasar sus trades cerrados y los asientos
+    ya snapshoteados del libro al archivo frío"""
+    archivar_cerrados(ruta, data)
+    archivar_asientos(ruta, data)
+    escribir(ruta, data)
+
+
+@contextmanager
+def modificar(ruta):
+    """Lectura-modificación-escritura de un portfolio bajo su bloqueo"""
+    with bloqueo(ruta):
+        data = leer(ruta) or portfolio_vacio()
+        yield data
+        escribir_portfolio(ruta, data)
+
+
+def cargar_portfolio(usuario, nombre):
+    return leer(ruta_portfolio(usuario, nombre))
+
+
+def guardar_portfolio(usuario, nombre, data):
+    ruta = ruta_portfolio(usuario, nombre)
+    with bloqueo(ruta):
+        escribir_portfolio(ruta, data)
+
+
+def crear_portfolio(usuario, nombre, capital_inicial=CAPITAL_INICIAL_DEFAULT):
+    """Crea un portfolio vacío.
+
+    ValueError si ya hay uno con el mismo nombre normalizado: "Swing", "swing" y
+    "swing!" van al mismo archivo, y crearlo otra vez mezclaría sus trades.
+    """
+    ruta = ruta_portfolio(usuario, nombre)
+    with bloqueo(ruta):
+        if os.path.exists(ruta):
+            raise ValueError(f"Ya existe el portfolio '{normalizar_nombre(nombre)}' "
+                             f"(los nombres no distinguen mayúsculas ni signos)")
+        escribir(ruta, portfolio_vacio(capital_inicial))
+    return ruta
+
+
+def listar_usuarios():
+    if not os.path.isdir(DIRECTORIO_PORTFOLIOS):
+        return []
+    return sorted(d for d in os.listdir(DIRECTORIO_PORTFOLIOS)
+                  if os.path.isdir(os.path.join(DIRECTORIO_PORTFOLIOS, d)))
+
+
+def listar_portfolios(usuario):
+    directorio = os.path.join(DIRECTORIO_PORTFOLIOS, normalizar_nombre(usuario))
+    if not os.path.isdir(directorio):
+        return []
+    return sorted(a[:-5] for a in os.listdir(directorio) if a.endswith('.json'))
+
+
+def migrar_legacy():
+    """Copia el `portfolio_data.json` global como portfolio principal del usuario default"""
+    destino = ruta_portfolio(USUARIO_DEFAULT, PORTFOLIO_DEFAULT)
+    if not os.path.exists(ARCHIVO_LEGACY) or os.path.exists(destino):
+        return
+    with bloqueo(destino):
+        if not os.path.exists(destino):
+            shutil.copyfile(ARCHIVO_LEGACY, destino)
@@ -0,0 +1,125 @@
+"""Análisis técnico "as-of": el pipeline de la pestaña de análisis evaluado en cualquier fecha.
+
+Los indicadores (soporte, stops de todos los métodos, volumen medio, RSI) se precalculan una vez sobre todas
+las barras cacheadas del ticker. Evaluar una fecha es un `searchsorted` más unas
+lecturas de array, así que se puede recorrer el histórico con un slider sin volver
+a descargar nada.
+"""
+import time
+
+import numpy as np
+
+from cache_compartida import CACHE, ttl
+from calendario import barras_vigentes
+from datos_mercado import (TTL_BARRAS_SESION, barras_en_curso, barras_ticker, guardar_cache_analisis,
+                           leer_cache_analisis)
+from metodos_stop import BARRAS_MES, METODO_DEFAULT, calcular_stops, stops_en
+from operaciones import fechas_barras
+
+BARRAS_GRAFICO = 63   # equivalente a period="3mo"
+PERIODO_RSI = 14
+
+
+def rsi_serie(cierres, periodo=PERIODO_RSI):
+    """RSI de 14 períodos con medias simples, para toda la serie"""
+    delta = cierres.diff()
+    ganancia = delta.where(delta > 0, 0).rolling(window=periodo).mean()
+    perdida = -delta.where(delta < 0, 0).rolling(window=periodo).mean()
+    return 100 - (100 / (1 + ganancia / perdida))
+
+
+class AnalisisHistorico:
+    """Indicadores precalculados de un ticker, consultables a cualquier fecha"""
+    __slots__ = ('barras', 'fechas', 'cierres', 'minimos', 'volumenes', 'volumen_medio', 'rsi', 'stops')
+
+    def __init__(self, barras):
+        self.barras = barras
+        self.fechas = fechas_barras(barras)
+        self.cierres = barras['Close'].to_numpy(np.float64)
+        self.minimos = barras['Low'].to_numpy(np.float64)
+        self.volumenes = barras['Volume'].to_numpy(np.float64)
+        self.volumen_medio = barras['Volume'].rolling(BARRAS_MES, min_periods=1).mean().to_numpy()
+        self.rsi = rsi_serie(barras['Close']).to_numpy()
+        self.stops = calcular_stops(barras)
+
+    def posicion(self, fecha):
+        """Índice de la última barra con fecha <= `fecha` (YYYY-MM-DD), -1 si no hay"""
+        return int(np.searchsorted(self.fechas, str(fecha)[:10], side='right')) - 1
+
+    def evaluar(self, fecha, metodo_stop=METODO_DEFAULT):
+        """Precio, soporte 20d, stops, volumen relativo y RSI tal como se veían al cierre de `fecha`.
+
+        'stop_loss' es el del método elegido; 'stops' trae el de todos los métodos.
+        """
+        i = self.posicion(fecha)
+        if i < 0:
+            return None
+        desde = max(0, i - BARRAS_MES + 1)
+        j = desde + int(np.argmin(self.minimos[desde:i + 1]))
+        minimo = float(self.minimos[j])
+
+        volumen_relativo = None
+        if i - desde >= 1 and self.volumen_medio[i] > 0:
+            volumen_relativo = round(float(self.volumenes[i] / self.volumen_medio[i] * 100), 0)
+        rsi = self.rsi[i] if i >= PERIODO_RSI else np.nan
+        stops = stops_en(self.stops, i)
+
+        return {
+            'fecha': str(self.fechas[i]),
+            'precio': float(self.cierres[i]),
+            'minimo_base': round(minimo, 2),
+            'stop_loss': stops.get(metodo_stop),
+            'stops': stops,
+            'info': {'dias': i - desde + 1, 'fecha_minimo': str(self.fechas[j])},
+            'volumen_relativo': volumen_relativo,
+            'volumen_actual': int(self.volumenes[i]),
+            'rsi': None if np.isnan(rsi) else round(float(rsi), 1),
+        }
+
+    def barras_hasta(self, fecha, n=BARRAS_GRAFICO):
+        """Últimas `n` barras hasta `fecha` inclusive (para el gráfico)"""
+        i = self.posicion(fecha)
+        return self.barras.iloc[max(0, i - n + 1):i + 1]
+
+
+def firma_barras(barras):
+    """Identifica unas barras entre procesos: número, última fecha y último cierre"""
+    return len(barras), str(barras.index[-1]), float(barras['Close'].iloc[-1])
+
+
+def _analisis_diario(ticker, barras):
+    """Indicadores de las barras diarias: de disco si otro proceso ya los calculó, si no se calculan y guardan"""
+    firma = firma_barras(barras)
+    guardado = leer_cache_analisis(ticker)
+    if guardado is not None and guardado[0] == firma:
+        analisis = guardado[1]
+        analisis.barras = barras
+        return analisis
+    analisis = AnalisisHistorico(barras)
+    try:
+        guardar_cache_analisis(ticker, firma, analisis)
+    except OSError:
+        pass
+    return analisis
+
+
+def analisis_historico(ticker, en_curso=False):
+    """AnalisisHistorico del ticker sobre la caché local de barras (None si no hay datos).
+
+    Se reconstruye solo cuando la caché trae barras nuevas (una vez al día) y se guarda en
+    disco junto a las barras, así que precalentar.py lo deja listo para la app. Con
+    `en_curso` incluye la barra de la sesión en curso y se renueva con ella; fuera de
+    sesión esa barra no existe y se sirve el mismo análisis diario.
+    """
+    barras = barras_ticker(ticker)
+    if barras is None or barras.empty:
+        return None
+    ticker = ticker.upper()
+    if en_curso:
+        actuales = barras_en_curso(ticker)
+        if actuales is not barras:
+            return CACHE.obtener('analisis_en_curso', ticker,
+                                 lambda: (time.time(), AnalisisHistorico(actuales)),
+                                 ttl(TTL_BARRAS_SESION), valida=lambda analisis: analisis.barras is actuales)
+    return CACHE.obtener('analisis', ticker, lambda: (time.time(), _analisis_diario(ticker, barras)),
+                         barras_vigentes, valida=lambda analisis: analisis.barras is barras)
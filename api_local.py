@@ -0,0 +1,448 @@
+"""Servicio HTTP local con los números de Swing Lab en JSON (bots, hojas de cálculo...).
+
+Misma lógica que la app, sin Streamlit: análisis técnico de la caché de barras,
+veredicto de los filtros, tamaño de posición y portfolios (lectura y refresco con
+el broker simulado).
+
+- Servidor asyncio con keep-alive; el cálculo va a un pool de hilos acotado
+  (`--trabajadores`), así que el bucle nunca se bloquea con pandas ni con Yahoo.
+- Las respuestas GET se cachean en la caché compartida del proceso
+  (`TTL_RESPUESTA` segundos, o hasta que cambie el archivo en los portfolios) y un
+  acierto se sirve desde el bucle sin pasar por el pool. Peticiones iguales
+  simultáneas se calculan una sola vez.
+- Los lotes descargan las barras que falten en una sola llamada y reparten los
+  tickers entre los trabajadores.
+
+Endpoints:
+    GET  /salud
+    GET  /analisis/<ticker>?metodo=soporte_20d&fecha=YYYY-MM-DD&smart_score=9&upside=15&consensus=Strong+Buy&regimen=1
+    POST /analisis                       {"tickers": [...], mismos parámetros}
+    GET  /posicion?capital=1000&riesgo_pct=2&entrada=100&stop_loss=95
+    POST /posicion                       {"capital": ..., "riesgo_pct": ..., "operaciones": [{"ticker", "entrada", "stop_loss"}]}
+    GET  /portfolios
+    GET  /portfolio/<usuario>/<nombre>[?trades=todos]
+    POST /portfolio/<usuario>/<nombre>/refrescar
+    GET  /estadisticas
+
+Uso sin UI:
+    python api_local.py --puerto 8770 --trabajadores 8
+    curl 'http://127.0.0.1:8770/analisis/MSFT?smart_score=9&upside=12&consensus=Moderate+Buy'
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+
+from acciones_corporativas import ajustar_trades
+from almacen_portfolio import (firma_archivo, leer, listar_portfolios, listar_usuarios, migrar_legacy,
+                               modificar, ruta_portfolio)
+from analisis import analisis_historico
+from archivo_trades import resumen_archivo, todos_los_trades
+from broker import procesar_portfolio
+from cache_compartida import CACHE, ttl
+from datos_mercado import TTL_COTIZACION, barras_cacheadas, descargar_barras_pendientes, precio_en_vivo
+from eficacia_filtros import validar_filtros_tipranks
+from libro_caja import saldos
+from metodos_stop import METODO_DEFAULT, METODOS_STOP
+from operaciones import ESTADO_ACTIVA, ESTADO_PENDIENTE, calcular_posicion
+from regimen import regimen_en, regimen_mercado
+
+PUERTO_API = 8770
+TRABAJADORES_DEFAULT = 8
+# Vigencia de una respuesta cacheada: la del precio en vivo que lleva dentro
+TTL_RESPUESTA = TTL_COTIZACION
+MAXIMO_LOTE = 500
+MAXIMO_CUERPO = 1024 * 1024
+ESTADOS_ABIERTOS = (ESTADO_ACTIVA, ESTADO_PENDIENTE)
+
+
+class ErrorApi(Exception):
+    """Error con su código HTTP; el mensaje va al cliente"""
+
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+# --- PARÁMETROS ---
+def _numero(params, nombre, defecto=None):
+    valor = params.get(nombre)
+    if valor is None or valor == '':
+        if defecto is None:
+            raise ErrorApi(400, f"Falta el parámetro '{nombre}'")
+        return defecto
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        raise ErrorApi(400, f"'{nombre}' debe ser un número") from None
+
+
+def _positivo(valor, nombre):
+    if not valor > 0:
+        raise ErrorApi(400, f"'{nombre}' debe ser mayor que 0")
+    return valor
+
+
+def _opcional(params, nombre):
+    return None if params.get(nombre) in (None, '') else _numero(params, nombre)
+
+
+def _si(params, nombre):
+    return str(params.get(nombre, '')).lower() in ('1', 'true', 'si', 'sí')
+
+
+def _opciones_analisis(params):
+    """(metodo, fecha, tipranks, regimen) validados a partir de la query o del cuerpo"""
+    metodo = params.get('metodo') or METODO_DEFAULT
+    if metodo not in METODOS_STOP:
+        raise ErrorApi(400, f"Método de stop desconocido: {metodo} (válidos: {', '.join(METODOS_STOP)})")
+    fecha = params.get('fecha') or None
+    if fecha is not None and not re.fullmatch(r'\d{4}-\d{2}-\d{2}', str(fecha)):
+        raise ErrorApi(400, "'fecha' debe ser YYYY-MM-DD")
+    tipranks = (_opcional(params, 'smart_score'), _opcional(params, 'upside'), params.get('consensus') or None)
+    return metodo, fecha, tipranks, _si(params, 'regimen')
+
+
+def _json(valor):
+    """Tipos de numpy (y NaN) a JSON"""
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+        return None if isinstance(valor, float) and np.isnan(valor) else valor
+    return str(valor)
+
+
+def _codificar(datos):
+    return json.dumps(datos, default=_json, ensure_ascii=False).encode()
+
+
+# --- LÓGICA ---
+def analizar_ticker(ticker, metodo=METODO_DEFAULT, fecha=None, tipranks=(None, None, None), regimen=False):
+    """Precio, soporte, stop, RSI, volumen y veredicto de los filtros de un ticker (None sin datos).
+
+    Sin `fecha` es el análisis de hoy con el precio en vivo; con ella, el as-of al cierre
+    de ese día. Los filtros de TipRanks solo se evalúan si llegan sus valores.
+    """
+    ticker = ticker.upper()
+
+    def cargar():
+        historico = analisis_historico(ticker, en_curso=fecha is None)
+        resultado = historico.evaluar(fecha or datetime.now().strftime('%Y-%m-%d'), metodo) if historico else None
+        if resultado is None:
+            return None
+        precio = resultado['precio'] if fecha else (precio_en_vivo(ticker) or resultado['precio'])
+        estado_mercado = None
+        if regimen:
+            estado_mercado = regimen_en(fecha) if fecha else regimen_mercado()
+        filtros, aprobada = validar_filtros_tipranks(*tipranks, resultado['volumen_relativo'],
+                                                     resultado['rsi'], estado_mercado)
+        stop = resultado['stop_loss']
+        return time.time(), {
+            'ticker': ticker,
+            'fecha': resultado['fecha'],
+            'precio': round(float(precio), 2),
+            'minimo_base': resultado['minimo_base'],
+            'metodo_stop': metodo,
+            'stop_loss': stop if stop and stop < precio else None,
+            'stops': resultado['stops'],
+            'rsi': resultado['rsi'],
+            'volumen_relativo': resultado['volumen_relativo'],
+            'volumen_actual': resultado['volumen_actual'],
+            'dias_soporte': resultado['info']['dias'],
+            'fecha_minimo': resultado['info']['fecha_minimo'],
+            'regimen': estado_mercado['regimen'] if estado_mercado else None,
+            'filtros': {nombre: f['pasa'] for nombre, f in filtros.items()},
+            'mensajes': [f['mensaje'] for f in filtros.values()],
+            'aprobada': aprobada,
+        }
+
+    clave = (ticker, metodo, fecha, tipranks, regimen)
+    return CACHE.obtener('api_analisis', clave, cargar, ttl(TTL_RESPUESTA))
+
+
+def posicion(capital, riesgo_pct, entrada, stop_loss):
+    _positivo(capital, 'capital')
+    _positivo(riesgo_pct, 'riesgo_pct')
+    try:
+        resultado = calcular_posicion(capital, riesgo_pct, entrada, stop_loss)
+    except ValueError as e:
+        raise ErrorApi(400, str(e)) from None
+    resultado = {k: round(v, 2) if isinstance(v, float) else v for k, v in resultado.items()}
+    resultado['pct_capital'] = round(resultado['inversion'] / capital * 100, 1)
+    return resultado
+
+
+def _ruta_existente(usuario, nombre):
+    ruta = ruta_portfolio(usuario, nombre)
+    if not os.path.exists(ruta):
+        raise ErrorApi(404, f"No existe el portfolio {usuario}/{nombre}")
+    return ruta
+
+
+def resumen_portfolio(portfolio, ruta, todos=False):
+    """Saldos del libro de caja, P/L y trades (los abiertos, o todos con los archivados)"""
+    cuentas = saldos(portfolio)
+    trades = portfolio['trades']
+    abiertos = [t for t in trades if t['status'] in ESTADOS_ABIERTOS]
+    estados = Counter(t['status'] for t in trades) + Counter(resumen_archivo(portfolio)['estados'])
+    return {
+        'capital_inicial': portfolio['capital_inicial'],
+        'caja': round(cuentas['caja'], 2),
+        'posiciones': round(cuentas['posiciones'], 2),
+        'pl_realizado': round(-cuentas['resultados'] - cuentas['comisiones'], 2),
+        'pl_abierto': round(sum(t.get('pl_actual') or 0.0 for t in abiertos
+                                if t['status'] == ESTADO_ACTIVA), 2),
+        'estados': dict(estados),
+        'trades': list(todos_los_trades(ruta, portfolio)) if todos else abiertos,
+    }
+
+
+def refrescar_portfolio(ruta):
+    """Barras nuevas de los trades abiertos -> splits -> broker, en un solo cambio atómico del archivo.
+
+    Las barras se descargan fuera del bloqueo; el broker solo procesa lo posterior al
+    checkpoint de cada trade, así que lo que otro proceso escriba mientras tanto se respeta.
+    """
+    barras = descargar_barras_pendientes((leer(ruta) or {}).get('trades', []))
+    with modificar(ruta) as portfolio:
+        eventos = ajustar_trades(portfolio['trades']) + procesar_portfolio(portfolio, barras)
+        resumen = resumen_portfolio(portfolio, ruta)
+    return {'eventos': eventos, **resumen}
+
+
+# --- RUTAS ---
+async def _salud(servidor, params, cuerpo):
+    return {'ok': True}
+
+
+async def _analisis(servidor, params, cuerpo, ticker):
+    resultado = await servidor.en_pool(analizar_ticker, unquote(ticker), *_opciones_analisis(params))
+    if resultado is None:
+        raise ErrorApi(404, f"No hay barras para '{ticker.upper()}'")
+    return resultado
+
+
+async def _analisis_lote(servidor, params, cuerpo):
+    tickers = sorted({str(t).strip().upper() for t in cuerpo.get('tickers') or [] if str(t).strip()})
+    if not tickers:
+        raise ErrorApi(400, "Falta la lista 'tickers'")
+    if len(tickers) > MAXIMO_LOTE:
+        raise ErrorApi(400, f"Máximo {MAXIMO_LOTE} tickers por lote")
+    opciones = _opciones_analisis(cuerpo)
+    # Las barras que falten, en una sola descarga; después cada ticker va a un trabajador
+    await servidor.en_pool(barras_cacheadas, tickers)
+    resultados = await asyncio.gather(*(servidor.en_pool(analizar_ticker, t, *opciones) for t in tickers),
+                                      return_exceptions=True)
+    analisis, errores = {}, {}
+    for ticker, resultado in zip(tickers, resultados):
+        if isinstance(resultado, Exception):
+            errores[ticker] = str(resultado)
+        elif resultado is None:
+            errores[ticker] = "Sin barras"
+        else:
+            analisis[ticker] = resultado
+    return {'analisis': analisis, 'errores': errores,
+            'aprobados': [t for t, a in analisis.items() if a['aprobada']]}
+
+
+async def _posicion(servidor, params, cuerpo):
+    return posicion(_numero(params, 'capital'), _numero(params, 'riesgo_pct', 2.0),
+                    _numero(params, 'entrada'), _numero(params, 'stop_loss'))
+
+
+async def _posicion_lote(servidor, params, cuerpo):
+    capital = _positivo(_numero(cuerpo, 'capital'), 'capital')
+    riesgo_pct = _positivo(_numero(cuerpo, 'riesgo_pct', 2.0), 'riesgo_pct')
+    operaciones = cuerpo.get('operaciones') or []
+    if len(operaciones) > MAXIMO_LOTE:
+        raise ErrorApi(400, f"Máximo {MAXIMO_LOTE} operaciones por lote")
+    resultados = []
+    for operacion in operaciones:
+        try:
+            fila = posicion(capital, riesgo_pct, _numero(operacion, 'entrada'), _numero(operacion, 'stop_loss'))
+        except ErrorApi as e:
+            fila = {'error': str(e)}
+        resultados.append({'ticker': operacion.get('ticker'), **fila})
+    return {'posiciones': resultados}
+
+
+async def _portfolios(servidor, params, cuerpo):
+    return {usuario: listar_portfolios(usuario) for usuario in listar_usuarios()}
+
+
+async def _portfolio(servidor, params, cuerpo, usuario, nombre):
+    ruta = _ruta_existente(usuario, nombre)
+    return await servidor.en_pool(lambda: resumen_portfolio(leer(ruta), ruta, params.get('trades') == 'todos'))
+
+
+async def _refrescar(servidor, params, cuerpo, usuario, nombre):
+    return await servidor.en_pool(refrescar_portfolio, _ruta_existente(usuario, nombre))
+
+
+async def _estadisticas(servidor, params, cuerpo):
+    return {'api': servidor.estadisticas(), 'cache': CACHE.estadisticas()}
+
+
+def _version_portfolio(usuario, nombre):
+    """Parte de la clave de caché que cambia con el archivo (un refresco invalida la respuesta)"""
+    return firma_archivo(ruta_portfolio(usuario, nombre))
+
+
+# (método, patrón, manejador, versión de la respuesta cacheada o None si no se cachea)
+RUTAS = [
+    ('GET', r'/salud', _salud, None),
+    ('GET', r'/analisis/([^/]+)', _analisis, lambda ticker: None),
+    ('POST', r'/analisis', _analisis_lote, None),
+    ('GET', r'/posicion', _posicion, None),
+    ('POST', r'/posicion', _posicion_lote, None),
+    ('GET', r'/portfolios', _portfolios, None),
+    ('GET', r'/portfolio/([^/]+)/([^/]+)', _portfolio, _version_portfolio),
+    ('POST', r'/portfolio/([^/]+)/([^/]+)/refrescar', _refrescar, None),
+    ('GET', r'/estadisticas', _estadisticas, None),
+]
+_RUTAS = [(metodo, re.compile(patron + '/?'), manejador, version) for metodo, patron, manejador, version in RUTAS]
+
+
+# --- SERVIDOR ---
+class ServidorApi:
+    """Servidor HTTP/1.1 asyncio con pool de trabajadores y caché de respuestas"""
+
+    def __init__(self, host='127.0.0.1', puerto=PUERTO_API, trabajadores=TRABAJADORES_DEFAULT):
+        self.host = host
+        self.puerto = puerto
+        self.trabajadores = trabajadores
+        self.pool = ThreadPoolExecutor(max_workers=max(1, trabajadores), thread_name_prefix='api')
+        self.peticiones = Counter()
+        self.respuestas_cacheadas = 0
+        self.latencias = deque(maxlen=10000)
+        self._servidor = None
+
+    def en_pool(self, funcion, *args):
+        return asyncio.get_running_loop().run_in_executor(self.pool, funcion, *args)
+
+    async def responder(self, metodo, destino, cuerpo):
+        """(estado, bytes JSON) de una petición"""
+        partes = urlsplit(destino)
+        params = dict(parse_qsl(partes.query))
+        for metodo_ruta, patron, manejador, version in _RUTAS:
+            encontrada = patron.fullmatch(partes.path)
+            if encontrada is None or metodo_ruta != metodo:
+                continue
+            self.peticiones[patron.pattern] += 1
+            if version is None:
+                return 200, _codificar(await manejador(self, params, cuerpo, *encontrada.groups()))
+            # GET cacheable: un acierto se sirve sin salir del bucle; un fallo se calcula una vez
+            clave = (destino, version(*encontrada.groups()))
+            respuesta = CACHE.consultar('api_respuestas', clave)
+            if respuesta is not None:
+                self.respuestas_cacheadas += 1
+                return 200, respuesta
+            respuesta = _codificar(await manejador(self, params, cuerpo, *encontrada.groups()))
+            CACHE.guardar('api_respuestas', clave, respuesta, ttl(TTL_RESPUESTA))
+            return 200, respuesta
+        raise ErrorApi(404, f"No existe {metodo} {partes.path}")
+
+    async def _atender(self, reader, writer):
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                inicio = time.perf_counter()
+                try:
+                    metodo, destino, version_http = linea.decode('latin-1').split()
+                except ValueError:
+                    break
+                cabeceras = {}
+                while True:
+                    cabecera = await reader.readline()
+                    if cabecera in (b'\r\n', b'\n', b''):
+                        break
+                    nombre, _, valor = cabecera.decode('latin-1').partition(':')
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+                mantener = (cabeceras.get('connection', '').lower() != 'close'
+                            and version_http != 'HTTP/1.0')
+                try:
+                    largo = int(cabeceras.get('content-length') or 0)
+                    if largo > MAXIMO_CUERPO:
+                        raise ErrorApi(413, "Cuerpo demasiado grande")
+                    cuerpo = {}
+                    if largo:
+                        try:
+                            cuerpo = json.loads(await reader.readexactly(largo))
+                        except ValueError:
+                            raise ErrorApi(400, "El cuerpo debe ser JSON") from None
+                    if not isinstance(cuerpo, dict):
+                        raise ErrorApi(400, "El cuerpo debe ser un objeto JSON")
+                    estado, respuesta = await self.responder(metodo.upper(), destino, cuerpo)
+                except ErrorApi as e:
+                    estado, respuesta = e.estado, _codificar({'error': str(e)})
+                except Exception as e:
+                    estado, respuesta = 500, _codificar({'error': f"{type(e).__name__}: {e}"})
+                writer.write(f"HTTP/1.1 {estado} {HTTPStatus(estado).phrase}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(respuesta)}\r\n"
+                             f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n".encode('latin-1')
+                             + respuesta)
+                await writer.drain()
+                self.latencias.append((time.perf_counter() - inicio) * 1000)
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cliente que se va o servidor que se detiene con la conexión abierta
+            pass
+        finally:
+            writer.close()
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+        return self.puerto
+
+    async def detener(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+        self.pool.shutdown(wait=False)
+
+    def estadisticas(self):
+        latencias = np.array(self.latencias) if self.latencias else None
+        return {
+            'peticiones': sum(self.peticiones.values()),
+            'por_ruta': dict(self.peticiones),
+            'respuestas_cacheadas': self.respuestas_cacheadas,
+            'trabajadores': self.trabajadores,
+            'latencia_p50_ms': None if latencias is None else round(float(np.percentile(latencias, 50)), 2),
+            'latencia_p95_ms': None if latencias is None else round(float(np.percentile(latencias, 95)), 2),
+        }
+
+
+async def _main(args):
+    migrar_legacy()
+    servidor = ServidorApi(args.host, args.puerto, args.trabajadores)
+    puerto = await servidor.iniciar()
+    print(f"API de Swing Lab escuchando en http://{args.host}:{puerto} ({args.trabajadores} trabajadores)")
+    try:
+        await servidor._servidor.serve_forever()
+    finally:
+        await servidor.detener()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="API HTTP local de Swing Lab (JSON)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=PUERTO_API)
+    parser.add_argument('--trabajadores', type=int, default=TRABAJADORES_DEFAULT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
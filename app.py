@@ -1,10 +1,41 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import json
+import functools
 import os
+import tempfile
+from contextlib import contextmanager
+
+from acciones_corporativas import ajustar_trades
+from datos_mercado import barras_cacheadas, descargar_barras_pendientes, info_cacheada, precio_en_vivo
+from cache_compartida import CACHE
+from analisis import analisis_historico
+from metodos_stop import METODOS_STOP, METODO_DEFAULT, nombres_metodos, comparar_stops
+from registros import TablaTrades
+from operaciones import aplicar_barras_historial, calcular_posicion
+from broker import CONFIG_BROKER_DEFAULT, TIPOS_ORDEN, abrir_trade, config_broker, procesar_portfolio
+from libro_caja import conciliar, saldo_caja, saldos, ultimos_asientos
+from archivo_trades import (ESTADOS_ABIERTOS, asientos_archivados, borrar_archivo, cerrados_en_rango, pl_antes_de,
+                            resumen_archivo, todos_los_trades)
+from calendario import fase_mercado, segundos_hasta_refresco, ultima_sesion_final
+from almacen_portfolio import (USUARIO_DEFAULT, PORTFOLIO_DEFAULT, CAPITAL_INICIAL_DEFAULT,
+                               ruta_portfolio, portfolio_vacio, leer, escribir_portfolio, bloqueo, firma_archivo,
+                               crear_portfolio, listar_portfolios, migrar_legacy)
+from importacion import preparar_importacion, aplicar_importacion
+from simbolos import validar_ticker
+from regimen import regimen_mercado, regimen_en
+from eficacia_filtros import (HORIZONTE_SESIONES, NOMBRES_FILTRO, validar_filtros_tipranks, registro_sombra,
+                              guardar_sombra, leer_sombras, informe_eficacia)
+from temporalidades import INTERVALOS_BASE, INTERVALO_BASE_DEFAULT, ETIQUETAS, analizar_temporalidades
+from precalentar import ARCHIVO_WATCHLIST, precalentar, tickers_a_precalentar, formatear_informe
+from exportacion import FORMATOS, formatos_disponibles, exportar, exportar_stock_master
+from streaming import (PipelineCotizaciones, ProveedorYahoo, ProveedorReplay, CierreEnArchivo,
+                       PUERTO_REPLAY, iniciar_en_segundo_plano)
+from alertas import (MotorAlertas, SinkUI, SinkLog, SinkWebhook,
+                     WEBHOOK_LOCAL_URL, clave_trade, precios_desde_trades)
 
 # --- CONFIGURACIÓN ---
 st.set_page_config(page_title="Swing Lab | Dr. Cruz", page_icon="🩸", layout="wide")
@@ -25,91 +56,68 @@ if 'historial_operaciones' not in st.session_state:
     st.session_state['historial_operaciones'] = []
 if 'auto_refresh' not in st.session_state:
     st.session_state['auto_refresh'] = False
+if 'portfolio_activo' not in st.session_state:
+    migrar_legacy()
+    st.session_state['portfolio_activo'] = (USUARIO_DEFAULT, PORTFOLIO_DEFAULT)
 if 'portfolio_forward_test' not in st.session_state:
-    st.session_state['portfolio_forward_test'] = {
-        'capital_inicial': 1000.0,
-        'capital_actual': 1000.0,
-        'trades': []
-    }
+    st.session_state['portfolio_forward_test'] = portfolio_vacio()
 if 'modo_estricto_tipranks' not in st.session_state:
     st.session_state['modo_estricto_tipranks'] = True
 if 'tracking_portfolio_enabled' not in st.session_state:
     st.session_state['tracking_portfolio_enabled'] = True
+if 'ticker_input' not in st.session_state:
+    st.session_state['ticker_input'] = "MSFT"
 
 # --- FUNCIONES ---
-def calcular_stop_loss_soporte_20d(ticker_obj, precio_actual):
-    """Calcula Stop Loss basado en soporte de 20 días"""
-    try:
-        hist = ticker_obj.history(period="1mo")
-        if hist.empty:
-            return None, None, None
-        
-        minimo_20d = hist['Low'].min()
-        stop_loss = minimo_20d * 0.98
-        dias_datos = len(hist)
-        fecha_minimo = hist['Low'].idxmin().strftime('%Y-%m-%d')
-        
-        return round(stop_loss, 2), round(minimo_20d, 2), {
-            'dias': dias_datos,
-            'fecha_minimo': fecha_minimo
-        }
-    except Exception as e:
-        return None, None, {'error': str(e)}
+def marcar_cambio(origen):
+    """Sube la versión de 'historial' o 'portfolio' tras mutar sus trades"""
+    st.session_state[f'version_{origen}'] = st.session_state.get(f'version_{origen}', 0) + 1
 
-def calcular_volumen_relativo(ticker_obj):
-    """Calcula volumen relativo (actual vs promedio 20d)"""
-    try:
-        hist = ticker_obj.history(period="1mo")
-        if len(hist) < 2:
-            return None, None
-        
-        volumen_actual = hist['Volume'].iloc[-1]
-        volumen_promedio = hist['Volume'].mean()
-        volumen_relativo = (volumen_actual / volumen_promedio) * 100
-        
-        return round(volumen_relativo, 0), int(volumen_actual)
-    except:
-        return None, None
+def _versiones():
+    return st.session_state.get('version_historial', 0), st.session_state.get('version_portfolio', 0)
 
-def calcular_rsi(ticker_obj, periodo=14):
-    """Calcula RSI de 14 períodos"""
-    try:
-        hist = ticker_obj.history(period="3mo")
-        if len(hist) < periodo + 1:
-            return None
-        
-        # Calcular cambios de precio
-        delta = hist['Close'].diff()
-        
-        # Ganancias y pérdidas
-        ganancia = delta.where(delta > 0, 0).rolling(window=periodo).mean()
-        perdida = -delta.where(delta < 0, 0).rolling(window=periodo).mean()
-        
-        # RSI
-        rs = ganancia / perdida
-        rsi = 100 - (100 / (1 + rs))
-        
-        return round(rsi.iloc[-1], 1)
-    except:
-        return None
+def fragmento(funcion):
+    """`st.fragment`: los widgets de la función solo relanzan la función, no la app entera.
+    
+    Si el fragmento muta el historial o el portfolio (`marcar_cambio`), al terminar se
+    relanza la app completa para que el sidebar y las demás vistas no queden desfasados.
+    """
+    @st.fragment
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        antes = _versiones()
+        funcion(*args, **kwargs)
+        if _versiones() != antes:
+            st.rerun()
+    return envoltura
 
+def memo_trades(origen, clave, construir):
+    """Valor derivado de los trades de un origen, construido una vez por versión.
+    
+    Todas las pestañas comparten la misma tabla/DataFrame dentro de un rerun y entre
+    reruns mientras nadie mute los trades.
+    """
+    version = st.session_state.get(f'version_{origen}', 0)
+    memo = st.session_state.get(f'memo_{origen}')
+    if memo is None or memo['version'] != version:
+        memo = st.session_state[f'memo_{origen}'] = {'version': version}
+    if clave not in memo:
+        memo[clave] = construir()
+    return memo[clave]
+
+def obtener_tabla(origen):
+    """TablaTrades memoizada del historial o del portfolio"""
+    def construir():
+        if origen == 'historial':
+            return TablaTrades.desde_dicts(st.session_state['historial_operaciones'])
+        return TablaTrades.desde_dicts(st.session_state['portfolio_forward_test']['trades'])
+    return memo_trades(origen, 'tabla', construir)
 
-def obtener_datos_fundamentales(ticker):
+def obtener_datos_fundamentales(ticker, precio_actual):
     """Obtiene datos fundamentales de Yahoo Finance (alternativa gratuita a TipRanks)"""
     try:
-        stock = yf.Ticker(ticker)
-        
-        # Obtener precio actual desde history (más confiable)
-        hist = stock.history(period="1d")
-        if hist.empty:
-            return None
-        precio_actual = hist['Close'].iloc[-1]
-        
-        # Intentar obtener info (puede fallar)
-        try:
-            info = stock.info
-        except:
-            info = {}
+        # Info desde la caché diaria (puede venir vacía si Yahoo falla)
+        info = info_cacheada(ticker)
         
         # Recomendaciones de analistas
         recomendacion = info.get('recommendationKey', 'hold')
@@ -158,11 +166,12 @@ def obtener_datos_fundamentales(ticker):
             'smart_score_aprox': 5
         }
 
-def crear_grafico_niveles(ticker, precio_actual, entrada, stop_loss, tp1, tp2):
+def crear_grafico_niveles(ticker, precio_actual, entrada, stop_loss, tp1, tp2, hist=None):
     """Crea gráfico visual con niveles de Stop y Take Profit"""
     try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period="3mo")
+        if hist is None:
+            stock = yf.Ticker(ticker)
+            hist = stock.history(period="3mo")
         
         fig = go.Figure()
         
@@ -217,8 +226,8 @@ def crear_grafico_niveles(ticker, precio_actual, entrada, stop_loss, tp1, tp2):
         return None
 
 def agregar_a_historial(ticker, acciones, entrada, stop, tp1, tp2, inversion, riesgo, 
-                        smart_score, upside, recomendacion):
-    """Agrega operación al historial"""
+                        smart_score, upside, recomendacion, **compuertas):
+    """Agrega operación al historial (con el valor de las compuertas técnicas evaluadas)"""
     operacion = {
         'fecha': datetime.now().strftime('%Y-%m-%d %H:%M'),
         'ticker': ticker,
@@ -234,55 +243,53 @@ def agregar_a_historial(ticker, acciones, entrada, stop, tp1, tp2, inversion, ri
         'recomendacion': recomendacion,
         'status': 'Activa',
         'precio_actual': round(entrada, 2),
-        'pl_actual': 0.0
+        'pl_actual': 0.0,
+        **compuertas
     }
     st.session_state['historial_operaciones'].insert(0, operacion)
+    marcar_cambio('historial')
+    return operacion
 
 def actualizar_precios_historial():
-    """Actualiza los precios de operaciones activas"""
-    for op in st.session_state['historial_operaciones']:
-        if op['status'] == 'Activa':
-            try:
-                stock = yf.Ticker(op['ticker'])
-                precio_actual = stock.history(period="1d")['Close'].iloc[-1]
-                op['precio_actual'] = round(precio_actual, 2)
-                
-                # Calcular P/L
-                pl = (precio_actual - op['entrada']) * op['acciones']
-                op['pl_actual'] = round(pl, 2)
-                
-                # Verificar si tocó Stop Loss o Take Profit
-                if precio_actual <= op['stop_loss']:
-                    op['status'] = 'Cerrada (Stop Loss)'
-                    op['pl_actual'] = -op['riesgo']
-                elif precio_actual >= op['tp_1_2']:
-                    op['status'] = 'Cerrada (TP 1:2)'
-                    op['pl_actual'] = op['riesgo'] * 2
-            except:
-                pass
+    """Actualiza los precios de operaciones activas con las barras nuevas desde el último chequeo"""
+    # Las cerradas no vuelven a cambiar: descarga, splits y evaluación solo recorren las activas
+    activas = [op for op in st.session_state['historial_operaciones'] if op['status'] == 'Activa']
+    try:
+        barras = descargar_barras_pendientes(activas)
+    except:
+        return
+    # Splits desde la apertura: niveles y acciones a la escala de las barras nuevas antes de evaluarlas
+    ajustar_trades(activas)
+    for op in activas:
+        if op['ticker'] in barras:
+            # Actualiza P/L y verifica si algún High/Low tocó Stop Loss o Take Profit
+            aplicar_barras_historial(op, *barras[op['ticker']])
+    marcar_cambio('historial')
 
 def calcular_metricas_performance():
-    """Calcula métricas de performance del historial"""
+    """Calcula métricas de performance del historial (memoizadas por versión)"""
     if not st.session_state['historial_operaciones']:
         return None
+    return memo_trades('historial', 'metricas', _calcular_metricas_performance)
+
+def _calcular_metricas_performance():
+    tabla = obtener_tabla('historial')
     
-    df = pd.DataFrame(st.session_state['historial_operaciones'])
-    
-    total_ops = len(df)
-    activas = len(df[df['status'] == 'Activa'])
+    total_ops = len(tabla)
+    activas = int(tabla.activas().sum())
     cerradas = total_ops - activas
     
     if cerradas > 0:
-        df_cerradas = df[df['status'].str.contains('Cerrada')]
-        ganadoras = len(df_cerradas[df_cerradas['pl_actual'] > 0])
-        perdedoras = len(df_cerradas[df_cerradas['pl_actual'] < 0])
+        pl_cerradas = tabla.numerica('pl_actual')[tabla.cerradas()]
+        ganadoras = int((pl_cerradas > 0).sum())
+        perdedoras = int((pl_cerradas < 0).sum())
         win_rate = (ganadoras / cerradas * 100) if cerradas > 0 else 0
         
-        total_ganancia = df_cerradas[df_cerradas['pl_actual'] > 0]['pl_actual'].sum()
-        total_perdida = abs(df_cerradas[df_cerradas['pl_actual'] < 0]['pl_actual'].sum())
+        total_ganancia = pl_cerradas[pl_cerradas > 0].sum()
+        total_perdida = abs(pl_cerradas[pl_cerradas < 0].sum())
         profit_factor = (total_ganancia / total_perdida) if total_perdida > 0 else 0
         
-        pl_total = df_cerradas['pl_actual'].sum()
+        pl_total = pl_cerradas.sum()
     else:
         ganadoras = perdedoras = win_rate = profit_factor = pl_total = 0
     
@@ -297,29 +304,44 @@ def calcular_metricas_performance():
         'pl_total': round(pl_total, 2)
     }
 
-def cargar_portfolio():
-    """Carga el portfolio de forward testing desde JSON"""
-    portfolio_file = 'portfolio_data.json'
-    if os.path.exists(portfolio_file):
-        try:
-            with open(portfolio_file, 'r') as f:
-                data = json.load(f)
-                st.session_state['portfolio_forward_test'] = data
-        except:
-            pass
+def ruta_portfolio_activo():
+    """Archivo del portfolio seleccionado (usuario, nombre) en el sidebar"""
+    return ruta_portfolio(*st.session_state['portfolio_activo'])
 
-def guardar_portfolio():
-    """Guarda el portfolio de forward testing en JSON"""
-    portfolio_file = 'portfolio_data.json'
+def cargar_portfolio():
+    """Carga solo el portfolio seleccionado, y solo si su archivo cambió desde la última carga"""
+    ruta = ruta_portfolio_activo()
     try:
-        with open(portfolio_file, 'w') as f:
-            json.dump(st.session_state['portfolio_forward_test'], f, indent=2)
+        firma = (ruta, firma_archivo(ruta))
+        if st.session_state.get('firma_portfolio') == firma:
+            return
+        data = leer(ruta)
+        st.session_state['portfolio_forward_test'] = data if data is not None else portfolio_vacio()
+        st.session_state['firma_portfolio'] = firma
+        marcar_cambio('portfolio')
     except:
         pass
 
+@contextmanager
+def modificar_portfolio():
+    """Cambio del portfolio seleccionado sobre su versión en disco, bajo su bloqueo.
+    
+    El cambio se aplica a lo que hay en el archivo, no a la copia de la sesión, así que
+    nunca se pisan cierres del streaming, de la API o de otra sesión. Al terminar, la
+    sesión se queda con el resultado.
+    """
+    ruta = ruta_portfolio_activo()
+    with bloqueo(ruta):
+        data = leer(ruta) or portfolio_vacio()
+        yield data
+        escribir_portfolio(ruta, data)
+        st.session_state['firma_portfolio'] = (ruta, firma_archivo(ruta))
+    st.session_state['portfolio_forward_test'] = data
+    marcar_cambio('portfolio')
+
 def agregar_trade_portfolio(ticker, acciones, entrada, stop, tp1, tp2, inversion, 
-                            smart_score, upside, consensus):
-    """Agrega trade al portfolio de forward testing"""
+                            smart_score, upside, consensus, orden=None, **compuertas):
+    """Agrega trade al portfolio de forward testing como orden del broker simulado"""
     if not st.session_state['tracking_portfolio_enabled']:
         return
     
@@ -337,79 +359,145 @@ def agregar_trade_portfolio(ticker, acciones, entrada, stop, tp1, tp2, inversion
         'pl_actual': 0.0,
         'smart_score': smart_score,
         'upside': upside,
-        'consensus': consensus
+        'consensus': consensus,
+        **compuertas
     }
     
-    st.session_state['portfolio_forward_test']['trades'].insert(0, trade)
-    st.session_state['portfolio_forward_test']['capital_actual'] -= inversion
-    guardar_portfolio()
+    with modificar_portfolio() as portfolio:
+        abrir_trade(portfolio, trade, **(orden or {}))
+    return trade
 
-def validar_filtros_tipranks(smart_score, upside, consensus, volumen_relativo=None, rsi=None):
-    """Valida que se cumplan los filtros de TipRanks + Técnicos (Volumen + RSI)"""
-    filtros = {
-        'smart_score': {
-            'pasa': smart_score >= 8,
-            'mensaje': f"Smart Score: {smart_score}/10 {'✅' if smart_score >= 8 else '❌'}"
-        },
-        'upside': {
-            'pasa': upside >= 10,
-            'mensaje': f"Upside: {upside:.1f}% {'✅' if upside >= 10 else '❌ (mínimo 10%)'}"
-        },
-        'consensus': {
-            'pasa': consensus in ['Strong Buy', 'Moderate Buy'],
-            'mensaje': f"Consenso: {consensus} {'✅' if consensus in ['Strong Buy', 'Moderate Buy'] else '❌'}"
-        }
-    }
+def guardar_analisis_tecnico(ticker, precio_actual, stop_calculado, minimo_base, info,
+                             volumen_rel, rsi_actual, datos_fundamentales=None, fecha_asof=None, stops=None):
+    """Guarda en session state el resultado del análisis (en vivo o as-of)"""
+    st.session_state['stops_metodos'] = stops or {}
+    st.session_state['ticker_analizado'] = ticker
+    st.session_state['precio_entrada'] = float(round(precio_actual, 2))
+    st.session_state['stop_loss'] = float(stop_calculado)
+    st.session_state['info_tecnica'] = info
+    st.session_state['minimo_base'] = round(minimo_base, 2)
+    st.session_state['datos_fundamentales'] = datos_fundamentales
+    st.session_state['volumen_relativo'] = volumen_rel
+    st.session_state['rsi_tecnico'] = rsi_actual
+    if fecha_asof is None:
+        st.session_state.pop('fecha_asof', None)
+    else:
+        st.session_state['fecha_asof'] = fecha_asof
+
+def mostrar_analisis_tecnico(precio_actual, minimo_base, stop_calculado, volumen_rel, rsi_actual, info):
+    """Métricas del análisis técnico"""
+    st.markdown("#### 📈 Análisis Técnico")
+    col_t1, col_t2, col_t3, col_t4, col_t5 = st.columns(5)
+    col_t1.metric("💵 Precio Actual", f"${precio_actual:.2f}")
+    col_t2.metric("📉 Soporte 20d", f"${minimo_base:.2f}")
+    col_t3.metric("🛑 Stop Loss", f"${stop_calculado:.2f}")
     
-    # Agregar volumen si está disponible (> 100% = por encima del promedio)
-    if volumen_relativo is not None:
-        volumen_ok = volumen_relativo >= 100
-        filtros['volumen'] = {
-            'pasa': volumen_ok,
-            'mensaje': f"Volumen: {volumen_relativo:.0f}% {'✅' if volumen_ok else '❌ (bajo promedio)'}"
-        }
+    if volumen_rel:
+        vol_emoji = "✅" if volumen_rel >= 100 else "⚠️"
+        col_t4.metric(f"{vol_emoji} Volumen", f"{volumen_rel:.0f}%")
+    else:
+        col_t4.metric("📊 Volumen", "N/A")
     
-    # Agregar RSI si está disponible (30-65 = zona óptima swing)
-    if rsi is not None:
-        rsi_optimo = 30 <= rsi <= 65
-        filtros['rsi'] = {
-            'pasa': rsi_optimo,
-            'mensaje': f"RSI: {rsi:.1f} {'✅' if rsi_optimo else '❌ (óptimo 30-65)'}"
-        }
+    if rsi_actual:
+        rsi_optimo = 30 <= rsi_actual <= 65
+        rsi_emoji = "✅" if rsi_optimo else "⚠️"
+        col_t5.metric(f"{rsi_emoji} RSI (14)", f"{rsi_actual:.1f}")
+    else:
+        col_t5.metric("📊 RSI", "N/A")
     
-    todos_pasan = all(f['pasa'] for f in filtros.values())
-    return filtros, todos_pasan
+    st.caption(f"📅 Datos de {info['dias']} días | Mínimo: {info['fecha_minimo']}")
+
+def actualizar_sombra(sombra):
+    """Registro sombra del análisis en curso: se escribe (como descartado) en cuanto se evalúa
+    y se vuelve a añadir con su id si cambia. Un mismo ticker y día conserva su id en la sesión."""
+    registradas = st.session_state.setdefault('sombras_registradas', {})
+    clave = (sombra['ticker'], sombra['fecha_analisis'])
+    anterior = registradas.get(clave)
+    if anterior is not None:
+        if anterior['decision'] == 'guardada' or dict(sombra, id=anterior['id']) == anterior:
+            st.session_state['sombra_pendiente'] = anterior
+            return
+        sombra['id'] = anterior['id']
+    try:
+        guardar_sombra(sombra)
+        registradas[clave] = sombra
+    except Exception as e:
+        st.warning(f"⚠️ No se pudo registrar el análisis para la eficacia de filtros: {e}")
+    st.session_state['sombra_pendiente'] = sombra
 
 def actualizar_precios_portfolio():
-    """Actualiza los precios del portfolio de forward testing"""
-    for trade in st.session_state['portfolio_forward_test']['trades']:
-        if trade['status'] == 'Activa':
-            try:
-                stock = yf.Ticker(trade['ticker'])
-                precio_actual = stock.history(period="1d")['Close'].iloc[-1]
-                trade['precio_actual'] = round(precio_actual, 2)
-                
-                # Calcular P/L
-                pl = (precio_actual - trade['entrada']) * trade['acciones']
-                trade['pl_actual'] = round(pl, 2)
-                
-                # Verificar si tocó Stop Loss o Take Profit
-                if precio_actual <= trade['stop_loss']:
-                    trade['status'] = 'Cerrada (Stop Loss)'
-                    # Devolver capital menos pérdida
-                    perdida = (trade['entrada'] - precio_actual) * trade['acciones']
-                    capital_recuperado = trade['inversion'] - perdida
-                    st.session_state['portfolio_forward_test']['capital_actual'] += capital_recuperado
-                elif precio_actual >= trade['tp_1_2']:
-                    trade['status'] = 'Cerrada (TP 1:2)'
-                    # Devolver capital más ganancia
-                    ganancia = (precio_actual - trade['entrada']) * trade['acciones']
-                    capital_recuperado = trade['inversion'] + ganancia
-                    st.session_state['portfolio_forward_test']['capital_actual'] += capital_recuperado
-            except:
-                pass
-    
-    guardar_portfolio()
+    """Actualiza el portfolio de forward testing con las barras nuevas desde el último chequeo"""
+    portfolio = st.session_state['portfolio_forward_test']
+    try:
+        barras = descargar_barras_pendientes(portfolio['trades'])
+    except:
+        return
+    # Las barras se descargan fuera del bloqueo; el broker solo procesa lo posterior al
+    # checkpoint de cada trade, así que lo que otro proceso escriba mientras tanto se respeta
+    with modificar_portfolio() as portfolio:
+        # Splits desde la apertura: niveles y acciones a la escala de las barras nuevas antes de evaluarlas
+        ajustes = ajustar_trades(portfolio['trades'])
+        # Órdenes pendientes, salidas parciales y trailing stops contra High/Low de cada barra
+        st.session_state['eventos_broker'] = ajustes + procesar_portfolio(portfolio, barras)
+
+def obtener_motor_alertas(origen, trades):
+    """Motor de alertas de la sesión con los trades activos de un origen indexados.
+    
+    El índice solo se sincroniza cuando cambia la versión de los trades del origen.
+    """
+    clave = f'motor_alertas_{origen}'
+    if clave not in st.session_state:
+        st.session_state[clave] = MotorAlertas()
+    motor = st.session_state[clave]
+    version = st.session_state.get(f'version_{origen}', 0)
+    if st.session_state.get(f'{clave}_version') != version:
+        motor.indice.sincronizar(trades, origen)
+        st.session_state[f'{clave}_version'] = version
+    return motor
+
+def archivo_descarga():
+    """Temporal en disco sin buffer: download_button acepta un io.RawIOBase y lo lee él mismo"""
+    return tempfile.TemporaryFile(buffering=0)
+
+def mostrar_exportacion(trades, nombre_archivo, etiqueta, clave):
+    """Exportación bajo demanda: el archivo solo se genera (por bloques) al pulsar el botón de descarga.
+    
+    `trades` también puede ser una función que los devuelve (solo se llama al exportar).
+    """
+    formato = st.selectbox("Formato", formatos_disponibles(), key=f"formato_{clave}",
+                           label_visibility="collapsed")
+    # Streamlit llama a `generar` al hacer clic, fuera del rerun (no puede usar st.*)
+    generar = lambda: exportar(trades, formato, destino=archivo_descarga())
+    st.download_button(etiqueta, generar, f"{nombre_archivo}.{FORMATOS[formato]['extension']}",
+                       FORMATOS[formato]['mime'], on_click="ignore", use_container_width=True,
+                       key=f"descargar_{clave}")
+
+@st.cache_resource
+def obtener_pipeline_streaming(ruta, fuente, _trades, host='127.0.0.1', puerto=PUERTO_REPLAY):
+    """Pipeline de streaming de un portfolio, compartido por todas las sesiones del proceso.
+    
+    `_trades` (sin hash) solo se usa al crearlo; después se reindexa con `actualizar_trades`.
+    """
+    if fuente == 'Yahoo (websocket)':
+        proveedor = ProveedorYahoo()
+    else:
+        proveedor = ProveedorReplay(host, puerto)
+    pipeline = PipelineCotizaciones(proveedor, al_cerrar=CierreEnArchivo(ruta))
+    pipeline.cargar_trades(_trades)
+    iniciar_en_segundo_plano(pipeline)
+    return pipeline
+
+@fragmento
+def balance_portfolio():
+    """Balance del portfolio en el sidebar (no relee el archivo si no cambió)"""
+    cargar_portfolio()
+    balance = saldo_caja(st.session_state['portfolio_forward_test'])
+    inicial = st.session_state['portfolio_forward_test']['capital_inicial']
+    pl_portfolio = balance - inicial
+    
+    st.metric("Balance Actual", f"${balance:.2f}", 
+             delta=f"${pl_portfolio:.2f}")
+    st.caption(f"Capital inicial: ${inicial:.2f}")
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -428,6 +516,8 @@ with st.sidebar:
     modo_estricto = st.checkbox("Modo Estricto", value=True,
                                help="Bloquea operaciones que no cumplan los filtros de TipRanks")
     st.session_state['modo_estricto_tipranks'] = modo_estricto
+    filtro_regimen = st.checkbox("🌐 Filtro de régimen de mercado", value=False,
+                                help="Exige mercado Alcista o Neutral: SPY vs medias 50/200, amplitud sectorial y VIX")
     
     if modo_estricto:
         st.success("🔒 Filtros activados:\n\n✅ Smart Score ≥ 8\n\n✅ Upside ≥ 10%\n\n✅ Consensus: Buy\n\n✅ Volumen > promedio\n\n✅ RSI 30-65")
@@ -436,28 +526,45 @@ with st.sidebar:
     
     st.write("---")
     st.subheader("💼 Forward Testing")
-    tracking_enabled = st.checkbox("Tracking Portfolio $1000", value=True,
-                                  help="Trackea operaciones aprobadas por TipRanks en portfolio de $1000")
+    tracking_enabled = st.checkbox("Tracking Portfolio", value=True,
+                                  help="Trackea operaciones aprobadas por TipRanks en el portfolio seleccionado")
     st.session_state['tracking_portfolio_enabled'] = tracking_enabled
     
     if tracking_enabled:
-        # Cargar portfolio al inicio
-        cargar_portfolio()
-        balance = st.session_state['portfolio_forward_test']['capital_actual']
-        inicial = st.session_state['portfolio_forward_test']['capital_inicial']
-        pl_portfolio = balance - inicial
+        # Selección de usuario y portfolio (un archivo por portfolio)
+        usuario = st.text_input("👤 Usuario", value=st.session_state['portfolio_activo'][0]).strip() or USUARIO_DEFAULT
+        portfolios_usuario = listar_portfolios(usuario) or [PORTFOLIO_DEFAULT]
+        nombre_actual = st.session_state['portfolio_activo'][1]
+        nombre_portfolio = st.selectbox("📁 Portfolio", portfolios_usuario,
+                                        index=portfolios_usuario.index(nombre_actual) if nombre_actual in portfolios_usuario else 0)
+        st.session_state['portfolio_activo'] = (usuario, nombre_portfolio)
+        
+        with st.expander("➕ Nuevo portfolio"):
+            nuevo_nombre = st.text_input("Nombre (usuario o estrategia)", key="nuevo_portfolio_nombre")
+            nuevo_capital = st.number_input("Capital inicial ($)", value=CAPITAL_INICIAL_DEFAULT,
+                                            step=100.0, min_value=100.0, key="nuevo_portfolio_capital")
+            if st.button("Crear portfolio", disabled=not nuevo_nombre.strip()):
+                try:
+                    ruta_nueva = crear_portfolio(usuario, nuevo_nombre, nuevo_capital)
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                else:
+                    st.session_state['portfolio_activo'] = (usuario, os.path.basename(ruta_nueva)[:-5])
+                    st.rerun()
         
-        st.metric("Balance Actual", f"${balance:.2f}", 
-                 delta=f"${pl_portfolio:.2f}")
-        st.caption(f"Capital inicial: ${inicial:.2f}")
+        balance_portfolio()
     
     st.write("---")
     st.subheader("🔄 Auto-actualización")
     auto_refresh = st.checkbox("Actualizar precios cada 5 min", value=False,
                               help="Actualiza automáticamente los precios de operaciones activas")
     
+    fases_texto = {'sesion': "🟢 Sesión abierta", 'pre': "🌅 Pre-mercado", 'post': "🌆 After-hours",
+                   'noche': "🌙 Mercado cerrado", 'cerrado': "⛔ Fin de semana / festivo"}
+    st.caption(f"NYSE: {fases_texto[fase_mercado()]} | Última barra definitiva: {ultima_sesion_final()}")
+    
     if auto_refresh:
-        st.info("🔄 Auto-actualización activada")
+        st.info(f"🔄 Auto-actualización activada (próxima en {segundos_hasta_refresco() // 60} min)")
         # Trigger para auto-refresh
         if st.button("🔄 Actualizar Ahora"):
             with st.spinner("Actualizando precios..."):
@@ -467,17 +574,81 @@ with st.sidebar:
             st.success("✅ Precios actualizados")
             st.rerun()
     
+    if st.button("🔥 Precalentar caché",
+                 help=f"Carga barras, fundamentales e indicadores de {ARCHIVO_WATCHLIST} y de los trades activos"):
+        with st.spinner("Precalentando caché..."):
+            st.session_state['informe_precalentado'] = formatear_informe(precalentar(tickers_a_precalentar()))
+    if 'informe_precalentado' in st.session_state:
+        with st.expander("📋 Último precalentado"):
+            st.code(st.session_state['informe_precalentado'])
+    
+    with st.expander("🗄️ Caché compartida"):
+        estadisticas = CACHE.estadisticas()
+        total = estadisticas['total']
+        tasa = f"{total['tasa_aciertos']:.0%}" if total['tasa_aciertos'] is not None else "-"
+        st.caption(f"{total['entradas']} entradas, {total['bytes'] / 2**20:.1f} de "
+                   f"{total['limite_bytes'] / 2**20:.0f} MB · {tasa} servido sin descargar")
+        if estadisticas['espacios']:
+            st.dataframe(pd.DataFrame(estadisticas['espacios']).T[
+                ['aciertos', 'agrupadas', 'fallos', 'caducadas', 'desalojos', 'errores', 'entradas']],
+                use_container_width=True)
+    
+    streaming_activo = st.checkbox("📡 Modo streaming (Stop/TP en vivo)", value=False,
+                                  help="Evalúa Stop Loss y TP 1:2 del portfolio con cada cotización recibida")
+    if streaming_activo and st.session_state['tracking_portfolio_enabled']:
+        fuente_streaming = st.selectbox("Fuente de cotizaciones", ["Yahoo (websocket)", "Replay local"])
+        puerto_replay = PUERTO_REPLAY
+        if fuente_streaming == "Replay local":
+            puerto_replay = st.number_input("Puerto replay", value=PUERTO_REPLAY, step=1)
+        try:
+            trades_streaming = [dict(t) for t in st.session_state['portfolio_forward_test']['trades']]
+            pipeline = obtener_pipeline_streaming(ruta_portfolio_activo(), fuente_streaming, trades_streaming,
+                                                  puerto=int(puerto_replay))
+            # Otro portfolio u otra fuente: el pipeline anterior deja de cerrar trades
+            anterior = st.session_state.get('pipeline_streaming')
+            if anterior is not None and anterior is not pipeline:
+                anterior.detener()
+            st.session_state['pipeline_streaming'] = pipeline
+            pipeline.actualizar_trades(trades_streaming)
+            stats = pipeline.estadisticas()
+            p95 = f"{stats['latencia_p95_ms']:.1f} ms" if stats['latencia_p95_ms'] is not None else "N/A"
+            st.caption(f"📡 {stats['ticks']} ticks | {stats['cierres']} cierres | p95 tick→cierre: {p95}")
+        except Exception as e:
+            st.error(f"❌ No se pudo iniciar el streaming: {e}")
+    elif st.session_state.get('pipeline_streaming') is not None:
+        # Streaming o tracking desactivado: se para el hilo y se descarta el pipeline compartido
+        st.session_state.pop('pipeline_streaming').detener()
+        obtener_pipeline_streaming.clear()
+    
+    st.write("---")
+    st.subheader("🔔 Alertas")
+    alertas_toast = st.checkbox("Mostrar como notificación", value=False,
+                               help="Muestra las alertas como toast en lugar de en la página")
+    sinks_alertas = [SinkUI(toast=alertas_toast)]
+    if st.checkbox("Registrar en alertas.log", value=False):
+        sinks_alertas.append(SinkLog())
+    if st.checkbox("Enviar a webhook", value=False,
+                   help="POST JSON con cada alerta nueva (ejecuta `python alertas.py` para el webhook local)"):
+        webhook_url = st.text_input("URL del webhook", value=WEBHOOK_LOCAL_URL)
+        sinks_alertas.append(SinkWebhook(webhook_url))
+    
     st.write("---")
     st.subheader("📊 Método Stop Loss")
-    st.success("**Soporte 20 Días**\n\n✅ Mínimo 4 semanas\n\n✅ Colchón 2%\n\n✅ Ideal Swing Trading")
+    nombres_stop = nombres_metodos()
+    metodo_stop = st.selectbox("Método", list(nombres_stop), format_func=nombres_stop.get,
+                               index=list(nombres_stop).index(METODO_DEFAULT), key="metodo_stop")
+    st.success(f"**{nombres_stop[metodo_stop]}**\n\n✅ {METODOS_STOP[metodo_stop]['descripcion']}")
     
     ajuste_manual = st.checkbox("🔧 Ajuste manual del Stop", value=False)
 
 # --- TABS PRINCIPALES ---
-tab1, tab2, tab3, tab4 = st.tabs(["🩸 Nueva Operación", "📊 Historial", "📈 Dashboard", "💼 Portfolio $1000"])
+# Con on_change="rerun" cada pestaña sabe si está visible (.open) y las ocultas no se ejecutan
+tab1, tab2, tab3, tab4 = st.tabs(["🩸 Nueva Operación", "📊 Historial", "📈 Dashboard", "💼 Portfolio"],
+                                 key="pestana_activa", on_change="rerun")
 
 # ==================== TAB 1: NUEVA OPERACIÓN ====================
-with tab1:
+@fragmento
+def vista_operacion():
     st.title("🩸 Swing Lab | Análisis Completo")
     
     # --- BÚSQUEDA Y ANÁLISIS AUTOMÁTICO ---
@@ -485,73 +656,101 @@ with tab1:
     
     col_tick, col_btn = st.columns([3, 1])
     with col_tick:
-        ticker = st.text_input("Símbolo (Ticker)", value="MSFT", max_chars=10).upper()
+        ticker = st.text_input("Símbolo (Ticker)", max_chars=10, key="ticker_input").strip().upper()
+    
+    # Validación y autocompletado contra el índice local de símbolos (sin red)
+    ticker_valido, detalle_ticker = validar_ticker(ticker) if ticker else (False, [])
+    if ticker_valido and detalle_ticker:
+        st.caption(f"🏢 {detalle_ticker['nombre']} · {detalle_ticker['exchange']}"
+                   + (f" · {detalle_ticker['sector']}" if detalle_ticker['sector'] else ""))
+    elif ticker and not ticker_valido:
+        # El índice solo tiene los listados de EE. UU.: se avisa pero se puede analizar igual
+        st.warning(f"⚠️ '{ticker}' no está en el índice de símbolos (si es de otro mercado, "
+                   f"p. ej. SAP.DE o ^VIX, se puede analizar igual)")
+        if detalle_ticker:
+            def elegir_ticker(simbolo):
+                st.session_state['ticker_input'] = simbolo
+            cols_sugerencias = st.columns(len(detalle_ticker))
+            for col_sugerencia, sugerencia in zip(cols_sugerencias, detalle_ticker):
+                col_sugerencia.button(sugerencia['ticker'], help=sugerencia['nombre'],
+                                      key=f"sugerencia_{sugerencia['ticker']}",
+                                      on_click=elegir_ticker, args=(sugerencia['ticker'],))
+    
+    modo_asof = st.checkbox("🕰️ Modo as-of (analizar en una fecha pasada)", value=False,
+                            help="Evalúa soporte, volumen, RSI, tamaño y gráfico con las barras hasta la fecha elegida")
     
     analizar = False
     with col_btn:
         st.write("")
         st.write("")
-        analizar = st.button("🔎 ANALIZAR TODO", use_container_width=True, type="primary")
+        analizar = st.button("🔎 ANALIZAR TODO", use_container_width=True, type="primary",
+                             disabled=modo_asof or not ticker)
+    
+    if modo_asof and ticker:
+        # Barras de la caché local (una descarga al día); cada fecha se evalúa en memoria
+        historico = None
+        try:
+            historico = analisis_historico(ticker)
+        except Exception as e:
+            st.caption(f"Detalles técnicos: {str(e)}")
+        
+        if historico is None or len(historico.fechas) < 2:
+            st.error(f"❌ No hay barras históricas para '{ticker}'")
+        else:
+            fechas_disponibles = list(historico.fechas)
+            fecha_asof = st.select_slider("📅 Fecha de análisis", options=fechas_disponibles,
+                                          value=fechas_disponibles[-1], key=f"fecha_asof_{ticker}")
+            resultado = historico.evaluar(fecha_asof, metodo_stop)
+            guardar_analisis_tecnico(ticker, resultado['precio'], resultado['stop_loss'] or 0.0,
+                                     resultado['minimo_base'], resultado['info'],
+                                     resultado['volumen_relativo'], resultado['rsi'],
+                                     fecha_asof=resultado['fecha'], stops=resultado['stops'])
+            st.success(f"🕰️ Análisis de {ticker} al cierre del {resultado['fecha']}")
+            mostrar_analisis_tecnico(resultado['precio'], resultado['minimo_base'], resultado['stop_loss'] or 0.0,
+                                     resultado['volumen_relativo'], resultado['rsi'], resultado['info'])
+    elif st.session_state.get('fecha_asof'):
+        # Al salir del modo as-of se descarta el análisis retrospectivo
+        for clave in ['ticker_analizado', 'fecha_asof', 'posicion_calculada']:
+            st.session_state.pop(clave, None)
     
     if analizar:
         try:
             with st.spinner(f"🔎 Analizando {ticker} (Fundamentales + Técnico)..."):
-                stock = yf.Ticker(ticker)
-                
-                # 1. Obtener precio actual primero
-                hist_actual = stock.history(period="1d")
+                # Barras e indicadores salen de la caché local (precalentar.py la deja lista);
+                # en sesión se les añade la barra de hoy
+                historico = analisis_historico(ticker, en_curso=True)
                 
-                if hist_actual.empty:
+                if historico is None:
                     st.error(f"❌ No se encontró el ticker '{ticker}'. Verifica que sea correcto.")
                 else:
-                    precio_actual = hist_actual['Close'].iloc[-1]
+                    resultado = historico.evaluar(datetime.now().strftime('%Y-%m-%d'), metodo_stop)
                     
-                    # 2. Calcular Stop Loss técnico (siempre funciona)
-                    stop_calculado, minimo_base, info = calcular_stop_loss_soporte_20d(stock, precio_actual)
+                    # 1. Precio actual: única petición en vivo (si falla, último cierre cacheado)
+                    precio_actual = precio_en_vivo(ticker) or resultado['precio']
                     
-                    # 3. Calcular volumen relativo
-                    volumen_rel, volumen_actual = calcular_volumen_relativo(stock)
+                    # 2. Stop Loss técnico (soporte 20d)
+                    stop_calculado, minimo_base, info = resultado['stop_loss'], resultado['minimo_base'], resultado['info']
                     
-                    # 4. Calcular RSI
-                    rsi_actual = calcular_rsi(stock, periodo=14)
+                    # 3. Volumen relativo
+                    volumen_rel = resultado['volumen_relativo']
+                    
+                    # 4. RSI
+                    rsi_actual = resultado['rsi']
                     
                     # 5. Obtener datos fundamentales (puede fallar, usamos valores por defecto)
-                    datos_fundamentales = obtener_datos_fundamentales(ticker)
+                    datos_fundamentales = obtener_datos_fundamentales(ticker, precio_actual)
                     
                     if stop_calculado and minimo_base and datos_fundamentales:
                         # Guardar en session state
-                        st.session_state['ticker_analizado'] = ticker
-                        st.session_state['precio_entrada'] = float(round(precio_actual, 2))
-                        st.session_state['stop_loss'] = float(stop_calculado)
-                        st.session_state['info_tecnica'] = info
-                        st.session_state['minimo_base'] = round(minimo_base, 2)
-                        st.session_state['datos_fundamentales'] = datos_fundamentales
-                        st.session_state['volumen_relativo'] = volumen_rel
-                        st.session_state['rsi_tecnico'] = rsi_actual
+                        guardar_analisis_tecnico(ticker, precio_actual, stop_calculado, minimo_base, info,
+                                                 volumen_rel, rsi_actual, datos_fundamentales,
+                                                 stops=resultado['stops'])
                         
                         st.success(f"✅ Análisis técnico completado para {ticker}")
                         
                         # Mostrar resultados técnicos
-                        st.markdown("#### 📈 Análisis Técnico")
-                        col_t1, col_t2, col_t3, col_t4, col_t5 = st.columns(5)
-                        col_t1.metric("💵 Precio Actual", f"${precio_actual:.2f}")
-                        col_t2.metric("📉 Soporte 20d", f"${minimo_base:.2f}")
-                        col_t3.metric("🛑 Stop Loss", f"${stop_calculado:.2f}")
-                        
-                        if volumen_rel:
-                            vol_emoji = "✅" if volumen_rel >= 100 else "⚠️"
-                            col_t4.metric(f"{vol_emoji} Volumen", f"{volumen_rel:.0f}%")
-                        else:
-                            col_t4.metric("📊 Volumen", "N/A")
-                        
-                        if rsi_actual:
-                            rsi_optimo = 30 <= rsi_actual <= 65
-                            rsi_emoji = "✅" if rsi_optimo else "⚠️"
-                            col_t5.metric(f"{rsi_emoji} RSI (14)", f"{rsi_actual:.1f}")
-                        else:
-                            col_t5.metric("📊 RSI", "N/A")
-                        
-                        st.caption(f"📅 Datos de {info['dias']} días | Mínimo: {info['fecha_minimo']}")
+                        mostrar_analisis_tecnico(precio_actual, minimo_base, stop_calculado,
+                                                 volumen_rel, rsi_actual, info)
                         
                     else:
                         st.error(f"❌ Error al calcular el Stop Loss. Verifica el ticker.")
@@ -562,308 +761,421 @@ with tab1:
     
     # --- PARÁMETROS Y CÁLCULO ---
     if 'ticker_analizado' in st.session_state:
-        st.markdown("---")
-        
-        # MANUAL TIPRANKS INPUT (PERSISTENTE)
-        st.markdown("### 📊 Datos de TipRanks (Entrada Manual)")
-        st.info("💡 Busca **" + st.session_state['ticker_analizado'] + "** en TipRanks.com e ingresa los datos:")
-        
-        col_tr1, col_tr2, col_tr3, col_tr4 = st.columns(4)
-        
-        with col_tr1:
-            smart_score_manual = st.number_input("Smart Score (1-10)", 
-                                                min_value=1, max_value=10, value=5,
-                                                key="smart_score_input",
-                                                help="Busca el Smart Score en TipRanks")
-        
-        with col_tr2:
-            price_target_manual = st.number_input("Price Target ($)", 
-                                                 value=float(st.session_state['precio_entrada'] * 1.1),
-                                                 step=1.0,
-                                                 key="price_target_input",
-                                                 help="Average Price Target de TipRanks")
-        
-        with col_tr3:
-            # Calcular upside automáticamente
-            precio_actual = st.session_state['precio_entrada']
-            upside_calculado = ((price_target_manual - precio_actual) / precio_actual) * 100
-            st.metric("Upside Calculado", f"{upside_calculado:.1f}%")
-        
-        with col_tr4:
-            consensus_manual = st.selectbox("Consenso",
-                                           ["Strong Buy", "Moderate Buy", "Hold", 
-                                            "Moderate Sell", "Strong Sell"],
-                                           index=1,
-                                           key="consensus_input",
-                                           help="Consenso de analistas en TipRanks")
-        
-        # Validar filtros TipRanks + Volumen + RSI
-        volumen_rel = st.session_state.get('volumen_relativo', None)
-        rsi_tecnico = st.session_state.get('rsi_tecnico', None)
-        filtros, todos_pasan = validar_filtros_tipranks(smart_score_manual, upside_calculado, consensus_manual, volumen_rel, rsi_tecnico)
-        
-        st.markdown("---")
-        st.markdown("#### ✅ Validación de Filtros (TipRanks + Técnicos)")
-        
-        # Determinar número de columnas según filtros disponibles
-        num_filtros = 3 + ('volumen' in filtros) + ('rsi' in filtros)
-        cols = st.columns(num_filtros)
+        # Fragmento propio: teclear en TipRanks o en el cálculo no relanza el análisis
+        seccion_operacion()
+    else:
+        st.info("👆 Ingresa un ticker y presiona ANALIZAR TODO")
+
+@fragmento
+def seccion_operacion():
+    """Datos de TipRanks, validación de filtros, cálculo de posición y guardado"""
+    # --- MULTI-TEMPORALIDAD (una descarga intradía, resto remuestreado) ---
+    if not st.session_state.get('fecha_asof') and st.checkbox("⏱️ Multi-temporalidad (confirmación semanal + timing intradía)",
+                                                               value=False, key="multi_temporalidad"):
+        intervalo_base = st.radio("Granularidad descargada", list(INTERVALOS_BASE),
+                                  index=list(INTERVALOS_BASE).index(INTERVALO_BASE_DEFAULT), horizontal=True,
+                                  format_func=lambda i: f"{ETIQUETAS[i]} ({INTERVALOS_BASE[i]})",
+                                  key="intervalo_base_tf")
+        try:
+            df_temporalidades = analizar_temporalidades(st.session_state['ticker_analizado'], intervalo_base)
+        except Exception:
+            df_temporalidades = None
         
-        # Mostrar filtros básicos
-        with cols[0]:
-            if filtros['smart_score']['pasa']:
-                st.success(filtros['smart_score']['mensaje'])
+        if df_temporalidades is None or df_temporalidades.empty:
+            st.warning("⚠️ No hay barras intradía para este ticker")
+        else:
+            cols_tf = st.columns(len(df_temporalidades))
+            for col_tf, fila in zip(cols_tf, df_temporalidades.to_dict('records')):
+                with col_tf:
+                    tendencia = {'Alcista': "⬆️ Alcista", 'Bajista': "⬇️ Bajista"}.get(fila['tendencia'], "N/A")
+                    st.markdown(f"**{fila['temporalidad']}** · {tendencia}")
+                    st.metric("💵 Cierre", f"${fila['cierre']:.2f}")
+                    st.metric("📉 Soporte 20", f"${fila['soporte']:.2f}")
+                    st.metric("📊 Volumen", f"{fila['volumen_relativo']:.0f}%" if fila['volumen_relativo'] else "N/A")
+                    st.metric("📈 RSI (14)", f"{fila['rsi']:.1f}" if fila['rsi'] is not None else "N/A")
+            st.caption(f"Una sola descarga de {ETIQUETAS[intervalo_base]}; las demás temporalidades se remuestrean localmente")
+    
+    st.markdown("---")
+    
+    # MANUAL TIPRANKS INPUT (PERSISTENTE)
+    st.markdown("### 📊 Datos de TipRanks (Entrada Manual)")
+    st.info("💡 Busca **" + st.session_state['ticker_analizado'] + "** en TipRanks.com e ingresa los datos:")
+    
+    col_tr1, col_tr2, col_tr3, col_tr4 = st.columns(4)
+    
+    with col_tr1:
+        smart_score_manual = st.number_input("Smart Score (1-10)", 
+                                            min_value=1, max_value=10, value=5,
+                                            key="smart_score_input",
+                                            help="Busca el Smart Score en TipRanks")
+    
+    with col_tr2:
+        price_target_manual = st.number_input("Price Target ($)", 
+                                             value=float(st.session_state['precio_entrada'] * 1.1),
+                                             step=1.0,
+                                             key="price_target_input",
+                                             help="Average Price Target de TipRanks")
+    
+    with col_tr3:
+        # Calcular upside automáticamente
+        precio_actual = st.session_state['precio_entrada']
+        upside_calculado = ((price_target_manual - precio_actual) / precio_actual) * 100
+        st.metric("Upside Calculado", f"{upside_calculado:.1f}%")
+    
+    with col_tr4:
+        consensus_manual = st.selectbox("Consenso",
+                                       ["Strong Buy", "Moderate Buy", "Hold", 
+                                        "Moderate Sell", "Strong Sell"],
+                                       index=1,
+                                       key="consensus_input",
+                                       help="Consenso de analistas en TipRanks")
+    
+    # Validar filtros TipRanks + Volumen + RSI
+    volumen_rel = st.session_state.get('volumen_relativo', None)
+    rsi_tecnico = st.session_state.get('rsi_tecnico', None)
+    regimen = None
+    if filtro_regimen:
+        # Calculado una vez por sesión; en modo as-of, el régimen de esa fecha
+        try:
+            if st.session_state.get('fecha_asof'):
+                regimen = regimen_en(st.session_state['fecha_asof'])
             else:
-                st.error(filtros['smart_score']['mensaje'])
-        
-        with cols[1]:
-            if filtros['upside']['pasa']:
-                st.success(filtros['upside']['mensaje'])
+                regimen = regimen_mercado()
+        except Exception:
+            regimen = None
+        if regimen is None:
+            st.caption("🌐 Régimen de mercado no disponible (sin barras de SPY)")
+        else:
+            dato = lambda v, sufijo='': 'N/A' if v is None else f"{v}{sufijo}"
+            st.caption(f"🌐 SPY {dato(regimen['spy'])} | SMA50 {dato(regimen['spy_sma50'])} | "
+                       f"SMA200 {dato(regimen['spy_sma200'])} | Amplitud {dato(regimen['amplitud_pct'], '%')} | "
+                       f"VIX {dato(regimen['vix'])} ({regimen['fecha']})")
+    filtros, todos_pasan = validar_filtros_tipranks(smart_score_manual, upside_calculado, consensus_manual,
+                                                    volumen_rel, rsi_tecnico, regimen)
+    # Todas las compuertas quedan registradas, se guarde o no la operación (solo análisis en vivo:
+    # los datos de TipRanks son los de hoy, no los de la fecha as-of)
+    if not st.session_state.get('fecha_asof'):
+        actualizar_sombra(registro_sombra(
+            st.session_state['ticker_analizado'], datetime.now().date(), st.session_state['precio_entrada'],
+            st.session_state['stop_loss'], smart_score_manual, upside_calculado, consensus_manual,
+            volumen_rel, rsi_tecnico, regimen['regimen'] if regimen else None, todos_pasan))
+    
+    st.markdown("---")
+    st.markdown("#### ✅ Validación de Filtros (TipRanks + Técnicos)")
+    
+    # Determinar número de columnas según filtros disponibles
+    num_filtros = 3 + ('volumen' in filtros) + ('rsi' in filtros) + ('regimen' in filtros)
+    cols = st.columns(num_filtros)
+    
+    # Mostrar filtros básicos
+    with cols[0]:
+        if filtros['smart_score']['pasa']:
+            st.success(filtros['smart_score']['mensaje'])
+        else:
+            st.error(filtros['smart_score']['mensaje'])
+    
+    with cols[1]:
+        if filtros['upside']['pasa']:
+            st.success(filtros['upside']['mensaje'])
+        else:
+            st.error(filtros['upside']['mensaje'])
+    
+    with cols[2]:
+        if filtros['consensus']['pasa']:
+            st.success(filtros['consensus']['mensaje'])
+        else:
+            st.error(filtros['consensus']['mensaje'])
+    
+    # Mostrar volumen si existe
+    col_idx = 3
+    if 'volumen' in filtros:
+        with cols[col_idx]:
+            if filtros['volumen']['pasa']:
+                st.success(filtros['volumen']['mensaje'])
             else:
-                st.error(filtros['upside']['mensaje'])
-        
-        with cols[2]:
-            if filtros['consensus']['pasa']:
-                st.success(filtros['consensus']['mensaje'])
+                st.error(filtros['volumen']['mensaje'])
+        col_idx += 1
+    
+    # Mostrar RSI si existe
+    if 'rsi' in filtros:
+        with cols[col_idx]:
+            if filtros['rsi']['pasa']:
+                st.success(filtros['rsi']['mensaje'])
             else:
-                st.error(filtros['consensus']['mensaje'])
-        
-        # Mostrar volumen si existe
-        col_idx = 3
-        if 'volumen' in filtros:
-            with cols[col_idx]:
-                if filtros['volumen']['pasa']:
-                    st.success(filtros['volumen']['mensaje'])
-                else:
-                    st.error(filtros['volumen']['mensaje'])
-            col_idx += 1
-        
-        # Mostrar RSI si existe
-        if 'rsi' in filtros:
-            with cols[col_idx]:
-                if filtros['rsi']['pasa']:
-                    st.success(filtros['rsi']['mensaje'])
-                else:
-                    st.error(filtros['rsi']['mensaje'])
+                st.error(filtros['rsi']['mensaje'])
+        col_idx += 1
+    
+    # Mostrar régimen de mercado si está activado
+    if 'regimen' in filtros:
+        with cols[col_idx]:
+            if filtros['regimen']['pasa']:
+                st.success(filtros['regimen']['mensaje'])
+            else:
+                st.error(filtros['regimen']['mensaje'])
+    
+    # Mensaje final de validación
+    if todos_pasan:
+        st.success("✅ **¡Acción APROBADA por todos los filtros de TipRanks!**")
+        # Guardar datos de TipRanks en session state
+        st.session_state['tipranks_data'] = {
+            'smart_score': smart_score_manual,
+            'price_target': price_target_manual,
+            'upside': upside_calculado,
+            'consensus': consensus_manual
+        }
+    else:
+        st.warning("⚠️ **La acción NO cumple todos los criterios de TipRanks**")
         
-        # Mensaje final de validación
-        if todos_pasan:
-            st.success("✅ **¡Acción APROBADA por todos los filtros de TipRanks!**")
-            # Guardar datos de TipRanks en session state
-            st.session_state['tipranks_data'] = {
-                'smart_score': smart_score_manual,
-                'price_target': price_target_manual,
-                'upside': upside_calculado,
-                'consensus': consensus_manual
-            }
+        if st.session_state['modo_estricto_tipranks']:
+            st.error("🔒 **Modo Estricto Activado**: No puedes proceder con esta operación")
+            st.info("💡 Desactiva el 'Modo Estricto' en el sidebar si quieres continuar de todos modos")
         else:
-            st.warning("⚠️ **La acción NO cumple todos los criterios de TipRanks**")
+            st.warning("⚠️ Modo permisivo: Puedes continuar bajo tu propio riesgo")
+        
+        # Guardar datos de TipRanks en session state (incluso si no pasan)
+        st.session_state['tipranks_data'] = {
+            'smart_score': smart_score_manual,
+            'price_target': price_target_manual,
+            'upside': upside_calculado,
+            'consensus': consensus_manual
+        }
+    
+    # --- COMPARATIVA DE MÉTODOS DE STOP ---
+    stops_metodos = st.session_state.get('stops_metodos') or {}
+    if stops_metodos:
+        st.markdown("---")
+        st.markdown("#### 🛑 Comparativa de Métodos de Stop")
+        df_stops = comparar_stops(stops_metodos, st.session_state['precio_entrada'])
+        df_stops['Elegido'] = np.where(df_stops['clave'] == metodo_stop, "✅", "")
+        st.dataframe(df_stops.drop(columns='clave'), use_container_width=True, hide_index=True)
+        # El stop sigue al método del sidebar sin repetir el análisis
+        stop_metodo = stops_metodos.get(metodo_stop)
+        if stop_metodo and stop_metodo < st.session_state['precio_entrada']:
+            st.session_state['stop_loss'] = float(stop_metodo)
+        else:
+            st.warning(f"⚠️ {nombres_stop[metodo_stop]} no da un stop válido por debajo del precio")
+    
+    st.markdown("---")
+    st.markdown("### 💊 Cálculo de Posición")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        entrada = st.number_input("💵 Precio Entrada ($)", 
+                                 value=st.session_state['precio_entrada'],
+                                 step=0.01, format="%.2f")
+    
+    with col2:
+        if ajuste_manual:
+            stop_loss = st.number_input("🛑 Stop Loss ($)", 
+                                       value=st.session_state['stop_loss'],
+                                       step=0.01, format="%.2f")
+        else:
+            stop_loss = st.session_state['stop_loss']
+            st.metric("🛑 Stop Loss", f"${stop_loss:.2f}")
+    
+    with col3:
+        riesgo_por_accion = entrada - stop_loss if entrada > stop_loss else 0
+        st.metric("📏 Riesgo/Acción", f"${riesgo_por_accion:.2f}")
+    
+    if riesgo_por_accion > 0:
+        pct_riesgo = (riesgo_por_accion / entrada) * 100
+        if pct_riesgo > 10:
+            st.warning(f"⚠️ Stop muy lejano: {pct_riesgo:.1f}%")
+        elif pct_riesgo < 2:
+            st.warning(f"⚠️ Stop muy cercano: {pct_riesgo:.1f}%")
+        else:
+            st.success(f"✅ Distancia óptima: {pct_riesgo:.1f}%")
+    
+    st.markdown("<br>", unsafe_allow_html=True)
+    
+    if st.button("💊 CALCULAR POSICIÓN", use_container_width=True, type="primary"):
+        if entrada > 0 and stop_loss > 0 and stop_loss < entrada:
+            # LÍMITE DE POSICIÓN: Máximo 25% del capital por operación (Swing Trading)
+            posicion = calcular_posicion(capital, riesgo_pct, entrada, stop_loss)
+            riesgo_por_accion = posicion['riesgo_por_accion']
+            acciones, inversion, riesgo_real = posicion['acciones'], posicion['inversion'], posicion['riesgo_real']
             
-            if st.session_state['modo_estricto_tipranks']:
-                st.error("🔒 **Modo Estricto Activado**: No puedes proceder con esta operación")
-                st.info("💡 Desactiva el 'Modo Estricto' en el sidebar si quieres continuar de todos modos")
-            else:
-                st.warning("⚠️ Modo permisivo: Puedes continuar bajo tu propio riesgo")
+            if posicion['limite'] == 'capital':
+                st.warning("⚠️ Capital Insuficiente")
+                st.info(f"✂️ Ajustado a {acciones:.2f} acciones")
+            elif posicion['limite'] == 'diversificacion':
+                st.warning(f"⚠️ Posición limitada al 25% del capital (${inversion:.2f})")
+                st.info(f"✂️ Ajustado a {acciones:.2f} acciones para diversificación")
+                st.caption("💡 **Swing Trading:** Máximo 25% por posición permite 4-5 operaciones simultáneas")
             
-            # Guardar datos de TipRanks en session state (incluso si no pasan)
-            st.session_state['tipranks_data'] = {
-                'smart_score': smart_score_manual,
-                'price_target': price_target_manual,
-                'upside': upside_calculado,
-                'consensus': consensus_manual
+            # GUARDAR EN SESSION STATE PARA QUE PERSISTA AL PRESIONAR "GUARDAR"
+            st.session_state['posicion_calculada'] = {
+                'acciones': acciones,
+                'inversion': inversion,
+                'riesgo_real': riesgo_real,
+                'entrada': entrada,
+                'stop_loss': stop_loss
             }
-        
-        st.markdown("---")
-        st.markdown("### 💊 Cálculo de Posición")
-        
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            entrada = st.number_input("💵 Precio Entrada ($)", 
-                                     value=st.session_state['precio_entrada'],
-                                     step=0.01, format="%.2f")
-        
-        with col2:
-            if ajuste_manual:
-                stop_loss = st.number_input("🛑 Stop Loss ($)", 
-                                           value=st.session_state['stop_loss'],
-                                           step=0.01, format="%.2f")
-            else:
-                stop_loss = st.session_state['stop_loss']
-                st.metric("🛑 Stop Loss", f"${stop_loss:.2f}")
-        
-        with col3:
-            riesgo_por_accion = entrada - stop_loss if entrada > stop_loss else 0
-            st.metric("📏 Riesgo/Acción", f"${riesgo_por_accion:.2f}")
-        
-        if riesgo_por_accion > 0:
-            pct_riesgo = (riesgo_por_accion / entrada) * 100
-            if pct_riesgo > 10:
-                st.warning(f"⚠️ Stop muy lejano: {pct_riesgo:.1f}%")
-            elif pct_riesgo < 2:
-                st.warning(f"⚠️ Stop muy cercano: {pct_riesgo:.1f}%")
-            else:
-                st.success(f"✅ Distancia óptima: {pct_riesgo:.1f}%")
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-        
-        if st.button("💊 CALCULAR POSICIÓN", use_container_width=True, type="primary"):
-            if entrada > 0 and stop_loss > 0 and stop_loss < entrada:
-                riesgo_por_accion = entrada - stop_loss
-                acciones_ideales = dinero_en_riesgo / riesgo_por_accion
-                inversion_necesaria = acciones_ideales * entrada
-                
-                # LÍMITE DE POSICIÓN: Máximo 25% del capital por operación (Swing Trading)
-                max_inversion_permitida = capital * 0.25
-                
-                if inversion_necesaria > capital:
-                    st.warning("⚠️ Capital Insuficiente")
-                    acciones = capital / entrada
-                    inversion = capital
-                    riesgo_real = acciones * riesgo_por_accion
-                    st.info(f"✂️ Ajustado a {acciones:.2f} acciones")
-                elif inversion_necesaria > max_inversion_permitida:
-                    # LIMITADO AL 25% DEL CAPITAL
-                    st.warning(f"⚠️ Posición limitada al 25% del capital (${max_inversion_permitida:.2f})")
-                    acciones = max_inversion_permitida / entrada
-                    inversion = max_inversion_permitida
-                    riesgo_real = acciones * riesgo_por_accion
-                    st.info(f"✂️ Ajustado a {acciones:.2f} acciones para diversificación")
-                    st.caption("💡 **Swing Trading:** Máximo 25% por posición permite 4-5 operaciones simultáneas")
-                else:
-                    acciones = acciones_ideales
-                    inversion = inversion_necesaria
-                    riesgo_real = dinero_en_riesgo
-                
-                # GUARDAR EN SESSION STATE PARA QUE PERSISTA AL PRESIONAR "GUARDAR"
-                st.session_state['posicion_calculada'] = {
-                    'acciones': acciones,
-                    'inversion': inversion,
-                    'riesgo_real': riesgo_real,
-                    'entrada': entrada,
-                    'stop_loss': stop_loss
-                }
-                
-                st.markdown("---")
-                st.success(f"✅ **Orden para {st.session_state['ticker_analizado']}**")
-                
-                m1, m2, m3, m4 = st.columns(4)
-                m1.metric("🔢 Acciones", f"{acciones:.2f}")
-                m2.metric("💰 Inversión", f"${inversion:.2f}")
-                m3.metric("⚠️ Riesgo", f"${riesgo_real:.2f}")
-                m4.metric("📊 % Capital", f"{(inversion/capital)*100:.0f}%")
-                
-                # Niveles
-                tp_1_2 = entrada + (riesgo_por_accion * 2)
-                tp_1_3 = entrada + (riesgo_por_accion * 3)
-                ganancia_1_2 = acciones * (tp_1_2 - entrada)
-                ganancia_1_3 = acciones * (tp_1_3 - entrada)
-                
-                # Guardar TPs también en session state
-                st.session_state['posicion_calculada']['tp_1_2'] = tp_1_2
-                st.session_state['posicion_calculada']['tp_1_3'] = tp_1_3
-                
-                st.markdown("### 🎯 Niveles de Salida")
-                df_niveles = pd.DataFrame({
-                    "Nivel": ["🛑 Stop Loss", "🎯 TP 1:2", "🚀 TP 1:3"],
-                    "Precio": [f"${stop_loss:.2f}", f"${tp_1_2:.2f}", f"${tp_1_3:.2f}"],
-                    "P/L": [f"-${riesgo_real:.2f}", f"+${ganancia_1_2:.2f}", f"+${ganancia_1_3:.2f}"],
-                    "% Cuenta": [
-                        f"-{(riesgo_real/capital)*100:.1f}%", 
-                        f"+{(ganancia_1_2/capital)*100:.1f}%",
-                        f"+{(ganancia_1_3/capital)*100:.1f}%"
-                    ]
-                })
-                st.dataframe(df_niveles, use_container_width=True, hide_index=True)
-                
-                # Gráfico
-                st.markdown("### 📈 Visualización de Niveles")
-                fig = crear_grafico_niveles(st.session_state['ticker_analizado'], 
-                                           st.session_state['precio_entrada'],
-                                           entrada, stop_loss, tp_1_2, tp_1_3)
-                if fig:
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                # Para Stock Master
-                st.markdown("---")
-                st.markdown("### 📱 Para Stock Master")
-                col_sm1, col_sm2 = st.columns(2)
-                with col_sm1:
-                    st.code(f"""Symbol: {st.session_state['ticker_analizado']}
+            
+            st.markdown("---")
+            st.success(f"✅ **Orden para {st.session_state['ticker_analizado']}**")
+            
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("🔢 Acciones", f"{acciones:.2f}")
+            m2.metric("💰 Inversión", f"${inversion:.2f}")
+            m3.metric("⚠️ Riesgo", f"${riesgo_real:.2f}")
+            m4.metric("📊 % Capital", f"{(inversion/capital)*100:.0f}%")
+            
+            # Niveles
+            tp_1_2, tp_1_3 = posicion['tp_1_2'], posicion['tp_1_3']
+            ganancia_1_2 = acciones * (tp_1_2 - entrada)
+            ganancia_1_3 = acciones * (tp_1_3 - entrada)
+            
+            # Guardar TPs también en session state
+            st.session_state['posicion_calculada']['tp_1_2'] = tp_1_2
+            st.session_state['posicion_calculada']['tp_1_3'] = tp_1_3
+            
+            st.markdown("### 🎯 Niveles de Salida")
+            df_niveles = pd.DataFrame({
+                "Nivel": ["🛑 Stop Loss", "🎯 TP 1:2", "🚀 TP 1:3"],
+                "Precio": [f"${stop_loss:.2f}", f"${tp_1_2:.2f}", f"${tp_1_3:.2f}"],
+                "P/L": [f"-${riesgo_real:.2f}", f"+${ganancia_1_2:.2f}", f"+${ganancia_1_3:.2f}"],
+                "% Cuenta": [
+                    f"-{(riesgo_real/capital)*100:.1f}%", 
+                    f"+{(ganancia_1_2/capital)*100:.1f}%",
+                    f"+{(ganancia_1_3/capital)*100:.1f}%"
+                ]
+            })
+            st.dataframe(df_niveles, use_container_width=True, hide_index=True)
+            
+            # Gráfico
+            st.markdown("### 📈 Visualización de Niveles")
+            # Barras cacheadas hasta la fecha analizada (hoy o la fecha as-of)
+            historico = analisis_historico(st.session_state['ticker_analizado'],
+                                           en_curso=not st.session_state.get('fecha_asof'))
+            fecha_grafico = st.session_state.get('fecha_asof') or datetime.now().strftime('%Y-%m-%d')
+            fig = crear_grafico_niveles(st.session_state['ticker_analizado'], 
+                                       st.session_state['precio_entrada'],
+                                       entrada, stop_loss, tp_1_2, tp_1_3,
+                                       hist=historico.barras_hasta(fecha_grafico) if historico else None)
+            if fig:
+                st.plotly_chart(fig, use_container_width=True)
+            
+            # Para Stock Master
+            st.markdown("---")
+            st.markdown("### 📱 Para Stock Master")
+            col_sm1, col_sm2 = st.columns(2)
+            with col_sm1:
+                st.code(f"""Symbol: {st.session_state['ticker_analizado']}
 Shares: {acciones:.2f}
 Price: ${entrada:.2f}
 Stop Loss: ${stop_loss:.2f}""")
-                with col_sm2:
-                    st.code(f"""Take Profit 1: ${tp_1_2:.2f}
+            with col_sm2:
+                st.code(f"""Take Profit 1: ${tp_1_2:.2f}
 Take Profit 2: ${tp_1_3:.2f}
 Risk/Reward: 1:2 y 1:3
 Capital: {(inversion/capital)*100:.0f}%""")
-                
-                if riesgo_real <= dinero_en_riesgo * 1.15:
-                    st.success("✅ Operación Aprobada")
-                else:
-                    st.error(f"❌ Riesgo excesivo")
             
-            elif stop_loss >= entrada:
-                st.error("❌ Stop Loss debe ser menor que entrada")
+            if posicion['aprobada']:
+                st.success("✅ Operación Aprobada")
             else:
-                st.warning("⚠️ Completa todos los campos")
+                st.error(f"❌ Riesgo excesivo")
         
-        # BOTÓN GUARDAR FUERA DEL BLOQUE DE CALCULAR (para que persista después del rerun)
-        if 'posicion_calculada' in st.session_state:
-            st.markdown("---")
-            if st.button("💾 GUARDAR EN HISTORIAL", use_container_width=True, key="btn_guardar"):
-                # Obtener valores calculados desde session_state
-                pos = st.session_state['posicion_calculada']
-                
-                # Obtener datos de TipRanks (usar valores por defecto si no existen)
-                if 'tipranks_data' in st.session_state:
-                    tipranks = st.session_state['tipranks_data']
-                else:
-                    # Valores por defecto si no se ingresaron datos de TipRanks
-                    st.warning("⚠️ No ingresaste datos de TipRanks. Se guardarán valores por defecto.")
-                    tipranks = {
-                        'smart_score': 5,
-                        'upside': 0,
-                        'consensus': 'Hold'
-                    }
-                
-                # Guardar en historial normal
-                agregar_a_historial(
-                    st.session_state['ticker_analizado'], 
+        elif stop_loss >= entrada:
+            st.error("❌ Stop Loss debe ser menor que entrada")
+        else:
+            st.warning("⚠️ Completa todos los campos")
+    
+    # BOTÓN GUARDAR FUERA DEL BLOQUE DE CALCULAR (para que persista después del rerun)
+    if 'posicion_calculada' in st.session_state:
+        st.markdown("---")
+        if st.session_state.get('fecha_asof'):
+            st.caption(f"🕰️ Análisis retrospectivo al {st.session_state['fecha_asof']}: no se guarda en historial ni portfolio")
+        # Orden de entrada para el broker simulado del portfolio
+        orden = None
+        if st.session_state['tracking_portfolio_enabled']:
+            entrada_orden = float(st.session_state['posicion_calculada']['entrada'])
+            col_o1, col_o2, col_o3 = st.columns(3)
+            with col_o1:
+                tipo_orden = st.selectbox("📝 Tipo de orden", list(TIPOS_ORDEN),
+                                          format_func=TIPOS_ORDEN.get, key="tipo_orden",
+                                          help="Mercado se ejecuta ya; el resto queda pendiente hasta que las barras la ejecuten")
+            orden = {'tipo': tipo_orden}
+            if tipo_orden in ('stop', 'stop_limite'):
+                with col_o2:
+                    orden['stop'] = st.number_input("Precio stop", value=entrada_orden, step=0.01,
+                                                    format="%.2f", key="precio_stop_orden")
+            if tipo_orden in ('limite', 'stop_limite'):
+                with col_o3:
+                    orden['limite'] = st.number_input("Precio límite", value=entrada_orden, step=0.01,
+                                                      format="%.2f", key="precio_limite_orden")
+        
+        if st.button("💾 GUARDAR EN HISTORIAL", use_container_width=True, key="btn_guardar",
+                     disabled=bool(st.session_state.get('fecha_asof'))):
+            # Obtener valores calculados desde session_state
+            pos = st.session_state['posicion_calculada']
+            
+            # Obtener datos de TipRanks (usar valores por defecto si no existen)
+            if 'tipranks_data' in st.session_state:
+                tipranks = st.session_state['tipranks_data']
+            else:
+                # Valores por defecto si no se ingresaron datos de TipRanks
+                st.warning("⚠️ No ingresaste datos de TipRanks. Se guardarán valores por defecto.")
+                tipranks = {
+                    'smart_score': 5,
+                    'upside': 0,
+                    'consensus': 'Hold'
+                }
+            
+            sombra = st.session_state.get('sombra_pendiente')
+            if sombra is None or sombra['ticker'] != st.session_state['ticker_analizado']:
+                sombra = None
+            compuertas = {k: sombra[k] for k in ('volumen_relativo', 'rsi', 'regimen')} if sombra else {}
+            
+            # Guardar en historial normal
+            operacion = agregar_a_historial(
+                st.session_state['ticker_analizado'], 
+                pos['acciones'], pos['entrada'], pos['stop_loss'], 
+                pos['tp_1_2'], pos['tp_1_3'],
+                pos['inversion'], pos['riesgo_real'], 
+                tipranks['smart_score'],
+                tipranks['upside'],
+                tipranks['consensus'],
+                **compuertas
+            )
+            trade_guardado = None
+            
+            # Guardar en portfolio de forward testing si está habilitado
+            if st.session_state['tracking_portfolio_enabled']:
+                trade_guardado = agregar_trade_portfolio(
+                    st.session_state['ticker_analizado'],
                     pos['acciones'], pos['entrada'], pos['stop_loss'], 
                     pos['tp_1_2'], pos['tp_1_3'],
-                    pos['inversion'], pos['riesgo_real'], 
+                    pos['inversion'],
                     tipranks['smart_score'],
                     tipranks['upside'],
-                    tipranks['consensus']
+                    tipranks['consensus'],
+                    orden,
+                    **compuertas
                 )
-                
-                # Guardar en portfolio de forward testing si está habilitado
-                if st.session_state['tracking_portfolio_enabled']:
-                    agregar_trade_portfolio(
-                        st.session_state['ticker_analizado'],
-                        pos['acciones'], pos['entrada'], pos['stop_loss'], 
-                        pos['tp_1_2'], pos['tp_1_3'],
-                        pos['inversion'],
-                        tipranks['smart_score'],
-                        tipranks['upside'],
-                        tipranks['consensus']
-                    )
-                    st.success(f"✅ Operación guardada en historial y portfolio ($1000)")
-                else:
-                    st.success("✅ Operación guardada en historial")
-                
-                # Limpiar la posición calculada después de guardar
-                del st.session_state['posicion_calculada']
-                st.balloons()
-                st.rerun()
-    
-    else:
-        st.info("👆 Ingresa un ticker y presiona ANALIZAR TODO")
+                st.success(f"✅ Operación guardada en historial y portfolio '{st.session_state['portfolio_activo'][1]}'")
+            else:
+                st.success("✅ Operación guardada en historial")
+            
+            # El registro sombra del análisis queda ligado al trade para medir su resultado real
+            if sombra is not None and sombra['decision'] != 'guardada':
+                sombra.update(decision='guardada', trade=clave_trade(trade_guardado or operacion))
+                try:
+                    guardar_sombra(sombra)
+                except Exception as e:
+                    # Tras el rerun solo sobrevive el toast
+                    st.toast(f"⚠️ No se pudo ligar el análisis al trade: {e}")
+            
+            # Limpiar la posición calculada después de guardar
+            del st.session_state['posicion_calculada']
+            st.balloons()
+            st.rerun()
+
 
 # ==================== TAB 2: HISTORIAL ====================
-with tab2:
+@fragmento
+def vista_historial():
     st.title("📊 Historial de Operaciones")
     
     # Botón de actualización
@@ -875,6 +1187,41 @@ with tab2:
             st.success("✅ Actualizado")
             st.rerun()
     
+    # Importación masiva
+    with st.expander("📤 Importar trades desde CSV"):
+        st.caption("Formato Stock Master (ticker, acciones, entrada, stop_loss, tp_1_2, tp_1_3) o fills de broker (Symbol, Quantity, Price, Side, Date)")
+        archivo_importar = st.file_uploader("Archivo CSV", type=["csv"], key="csv_importar")
+        rellenar_stops = st.checkbox("Rellenar stops faltantes con Soporte 20 Días", value=True)
+        # El resultado se pinta en el rerun completo que sigue a la importación
+        resultado_importacion = st.session_state.pop('resultado_importacion', None)
+        if resultado_importacion:
+            importadas, rechazadas = resultado_importacion
+            st.success(f"✅ {importadas} operaciones importadas")
+            if not rechazadas.empty:
+                st.warning(f"⚠️ {len(rechazadas)} filas rechazadas")
+                st.dataframe(rechazadas[['ticker', 'acciones', 'entrada', 'stop_loss', 'motivo']],
+                             use_container_width=True, hide_index=True)
+        if archivo_importar is not None and st.button("📤 Importar", use_container_width=True):
+            tracking = st.session_state['tracking_portfolio_enabled']
+            capital_disponible = (saldo_caja(st.session_state['portfolio_forward_test'])
+                                  if tracking else capital)
+            try:
+                with st.spinner("Validando e importando..."):
+                    validas, rechazadas = preparar_importacion(archivo_importar, capital_disponible,
+                                                               rellenar_stops)
+                    nuevas_operaciones = []
+                    if tracking:
+                        # Una sola escritura del portfolio; el historial solo se toca si tuvo éxito
+                        with modificar_portfolio() as data:
+                            importadas = aplicar_importacion(validas, nuevas_operaciones, data)
+                    else:
+                        importadas = aplicar_importacion(validas, nuevas_operaciones)
+                    st.session_state['historial_operaciones'][:0] = nuevas_operaciones
+                    marcar_cambio('historial')
+                st.session_state['resultado_importacion'] = (importadas, rechazadas)
+            except Exception as e:
+                st.error(f"❌ Error al importar: {e}")
+    
     if len(st.session_state['historial_operaciones']) == 0:
         st.info("📭 No hay operaciones registradas")
     else:
@@ -891,31 +1238,19 @@ with tab2:
         st.markdown("---")
         
         # Tabla
-        df_historial = pd.DataFrame(st.session_state['historial_operaciones'])
-        
-        # Colorear P/L
-        def colorear_pl(val):
-            color = 'green' if val > 0 else 'red' if val < 0 else 'gray'
-            return f'color: {color}'
-        
-        styled_df = df_historial.style.applymap(colorear_pl, subset=['pl_actual'])
-        
-        st.dataframe(df_historial[[
+        df_historial = memo_trades('historial', 'df_tabla', lambda: obtener_tabla('historial').a_dataframe([
             'fecha', 'ticker', 'acciones', 'entrada', 'precio_actual', 
             'stop_loss', 'tp_1_2', 'pl_actual', 'status'
-        ]], use_container_width=True, hide_index=True)
+        ]))
+        
+        st.dataframe(df_historial, use_container_width=True, hide_index=True)
         
         # Alertas
         st.markdown("### 🔔 Alertas de Precio")
-        for op in st.session_state['historial_operaciones']:
-            if op['status'] == 'Activa':
-                dist_stop = ((op['precio_actual'] - op['stop_loss']) / op['entrada']) * 100
-                dist_tp = ((op['tp_1_2'] - op['precio_actual']) / op['entrada']) * 100
-                
-                if dist_stop < 2:
-                    st.error(f"🚨 **{op['ticker']}** muy cerca del Stop Loss ({dist_stop:.1f}%)")
-                elif dist_tp < 2:
-                    st.success(f"🎯 **{op['ticker']}** muy cerca del TP 1:2 ({dist_tp:.1f}%)")
+        motor = obtener_motor_alertas('historial', st.session_state['historial_operaciones'])
+        precios = memo_trades('historial', 'precios',
+                              lambda: precios_desde_trades(st.session_state['historial_operaciones']))
+        motor.procesar_precios(precios, sinks_alertas)
         
         st.markdown("---")
         col_btn1, col_btn2 = st.columns(2)
@@ -923,15 +1258,16 @@ with tab2:
         with col_btn1:
             if st.button("🗑️ Limpiar Historial", use_container_width=True):
                 st.session_state['historial_operaciones'] = []
+                marcar_cambio('historial')
                 st.rerun()
         
         with col_btn2:
-            csv = df_historial.to_csv(index=False)
-            st.download_button("📥 Descargar CSV", csv, "historial.csv", 
-                             "text/csv", use_container_width=True)
+            mostrar_exportacion(st.session_state['historial_operaciones'], "historial",
+                                "📥 Exportar Historial", "historial")
 
 # ==================== TAB 3: DASHBOARD ====================
-with tab3:
+@fragmento
+def vista_dashboard():
     st.title("📈 Dashboard de Performance")
     
     if len(st.session_state['historial_operaciones']) == 0:
@@ -949,11 +1285,15 @@ with tab3:
         st.markdown("---")
         
         # Gráfico de P/L acumulado
-        df = pd.DataFrame(st.session_state['historial_operaciones'])
-        df_cerradas = df[df['status'].str.contains('Cerrada')].copy()
+        def construir_cerradas():
+            tabla = obtener_tabla('historial')
+            df = tabla.seleccionar(tabla.cerradas()).ordenar_por_fecha().a_dataframe(
+                ['fecha', 'ticker', 'pl_actual'])
+            df['pl_acumulado'] = df['pl_actual'].cumsum()
+            return df
+        df_cerradas = memo_trades('historial', 'df_cerradas', construir_cerradas)
         
         if not df_cerradas.empty:
-            df_cerradas['pl_acumulado'] = df_cerradas['pl_actual'].cumsum()
             
             fig_pl = go.Figure()
             fig_pl.add_trace(go.Scatter(
@@ -1044,14 +1384,54 @@ with tab3:
             analisis_ticker = analisis_ticker.sort_values('P/L Total', ascending=False)
             
             st.dataframe(analisis_ticker, use_container_width=True)
+    
+    # Eficacia de cada compuerta sobre todos los análisis registrados (guardados o no)
+    st.markdown("---")
+    st.markdown("### 🧪 Eficacia de Filtros")
+    sombras = leer_sombras()
+    if sombras.empty:
+        st.info("📭 Aún no hay análisis registrados: cada análisis evaluado en 🩸 Nueva Operación deja uno")
+    else:
+        st.caption(f"{len(sombras)} análisis registrados ({int((sombras['decision'] == 'guardada').sum())} guardados). "
+                   f"Resultado real si el trade ya cerró; si no, backtest de {HORIZONTE_SESIONES} sesiones "
+                   f"contra el Stop y el TP 1:2, en múltiplos del riesgo (R)")
+        if st.button("🧪 Calcular eficacia", key="btn_eficacia"):
+            with st.spinner("Cruzando análisis con resultados..."):
+                trades = st.session_state['historial_operaciones'] + list(todos_los_trades(
+                    ruta_portfolio_activo(), st.session_state['portfolio_forward_test']))
+                st.session_state['informe_eficacia'] = informe_eficacia(
+                    sombras, barras_cacheadas(sombras['ticker'].unique()), trades)
+        informe = st.session_state.get('informe_eficacia')
+        if informe:
+            col_e1, col_e2, col_e3 = st.columns(3)
+            col_e1.metric("Análisis", informe['registros'])
+            col_e2.metric("Con resultado", informe['con_resultado'])
+            col_e3.metric("Resultados reales", informe['reales'])
+            st.markdown("**Umbral actual: los que pasan contra los que no**")
+            st.dataframe(informe['umbral'], use_container_width=True, hide_index=True)
+            filtro = st.selectbox("Tramos de", list(informe['tramos']), format_func=NOMBRES_FILTRO.get,
+                                  key="filtro_eficacia")
+            tabla = informe['tramos'][filtro]
+            if tabla.empty:
+                st.info("Sin registros con este filtro evaluado")
+            else:
+                fig_ef = go.Figure(data=[go.Bar(
+                    x=tabla.index, y=tabla['esperanza_r'], text=tabla['win_rate'].map("{:.0f}%".format),
+                    marker=dict(color=np.where(tabla['esperanza_r'] >= 0, 'green', 'red'))
+                )])
+                fig_ef.update_layout(title=f"Esperanza (R) por tramo de {NOMBRES_FILTRO[filtro]}",
+                                     yaxis_title="R medio", height=300)
+                st.plotly_chart(fig_ef, use_container_width=True)
+                st.dataframe(tabla, use_container_width=True)
 
 # ==================== TAB 4: PORTFOLIO FORWARD TESTING ====================
-with tab4:
-    st.title("💼 Portfolio Forward Testing ($1000)")
+@fragmento
+def vista_portfolio():
+    st.title(f"💼 Portfolio Forward Testing: {st.session_state['portfolio_activo'][1]}")
     
     if not st.session_state['tracking_portfolio_enabled']:
         st.warning("⚠️ El tracking de portfolio está desactivado")
-        st.info("Activa 'Tracking Portfolio $1000' en el sidebar para usar esta función")
+        st.info("Activa 'Tracking Portfolio' en el sidebar para usar esta función")
     else:
         # Cargar portfolio
         cargar_portfolio()
@@ -1062,14 +1442,15 @@ with tab4:
         col_p1, col_p2, col_p3, col_p4 = st.columns(4)
         
         capital_inicial = portfolio['capital_inicial']
-        capital_actual = portfolio['capital_actual']
+        capital_actual = saldo_caja(portfolio)
         pl_total = capital_actual - capital_inicial
         roi = (pl_total / capital_inicial) * 100
         
         col_p1.metric("Capital Inicial", f"${capital_inicial:.2f}")
         col_p2.metric("Capital Actual", f"${capital_actual:.2f}", delta=f"${pl_total:.2f}")
         col_p3.metric("ROI", f"{roi:.1f}%")
-        col_p4.metric("Total Trades", len(portfolio['trades']))
+        archivo = resumen_archivo(portfolio)
+        col_p4.metric("Total Trades", len(portfolio['trades']) + archivo['trades'])
         
         # Botón de actualización
         col_ref1, col_ref2 = st.columns([3, 1])
@@ -1080,56 +1461,115 @@ with tab4:
                 st.success("✅ Portfolio actualizado")
                 st.rerun()
         
+        eventos = st.session_state.pop('eventos_broker', None)
+        if eventos:
+            st.info("🏦 Ejecuciones del broker: " + ", ".join(
+                f"{e['ticker']} {e['evento']} {e['acciones']:g} @ ${e['precio']:.2f} ({e['barra']})" for e in eventos))
+        
+        with st.expander("🏦 Broker simulado (deslizamiento, comisiones, salidas parciales)"):
+            config = config_broker(portfolio)
+            col_b1, col_b2, col_b3 = st.columns(3)
+            nueva_config = {
+                'deslizamiento_pct': col_b1.number_input("Deslizamiento (%)", 0.0, 5.0, float(config['deslizamiento_pct']), 0.01,
+                                                         help="En órdenes a mercado y stops; los límites no deslizan"),
+                'comision_por_accion': col_b2.number_input("Comisión por acción ($)", 0.0, 1.0, float(config['comision_por_accion']), 0.001, format="%.3f"),
+                'comision_minima': col_b3.number_input("Comisión mínima ($)", 0.0, 50.0, float(config['comision_minima']), 0.5),
+                'fraccion_tp1': col_b1.slider("Venta en TP 1:2 (%)", 0, 100, int(config['fraccion_tp1'] * 100), 5,
+                                              help="El resto sale en TP 1:3 o por el trailing stop; 100% = salida completa") / 100,
+                'trailing_r': col_b2.number_input("Trailing tras TP 1:2 (x riesgo)", 0.0, 5.0, float(config['trailing_r']), 0.25,
+                                                  help="0 = sin trailing"),
+                'vigencia_sesiones': col_b3.number_input("Vigencia de órdenes (sesiones)", 0, 60, int(config['vigencia_sesiones']),
+                                                         help="0 = hasta que se ejecute"),
+                'breakeven_tras_tp1': col_b1.checkbox("Stop a break-even tras TP 1:2", value=bool(config['breakeven_tras_tp1'])),
+            }
+            # El aviso se pinta en el rerun completo que sigue al guardado
+            if st.session_state.pop('aviso_broker', False):
+                st.success("✅ Configuración guardada (se aplica a las próximas ejecuciones)")
+            if nueva_config != config and st.button("💾 Guardar configuración del broker"):
+                with modificar_portfolio() as data:
+                    data['broker'] = {k: v for k, v in nueva_config.items() if v != CONFIG_BROKER_DEFAULT[k]}
+                st.session_state['aviso_broker'] = True
+        
+        with st.expander("🧾 Libro de caja"):
+            # Los asientos anteriores al último snapshot están en el archivo frío
+            archivo_libro = functools.partial(asientos_archivados, ruta_portfolio_activo())
+            col_l1, col_l2 = st.columns([1, 2])
+            fecha_saldo = col_l1.date_input("Saldo a fecha", value=datetime.now().date(), key="fecha_saldo_libro")
+            saldos_fecha = saldos(portfolio, fecha_saldo.strftime('%Y-%m-%d'), archivo_libro)
+            col_l1.metric("Caja", f"${saldos_fecha['caja']:.2f}")
+            col_l1.caption(f"Posiciones: ${saldos_fecha['posiciones']:.2f} · Comisiones: ${saldos_fecha['comisiones']:.2f} · "
+                           f"P/L realizado: ${-saldos_fecha['resultados']:.2f}")
+            col_l2.dataframe(pd.DataFrame([{'Fecha': a['fecha'], 'Concepto': a['concepto'], 'Trade': a.get('trade', ''),
+                                            'Caja': round(a['lineas'].get('caja', 0.0), 2)}
+                                           for a in reversed(ultimos_asientos(portfolio, 20, archivo_libro))]),
+                             use_container_width=True, hide_index=True)
+            if st.button("🔍 Conciliar con los trades"):
+                informe = conciliar(portfolio, todos_los_trades(ruta_portfolio_activo(), portfolio), archivo_libro)
+                if informe['cuadra']:
+                    st.success(f"✅ El libro cuadra: caja ${informe['saldo_libro']:.2f} en {informe['asientos']} asientos")
+                else:
+                    st.error(f"❌ Diferencia de ${informe['diferencia']:.2f} entre el libro y los trades")
+                    st.json(informe)
+                if informe['deriva_migracion']:
+                    st.caption(f"Deriva del capital antiguo al migrar: ${informe['deriva_migracion']:.2f}")
+        
         st.markdown("---")
         
         # Lista de trades
-        if len(portfolio['trades']) == 0:
+        if len(portfolio['trades']) == 0 and archivo['trades'] == 0:
             st.info("📭 No hay trades en el portfolio de forward testing")
             st.caption("💡 Las operaciones que apruebes con TipRanks se agregarán automáticamente aquí")
         else:
             st.markdown("### 📋 Trades del Portfolio")
             
-            df_portfolio = pd.DataFrame(portfolio['trades'])
+            # Los cerrados viven en el archivo frío: solo se leen las particiones de los meses del periodo
+            ruta = ruta_portfolio_activo()
+            hoy = datetime.now().date()
+            periodo = st.date_input("Periodo de los trades cerrados", value=(hoy - timedelta(days=365), hoy),
+                                    key="periodo_portfolio")
+            desde, hasta = (f.strftime('%Y-%m-%d') for f in (periodo[0], periodo[-1]))
+            df_cerradas = memo_trades('portfolio', ('cerradas', desde, hasta),
+                                      lambda: cerrados_en_rango(ruta, portfolio, desde, hasta))
+            mascara_cerradas = df_cerradas['status'].astype(str).str.startswith('Cerrada')
+            
+            tabla_portfolio = obtener_tabla('portfolio')
+            mascara_abiertos = np.isin(tabla_portfolio.columna('status'), ESTADOS_ABIERTOS)
             
-            # Calcular métricas
-            activas = len(df_portfolio[df_portfolio['status'] == 'Activa'])
-            cerradas = len(df_portfolio[df_portfolio['status'] != 'Activa'])
+            # Calcular métricas (las órdenes pendientes o canceladas no cuentan como cerradas)
+            activas = int(tabla_portfolio.activas().sum())
+            cerradas = int(mascara_cerradas.sum())
             
             col_m1, col_m2, col_m3 = st.columns(3)
             col_m1.metric("Trades Activos", activas)
-            col_m2.metric("Trades Cerrados", cerradas)
+            archivadas = sum(n for estado, n in archivo['estados'].items() if estado.startswith('Cerrada'))
+            col_m2.metric("Trades Cerrados", cerradas, help=f"En el periodo ({archivadas} archivadas en total)")
             
             if cerradas > 0:
-                df_cerradas = df_portfolio[df_portfolio['status'] != 'Activa']
-                ganadoras = len(df_cerradas[df_cerradas['pl_actual'] > 0])
+                pl_cerradas = pd.to_numeric(df_cerradas['pl_actual'][mascara_cerradas], errors='coerce')
+                ganadoras = int((pl_cerradas > 0).sum())
                 win_rate = (ganadoras / cerradas * 100) if cerradas > 0 else 0
                 col_m3.metric("Win Rate", f"{win_rate:.1f}%")
             
             st.markdown("---")
             
-            # Tabla de trades
-            st.dataframe(df_portfolio[[
-                'fecha', 'ticker', 'acciones', 'entrada', 'precio_actual',
-                'stop_loss', 'tp_1_2', 'pl_actual', 'status',
-                'smart_score', 'upside', 'consensus'
-            ]], use_container_width=True, hide_index=True)
+            # Tabla de trades: abiertos más los cerrados del periodo
+            columnas_tabla = ['fecha', 'ticker', 'acciones', 'acciones_abiertas', 'entrada', 'precio_actual',
+                              'stop_loss', 'tp_1_2', 'tp_1_3', 'pl_actual', 'comisiones', 'status',
+                              'smart_score', 'upside', 'consensus']
+            partes = [tabla_portfolio.seleccionar(mascara_abiertos).a_dataframe(columnas_tabla),
+                      df_cerradas.assign(fecha=pd.to_datetime(df_cerradas['fecha'], format='%Y-%m-%d %H:%M',
+                                                              errors='coerce')).reindex(columns=columnas_tabla)]
+            df_tabla = pd.concat([p for p in partes if not p.empty] or partes[:1], ignore_index=True)
+            st.dataframe(df_tabla.sort_values('fecha', ascending=False, kind='stable'),
+                         use_container_width=True, hide_index=True)
             
             # Alertas
             st.markdown("### 🔔 Alertas de Precio (Portfolio)")
-            alertas_encontradas = False
-            for trade in portfolio['trades']:
-                if trade['status'] == 'Activa':
-                    dist_stop = ((trade['precio_actual'] - trade['stop_loss']) / trade['entrada']) * 100
-                    dist_tp = ((trade['tp_1_2'] - trade['precio_actual']) / trade['entrada']) * 100
-                    
-                    if dist_stop < 2:
-                        st.error(f"🚨 **{trade['ticker']}** muy cerca del Stop Loss ({dist_stop:.1f}%)")
-                        alertas_encontradas = True
-                    elif dist_tp < 2:
-                        st.success(f"🎯 **{trade['ticker']}** muy cerca del TP 1:2 ({dist_tp:.1f}%)")
-                        alertas_encontradas = True
+            motor = obtener_motor_alertas('portfolio', portfolio['trades'])
+            precios = memo_trades('portfolio', 'precios', lambda: precios_desde_trades(portfolio['trades']))
+            alertas = motor.procesar_precios(precios, sinks_alertas)
             
-            if not alertas_encontradas:
+            if not alertas:
                 st.info("✅ No hay alertas activas")
             
             st.markdown("---")
@@ -1138,16 +1578,15 @@ with tab4:
             if cerradas > 0:
                 st.markdown("### 📈 Evolución del Capital")
                 
-                # Ordenar por fecha
-                df_sorted = df_portfolio.sort_values('fecha')
-                
-                # Calcular capital acumulado (simplificado)
-                df_sorted_cerradas = df_sorted[df_sorted['status'] != 'Activa'].copy()
+                # Cerradas del periodo ordenadas por fecha
+                df_evolucion = df_cerradas[mascara_cerradas].sort_values('fecha', kind='stable')
                 
-                if not df_sorted_cerradas.empty:
-                    capital_evolution = [capital_inicial]
-                    for _, trade in df_sorted_cerradas.iterrows():
-                        capital_evolution.append(capital_evolution[-1] + trade['pl_actual'])
+                # Calcular capital acumulado (simplificado), partiendo del capital al inicio del periodo
+                if len(df_evolucion):
+                    capital_periodo = capital_inicial + memo_trades(
+                        'portfolio', ('pl_antes', desde), lambda: pl_antes_de(ruta, portfolio, desde))
+                    capital_evolution = [capital_periodo] + list(capital_periodo + np.cumsum(
+                        pd.to_numeric(df_evolucion['pl_actual'], errors='coerce').fillna(0.0).to_numpy()))
                     
                     fig_capital = go.Figure()
                     fig_capital.add_trace(go.Scatter(
@@ -1176,26 +1615,21 @@ with tab4:
             col_exp1, col_exp2, col_exp3 = st.columns(3)
             
             with col_exp1:
-                # Exportar todo a CSV
-                csv_all = df_portfolio.to_csv(index=False)
-                st.download_button(
-                    "📥 Descargar Portfolio Completo",
-                    csv_all,
-                    "portfolio_forward_test.csv",
-                    "text/csv",
-                    use_container_width=True
-                )
+                # Exportar todo (CSV / Parquet / Arrow) bajo demanda
+                mostrar_exportacion(lambda: todos_los_trades(ruta, portfolio), "portfolio_forward_test",
+                                    "📥 Exportar Portfolio Completo", "portfolio")
             
             with col_exp2:
                 # Exportar trades activos para Stock Master
-                df_activos = df_portfolio[df_portfolio['status'] == 'Activa']
-                if not df_activos.empty:
-                    csv_stock_master = df_activos[['ticker', 'acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3']].to_csv(index=False)
+                if activas > 0:
+                    # El CSV se genera al hacer clic, no en cada rerun
+                    activos = portfolio['trades']
                     st.download_button(
                         "📱 Exportar a Stock Master",
-                        csv_stock_master,
+                        lambda: exportar_stock_master(activos, destino=archivo_descarga()),
                         "stock_master_import.csv",
                         "text/csv",
+                        on_click="ignore",
                         use_container_width=True
                     )
                 else:
@@ -1205,23 +1639,40 @@ with tab4:
                 # Reiniciar portfolio
                 if st.button("🔄 Reiniciar Portfolio", use_container_width=True, type="secondary"):
                     if st.checkbox("⚠️ Confirmar reinicio (se perderán todos los datos)"):
-                        st.session_state['portfolio_forward_test'] = {
-                            'capital_inicial': 1000.0,
-                            'capital_actual': 1000.0,
-                            'trades': []
-                        }
-                        guardar_portfolio()
+                        with modificar_portfolio() as data:
+                            borrar_archivo(ruta)
+                            data.clear()
+                            data.update(portfolio_vacio(capital_inicial))
                         st.success("✅ Portfolio reiniciado")
                         st.rerun()
 
 
+# Solo se ejecuta la pestaña visible; cada vista es un fragmento que se relanza por su cuenta
+with tab1:
+    if tab1.open is not False:
+        vista_operacion()
+
+with tab2:
+    if tab2.open is not False:
+        vista_historial()
+
+with tab3:
+    if tab3.open is not False:
+        vista_dashboard()
+
+with tab4:
+    if tab4.open is not False:
+        vista_portfolio()
+
 # --- AUTO-REFRESH (si está activado) ---
 if auto_refresh:
     import time
-    time.sleep(300)  # 5 minutos
+    time.sleep(segundos_hasta_refresco())  # 5 min en sesión, más espaciado fuera de ella
     actualizar_precios_historial()
+    if st.session_state['tracking_portfolio_enabled']:
+        actualizar_precios_portfolio()
     st.rerun()
 
 st.markdown("---")
 st.caption("🩸 Swing Lab v5.0 | TipRanks Integration + Forward Testing Portfolio")
-st.caption("📊 Filtros profesionales TipRanks (Smart Score ≥ 8, Upside ≥ 10%, Consensus Buy) + Portfolio Tracker $1000")
\ No newline at end of file
+st.caption("📊 Filtros profesionales TipRanks (Smart Score ≥ 8, Upside ≥ 10%, Consensus Buy) + Portfolio Tracker multi-portfolio")
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""Archivo frío de los trades cerrados de cada portfolio, particionado por mes.
+
+    portfolios/<usuario>/<portfolio>.json                      abiertos (caliente)
+    portfolios/<usuario>/<portfolio>.cerrados/AAAA-MM.parquet   cerrados y cancelados
+    portfolios/<usuario>/<portfolio>.cerrados/libro/NNNNNN.parquet
+                                     asientos del libro de caja anteriores al último snapshot
+
+Un trade cerrado ya no cambia, pero mientras siga en el JSON cada refresco lo
+recorre y cada guardado lo reescribe. Cada escritura del portfolio
+(`almacen_portfolio.escribir_portfolio`) pasa antes los cerrados a la partición
+del mes de su `fecha`, así que refrescar y guardar cuestan lo que los abiertos.
+
+- Cada partición es Parquet comprimido (zstd): columnas tipadas para consultar
+  (fecha, ticker, status, P/L...) más el trade completo en JSON para reconstruirlo.
+- Las consultas por rango de fechas solo abren las particiones de los meses del
+  rango y solo leen las columnas pedidas.
+- El JSON guarda un resumen por mes (`archivados`) con los contadores y el P/L,
+  así que los totales no abren ninguna partición.
+- Archivar es idempotente (las filas se reemplazan por id): si se corta a medias,
+  los trades siguen en el caliente y la siguiente escritura lo completa.
+- Los asientos del libro se agrupan por tramos de `ASIENTOS_POR_PARTICION` seq; en
+  el JSON quedan los snapshots y la cola posterior al último.
+
+Necesita pyarrow; sin él los cerrados se quedan en el JSON como hasta ahora.
+"""
+import json
+import os
+import shutil
+import threading
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from alertas import clave_trade
+from operaciones import ESTADO_ACTIVA, ESTADO_PENDIENTE
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+COMPRESION = 'zstd'
+EXTENSION_ARCHIVO = '.cerrados'
+DIRECTORIO_LIBRO = 'libro'
+ASIENTOS_POR_PARTICION = 1000
+ESTADOS_ABIERTOS = (ESTADO_ACTIVA, ESTADO_PENDIENTE)
+
+COLUMNAS_TEXTO = ('id', 'fecha', 'ticker', 'status', 'consensus', 'barra_cierre')
+COLUMNAS_NUMERICAS = ('acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3', 'precio_actual', 'pl_actual',
+                      'inversion', 'comisiones', 'smart_score', 'upside')
+# Columnas de las consultas por defecto (las de la tabla del portfolio)
+COLUMNAS_CONSULTA = ('fecha', 'ticker', 'acciones', 'entrada', 'precio_actual', 'stop_loss', 'tp_1_2',
+                     'tp_1_3', 'pl_actual', 'comisiones', 'status', 'smart_score', 'upside', 'consensus')
+
+
+def disponible():
+    return pa is not None
+
+
+def ruta_archivo(ruta):
+    """Directorio de particiones del portfolio guardado en `ruta`"""
+    return os.path.splitext(ruta)[0] + EXTENSION_ARCHIVO
+
+
+def _mes(trade):
+    return trade['fecha'][:7]
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _esquema():
+    return pa.schema([pa.field(c, pa.string()) for c in COLUMNAS_TEXTO]
+                     + [pa.field(c, pa.float64()) for c in COLUMNAS_NUMERICAS]
+                     + [pa.field('trade', pa.string())])
+
+
+def _fila(trade):
+    fila = {c: None if trade.get(c) is None else str(trade[c]) for c in COLUMNAS_TEXTO}
+    fila.update({c: _numero(trade.get(c)) for c in COLUMNAS_NUMERICAS})
+    fila['id'] = clave_trade(trade)
+    fila['trade'] = json.dumps(trade)
+    return fila
+
+
+def _resumen(tabla):
+    """Contadores y P/L de una partición para el índice del JSON"""
+    estados = Counter(tabla.column('status').to_pylist())
+    cerradas = tabla.filter(pc.starts_with(tabla.column('status'), 'Cerrada'))
+    pl = cerradas.column('pl_actual').fill_null(0.0)
+    return {'trades': tabla.num_rows, 'estados': dict(estados),
+            'ganadoras': pc.sum(pc.greater(pl, 0.0)).as_py() or 0,
+            'pl': round(pc.sum(pl).as_py() or 0.0, 2)}
+
+
+def _escribir_particion(destino, tabla):
+    temporal = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(tabla, temporal, compression=COMPRESION)
+    os.replace(temporal, destino)
+
+
+# --- ARCHIVADO ---
+def archivar_cerrados(ruta, portfolio):
+    """Pasa los trades cerrados y cancelados del portfolio a sus particiones.
+
+    Se llama con el bloqueo del portfolio tomado, justo antes de escribir el JSON,
+    y quita esos trades de `portfolio['trades']`. Devuelve cuántos archivó.
+    """
+    # Sin libro de caja aún, los trades cerrados son los que lo reconstruyen al migrar
+    if pa is None or 'libro' not in portfolio:
+        return 0
+    cerrados = [t for t in portfolio['trades'] if t['status'] not in ESTADOS_ABIERTOS]
+    if not cerrados:
+        return 0
+    por_mes = defaultdict(list)
+    for trade in cerrados:
+        por_mes[_mes(trade)].append(trade)
+    directorio = ruta_archivo(ruta)
+    resumenes = {}
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        for mes, trades in por_mes.items():
+            destino = os.path.join(directorio, f"{mes}.parquet")
+            tabla = pa.Table.from_pylist([_fila(t) for t in trades], schema=_esquema())
+            if os.path.exists(destino):
+                anterior = pq.read_table(destino, schema=_esquema())
+                repetidos = pc.is_in(anterior.column('id'), value_set=tabla.column('id'))
+                tabla = pa.concat_tables([anterior.filter(pc.invert(repetidos)), tabla])
+            _escribir_particion(destino, tabla)
+            resumenes[mes] = _resumen(tabla)
+    except Exception:
+        # Los meses ya escritos se reemplazan por id en el próximo intento
+        return 0
+    portfolio['trades'][:] = [t for t in portfolio['trades'] if t['status'] in ESTADOS_ABIERTOS]
+    portfolio.setdefault('archivados', {}).update(resumenes)
+    return len(cerrados)
+
+
+def _esquema_asientos():
+    return pa.schema([pa.field('seq', pa.int64()), pa.field('fecha', pa.string()),
+                      pa.field('asiento', pa.string())])
+
+
+def archivar_asientos(ruta, portfolio):
+    """Pasa al archivo los asientos del libro anteriores a su último snapshot.
+
+    Como `archivar_cerrados`, se llama con el bloqueo tomado antes de escribir el JSON.
+    Devuelve cuántos archivó.
+    """
+    datos = portfolio.get('libro')
+    if pa is None or not datos or not datos['snapshots']:
+        return 0
+    base, corte = datos.get('base', 0), datos['snapshots'][-1]['seq']
+    viejos = datos['asientos'][:corte - base]
+    if not viejos:
+        return 0
+    por_tramo = defaultdict(list)
+    for asiento in viejos:
+        por_tramo[asiento['seq'] // ASIENTOS_POR_PARTICION].append(asiento)
+    directorio = os.path.join(ruta_archivo(ruta), DIRECTORIO_LIBRO)
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        for tramo, asientos in por_tramo.items():
+            destino = os.path.join(directorio, f"{tramo * ASIENTOS_POR_PARTICION:06d}.parquet")
+            tabla = pa.Table.from_pylist([{'seq': a['seq'], 'fecha': a['fecha'], 'asiento': json.dumps(a)}
+                                          for a in asientos], schema=_esquema_asientos())
+            if os.path.exists(destino):
+                anterior = pq.read_table(destino, schema=_esquema_asientos())
+                repetidos = pc.is_in(anterior.column('seq'), value_set=tabla.column('seq'))
+                tabla = pa.concat_tables([anterior.filter(pc.invert(repetidos)), tabla]).sort_by('seq')
+            _escribir_particion(destino, tabla)
+    except Exception:
+        # Los tramos ya escritos se reemplazan por seq en el próximo intento
+        return 0
+    del datos['asientos'][:len(viejos)]
+    datos['base'] = corte
+    return len(viejos)
+
+
+def asientos_archivados(ruta, desde=0, hasta=None):
+    """Asientos archivados con `seq` en [desde, hasta), en orden (el `archivo` de libro_caja)"""
+    directorio = os.path.join(ruta_archivo(ruta), DIRECTORIO_LIBRO)
+    if pa is None or not os.path.isdir(directorio):
+        return []
+    tablas = []
+    for nombre in sorted(os.listdir(directorio)):
+        inicio, extension = os.path.splitext(nombre)
+        if extension != '.parquet' or not inicio.isdigit():
+            continue
+        inicio = int(inicio)
+        if inicio + ASIENTOS_POR_PARTICION <= desde or (hasta is not None and inicio >= hasta):
+            continue
+        filtros = [('seq', '>=', desde)] + ([('seq', '<', hasta)] if hasta is not None else [])
+        tablas.append(pq.read_table(os.path.join(directorio, nombre), columns=['asiento'], filters=filtros))
+    return [json.loads(a) for t in tablas for a in t.column('asiento').to_pylist()]
+
+
+def borrar_archivo(ruta):
+    """Elimina todas las particiones del portfolio (al reiniciarlo)"""
+    shutil.rmtree(ruta_archivo(ruta), ignore_errors=True)
+
+
+# --- CONSULTAS ---
+def particiones(ruta, desde=None, hasta=None):
+    """Archivos de los meses que se solapan con [desde, hasta] (fechas YYYY-MM-DD)"""
+    directorio = ruta_archivo(ruta)
+    if pa is None or not os.path.isdir(directorio):
+        return []
+    rutas = []
+    for nombre in sorted(os.listdir(directorio)):
+        mes, extension = os.path.splitext(nombre)
+        if extension != '.parquet':
+            continue
+        if (desde is None or mes >= desde[:7]) and (hasta is None or mes <= hasta[:7]):
+            rutas.append(os.path.join(directorio, nombre))
+    return rutas
+
+
+def _en_rango(fechas, desde, hasta):
+    dias = fechas.str[:10]
+    mascara = pd.Series(True, index=fechas.index)
+    if desde is not None:
+        mascara &= dias >= desde
+    if hasta is not None:
+        mascara &= dias <= hasta
+    return mascara
+
+
+def leer_archivados(ruta, desde=None, hasta=None, columnas=COLUMNAS_CONSULTA):
+    """DataFrame con las `columnas` de los trades archivados con fecha en [desde, hasta]"""
+    columnas = list(dict.fromkeys(['fecha', *columnas]))
+    tablas = [pq.read_table(p, columns=columnas) for p in particiones(ruta, desde, hasta)]
+    if not tablas:
+        return pd.DataFrame(columns=columnas)
+    df = pa.concat_tables(tablas).to_pandas()
+    return df[_en_rango(df['fecha'], desde, hasta)].reset_index(drop=True)
+
+
+def trades_archivados(ruta, desde=None, hasta=None):
+    """Trades archivados completos (dicts), para exportar o conciliar.
+
+    Es un generador: abre las particiones de una en una, así que en memoria solo
+    está la del mes que se está recorriendo.
+    """
+    for particion in particiones(ruta, desde, hasta):
+        df = pq.read_table(particion, columns=['fecha', 'trade']).to_pandas()
+        for trade in df.loc[_en_rango(df['fecha'], desde, hasta), 'trade']:
+            yield json.loads(trade)
+
+
+def todos_los_trades(ruta, portfolio):
+    """Abiertos del JSON seguidos de todos los archivados (generador, partición a partición)"""
+    yield from list(portfolio['trades'])
+    yield from trades_archivados(ruta)
+
+
+def cerrados_en_rango(ruta, portfolio, desde=None, hasta=None, columnas=COLUMNAS_CONSULTA):
+    """Cerrados y cancelados del rango: los archivados más los que aún estén en el JSON"""
+    df = leer_archivados(ruta, desde, hasta, columnas)
+    calientes = pd.DataFrame([t for t in portfolio['trades'] if t['status'] not in ESTADOS_ABIERTOS],
+                             columns=df.columns)
+    if not calientes.empty:
+        calientes = calientes[_en_rango(calientes['fecha'], desde, hasta)]
+        df = pd.concat([df, calientes], ignore_index=True) if not df.empty else calientes.reset_index(drop=True)
+    return df
+
+
+def _pl_cerradas(estados, pl):
+    cerradas = pd.Series(estados, dtype=object).astype(str).str.startswith('Cerrada').to_numpy()
+    return float(pd.to_numeric(pd.Series(pl, dtype=object), errors='coerce').fillna(0.0)[cerradas].sum())
+
+
+def pl_antes_de(ruta, portfolio, fecha):
+    """P/L de los trades cerrados con fecha anterior a `fecha` (YYYY-MM-DD): los meses completos
+    salen del índice y solo se abre la partición del propio mes"""
+    mes = fecha[:7]
+    pl = sum(r['pl'] for m, r in portfolio.get('archivados', {}).items() if m < mes)
+    anterior = (pd.Timestamp(fecha) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    df = leer_archivados(ruta, f"{mes}-01", anterior, ('status', 'pl_actual'))
+    calientes = [t for t in portfolio['trades'] if t['fecha'][:10] < fecha]
+    return (pl + _pl_cerradas(df['status'], df['pl_actual'])
+            + _pl_cerradas([t['status'] for t in calientes], [t.get('pl_actual') for t in calientes]))
+
+
+def resumen_archivo(portfolio):
+    """Totales del archivo frío sin abrir ninguna partición"""
+    archivados = portfolio.get('archivados', {}).values()
+    estados = Counter()
+    for resumen in archivados:
+        estados.update(resumen['estados'])
+    return {'trades': sum(r['trades'] for r in archivados), 'estados': dict(estados),
+            'ganadoras': sum(r['ganadoras'] for r in archivados),
+            'pl': round(sum(r['pl'] for r in archivados), 2)}
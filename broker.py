@@ -0,0 +1,328 @@
+"""Broker simulado a nivel de barra para el portfolio de forward testing.
+
+Cada trade del portfolio lleva su orden de entrada ('mercado', 'limite', 'stop' o
+'stop_limite') y el broker la procesa contra las barras diarias (Open/High/Low):
+  - entradas con deslizamiento (mercado y stops) y comisión por acción con mínimo
+  - salida parcial en TP 1:2 (`fraccion_tp1`) y el resto en TP 1:3
+  - tras el TP 1:2 el stop pasa a break-even y sigue al máximo a `trailing_r` veces
+    el riesgo inicial
+
+Es un bucle de eventos por trade: con numpy se salta directamente a la siguiente
+barra en la que puede pasar algo (ejecución, toque de stop u objetivo), así que
+miles de órdenes abiertas se procesan en cada refresh recorriendo solo las barras
+nuevas desde el checkpoint de cada trade. Si una barra toca stop y objetivo se
+asume el stop, salvo que abra por encima del objetivo (igual que `operaciones`).
+
+Todo el estado vive en el dict del trade (JSON), así que sobrevive a recargas; el
+efectivo de cada ejecución se asienta en el libro de caja (`libro_caja`). Los
+precios de ejecución y las comisiones se redondean a céntimos, como en un broker.
+"""
+from datetime import date
+
+import numpy as np
+
+from calendario import ahora_ny, sesion_siguiente, ultima_sesion_final
+from alertas import clave_trade
+from libro_caja import asiento_entrada, asiento_salida, libro
+from operaciones import (ESTADO_ACTIVA, ESTADO_CANCELADA, ESTADO_PENDIENTE, ESTADO_STOP,
+                         ESTADO_TP_1_2, ESTADO_TP_1_3, ESTADO_TRAILING, fechas_barras)
+
+TIPOS_ORDEN = {'mercado': "Mercado", 'limite': "Límite", 'stop': "Stop", 'stop_limite': "Stop-Límite"}
+
+CONFIG_BROKER_DEFAULT = {
+    'deslizamiento_pct': 0.05,      # % en contra en órdenes a mercado y stops (los límites no deslizan)
+    'comision_por_accion': 0.005,
+    'comision_minima': 1.0,
+    'fraccion_tp1': 0.5,            # parte de la posición que se vende en TP 1:2 (1 = todo, como antes)
+    'breakeven_tras_tp1': True,
+    'trailing_r': 1.0,              # distancia del trailing tras TP 1:2, en múltiplos del riesgo (0 = sin trailing)
+    'vigencia_sesiones': 5,         # las entradas pendientes caducan tras N sesiones (0 = hasta cancelar)
+}
+
+
+def config_broker(portfolio):
+    """Configuración del broker del portfolio (los valores que falten, por defecto)"""
+    return {**CONFIG_BROKER_DEFAULT, **portfolio.get('broker', {})}
+
+
+def comision(config, acciones):
+    return round(max(config['comision_minima'], acciones * config['comision_por_accion']), 2)
+
+
+def _deslizar(config, precio, compra):
+    factor = config['deslizamiento_pct'] / 100
+    return precio * (1 + factor) if compra else precio * (1 - factor)
+
+
+# --- EJECUCIONES ---
+def _ejecutar_entrada(portfolio, trade, precio, barra, config):
+    precio = round(float(precio), 2)
+    acciones = trade['acciones']
+    coste = comision(config, acciones)
+    trade['status'] = ESTADO_ACTIVA
+    trade['entrada'] = precio
+    trade['inversion'] = round(acciones * precio, 2)
+    trade['acciones_abiertas'] = acciones
+    trade['comisiones'] = coste
+    trade['pl_realizado'] = -coste
+    trade['maximo'] = precio
+    trade['barra_entrada'] = barra
+    trade['precio_actual'] = precio
+    trade['pl_actual'] = -coste
+    asiento_entrada(portfolio, trade, barra, trade['inversion'], coste)
+    return {'ticker': trade['ticker'], 'evento': "Entrada", 'barra': barra,
+            'acciones': acciones, 'precio': precio}
+
+
+def _ejecutar_salida(portfolio, trade, acciones, precio, motivo, barra, config):
+    precio = round(float(precio), 2)
+    coste = comision(config, acciones)
+    trade['acciones_abiertas'] = round(trade['acciones_abiertas'] - acciones, 2)
+    trade['pl_realizado'] += acciones * (precio - trade['entrada']) - coste
+    trade['comisiones'] = round(trade.get('comisiones', 0.0) + coste, 2)
+    trade.setdefault('salidas', []).append({'barra': barra, 'motivo': motivo, 'acciones': acciones,
+                                            'precio': precio, 'comision': coste})
+    asiento_salida(portfolio, trade, barra, acciones, precio, coste, concepto=motivo)
+    return {'ticker': trade['ticker'], 'evento': motivo, 'barra': barra,
+            'acciones': acciones, 'precio': precio}
+
+
+def _cerrar(trade, estado, precio, barra):
+    precio = float(precio)
+    trade['status'] = estado
+    trade['acciones_abiertas'] = 0.0
+    trade['precio_actual'] = round(precio, 2)
+    trade['pl_actual'] = round(trade['pl_realizado'], 2)
+    trade['precio_cierre'] = round(precio, 2)
+    trade['barra_cierre'] = barra
+
+
+def _preparar(trade):
+    """Campos del broker para trades creados antes de él (entrada ya ejecutada, sin comisión)"""
+    if trade['status'] == ESTADO_ACTIVA and 'acciones_abiertas' not in trade:
+        trade['acciones_abiertas'] = trade['acciones']
+        trade['pl_realizado'] = 0.0
+        trade['maximo'] = trade['entrada']
+    trade.setdefault('stop_inicial', trade['stop_loss'])
+
+
+# --- ÓRDENES ---
+def abrir_trade(portfolio, trade, tipo='mercado', limite=None, stop=None, config=None):
+    """Añade el trade al portfolio con su orden de entrada.
+
+    A mercado se ejecuta ya sobre `entrada` (con deslizamiento); el resto queda
+    'Pendiente' y se evalúa contra las barras desde la sesión siguiente.
+    Devuelve el evento de entrada o None si la orden queda pendiente.
+    """
+    config = config or config_broker(portfolio)
+    # El libro se migra (si hace falta) antes de que el trade nuevo forme parte del portfolio
+    libro(portfolio)
+    # Identificador estable y único: la entrada cambia al ejecutarse la orden
+    if not trade.get('id'):
+        base = clave_trade(trade)
+        usados = {clave_trade(t) for t in portfolio['trades']}
+        clave, n = base, 0
+        while clave in usados:
+            n += 1
+            clave = f"{base}#{n}"
+        trade['id'] = clave
+    vigencia = None
+    if config['vigencia_sesiones']:
+        vigencia = date.fromisoformat(trade['fecha'][:10])
+        for _ in range(int(config['vigencia_sesiones'])):
+            vigencia = sesion_siguiente(vigencia)
+        vigencia = vigencia.isoformat()
+    trade['orden'] = {'tipo': tipo, 'limite': limite, 'stop': stop, 'vigencia_hasta': vigencia}
+    trade['stop_inicial'] = trade['stop_loss']
+    trade['acciones_abiertas'] = 0.0
+    trade['status'] = ESTADO_PENDIENTE
+    trade['pl_actual'] = 0.0
+    portfolio['trades'].insert(0, trade)
+    if tipo == 'mercado':
+        return _ejecutar_entrada(portfolio, trade, _deslizar(config, trade['entrada'], True),
+                                 trade['fecha'][:10], config)
+    return None
+
+
+def cancelar_orden(trade, barra=None):
+    if trade['status'] == ESTADO_PENDIENTE:
+        trade['status'] = ESTADO_CANCELADA
+        trade['barra_cierre'] = barra
+
+
+def _buscar_entrada(trade, a, k, fin, config):
+    """(barra, precio) de la ejecución de la orden pendiente en [k, fin), o (None, None)"""
+    orden = trade['orden']
+    aperturas, maximos, minimos = a['Open'][k:fin], a['High'][k:fin], a['Low'][k:fin]
+    if orden['tipo'] == 'limite':
+        toques = minimos <= orden['limite']
+        if toques.any():
+            i = int(np.argmax(toques))
+            return k + i, min(aperturas[i], orden['limite'])
+        return None, None
+
+    disparos = maximos >= orden['stop']
+    if not disparos.any():
+        return None, None
+    i = int(np.argmax(disparos))
+    disparo = max(aperturas[i], orden['stop'])
+    if orden['tipo'] == 'stop':
+        return k + i, _deslizar(config, disparo, True)
+    # Stop-límite: ejecuta si el disparo cae dentro del límite (sin pasarlo); si abrió
+    # por encima, queda como límite desde esa misma barra
+    if disparo <= orden['limite']:
+        return k + i, min(_deslizar(config, disparo, True), orden['limite'])
+    orden['tipo'] = 'limite'
+    orden['activada'] = True
+    return _buscar_entrada(trade, a, k + i, fin, config)
+
+
+def _stops_por_barra(trade, maximos, distancia):
+    """Stop vigente en cada barra: el trailing usa el máximo hasta la barra anterior"""
+    if not trade.get('tp1_ejecutado') or distancia <= 0:
+        return np.full(len(maximos), trade['stop_loss'])
+    previos = np.maximum.accumulate(np.concatenate(([trade['maximo']], maximos[:-1])))
+    return np.maximum(trade['stop_loss'], previos - distancia)
+
+
+def procesar_barras(portfolio, trade, a, fechas, config=None, ultima_final=None, checkpoint=True):
+    """Bucle de eventos de un trade sobre sus barras nuevas (`a`: arrays Open/High/Low/Close).
+
+    Devuelve la lista de eventos (entradas y salidas) ejecutados.
+    """
+    config = config or config_broker(portfolio)
+    libro(portfolio)
+    _preparar(trade)
+    if trade['status'] not in (ESTADO_ACTIVA, ESTADO_PENDIENTE):
+        return []
+    n = len(fechas)
+    entrada = None
+    if trade.get('ultima_barra'):
+        k = int(np.searchsorted(fechas, trade['ultima_barra'], side='right'))
+    elif trade['status'] == ESTADO_PENDIENTE:
+        # Una orden colocada hoy no puede ejecutarse con precios anteriores a ella
+        k = int(np.searchsorted(fechas, trade['fecha'][:10], side='right'))
+    else:
+        k = int(np.searchsorted(fechas, trade['fecha'][:10], side='left'))
+        if k < n and fechas[k] == trade['fecha'][:10]:
+            # De la barra del día de entrada solo cuenta el cierre (posterior a la entrada)
+            entrada = k
+            a = {c: v.copy() for c, v in a.items()}
+            a['Open'][k] = a['High'][k] = a['Low'][k] = a['Close'][k]
+    desde, ultimo_evento, eventos = k, None, []
+    distancia = config['trailing_r'] * (trade['entrada'] - trade['stop_inicial'])
+
+    while k < n:
+        if trade['status'] == ESTADO_PENDIENTE:
+            vigencia = trade['orden'].get('vigencia_hasta')
+            fin = int(np.searchsorted(fechas, vigencia, side='right')) if vigencia else n
+            j, precio = _buscar_entrada(trade, a, k, fin, config) if fin > k else (None, None)
+            if j is None:
+                if fin < n:
+                    cancelar_orden(trade, str(fechas[fin]))
+                    ultimo_evento = fin
+                break
+            eventos.append(_ejecutar_entrada(portfolio, trade, precio, str(fechas[j]), config))
+            distancia = config['trailing_r'] * (trade['entrada'] - trade['stop_inicial'])
+            ultimo_evento, k = j, j + 1
+            continue
+
+        maximos, minimos, aperturas = a['High'][k:], a['Low'][k:], a['Open'][k:]
+        stops = _stops_por_barra(trade, maximos, distancia)
+        objetivo = trade['tp_1_3'] if trade.get('tp1_ejecutado') else trade['tp_1_2']
+        toques = (minimos <= stops) | (maximos >= objetivo)
+        if not toques.any():
+            trade['maximo'] = max(trade['maximo'], float(maximos.max()))
+            if trade.get('tp1_ejecutado') and distancia > 0:
+                trade['stop_loss'] = round(max(trade['stop_loss'], trade['maximo'] - distancia), 2)
+            break
+
+        i = int(np.argmax(toques))
+        j, barra = k + i, str(fechas[k + i])
+        ultimo_evento = j
+        if minimos[i] <= stops[i] and not aperturas[i] >= objetivo:
+            precio = _deslizar(config, min(aperturas[i], stops[i]), False)
+            estado = ESTADO_TRAILING if trade.get('tp1_ejecutado') else ESTADO_STOP
+            eventos.append(_ejecutar_salida(portfolio, trade, trade['acciones_abiertas'], precio,
+                                            "Trailing Stop" if trade.get('tp1_ejecutado') else "Stop Loss",
+                                            barra, config))
+            _cerrar(trade, estado, precio, barra)
+            break
+
+        precio = max(aperturas[i], objetivo)
+        if trade.get('tp1_ejecutado'):
+            eventos.append(_ejecutar_salida(portfolio, trade, trade['acciones_abiertas'], precio,
+                                            "TP 1:3", barra, config))
+            _cerrar(trade, ESTADO_TP_1_3, precio, barra)
+            break
+
+        parcial = round(trade['acciones_abiertas'] * config['fraccion_tp1'], 2)
+        if parcial <= 0 or trade['acciones_abiertas'] - parcial < 0.01:
+            eventos.append(_ejecutar_salida(portfolio, trade, trade['acciones_abiertas'], precio,
+                                            "TP 1:2", barra, config))
+            _cerrar(trade, ESTADO_TP_1_2, precio, barra)
+            break
+        eventos.append(_ejecutar_salida(portfolio, trade, parcial, precio, "TP 1:2", barra, config))
+        trade['tp1_ejecutado'] = True
+        trade['maximo'] = max(trade['maximo'], float(maximos[i]))
+        if config['breakeven_tras_tp1']:
+            trade['stop_loss'] = max(trade['stop_loss'], trade['entrada'])
+        # Ambos objetivos son órdenes límite en reposo: la misma barra puede llenar los dos
+        if maximos[i] >= trade['tp_1_3']:
+            precio = max(aperturas[i], trade['tp_1_3'])
+            eventos.append(_ejecutar_salida(portfolio, trade, trade['acciones_abiertas'], precio,
+                                            "TP 1:3", barra, config))
+            _cerrar(trade, ESTADO_TP_1_3, precio, barra)
+            break
+        k = j + 1
+
+    if trade['status'] == ESTADO_ACTIVA and n:
+        cierre = float(a['Close'][-1])
+        trade['precio_actual'] = round(cierre, 2)
+        trade['pl_actual'] = round(trade['pl_realizado']
+                                   + trade['acciones_abiertas'] * (cierre - trade['entrada']), 2)
+    if checkpoint:
+        # Solo barras definitivas, salvo la del último evento (ya ejecutado)
+        ultima_final = ultima_final or ultima_sesion_final()
+        # Tampoco de la barra del día de entrada, evaluada solo por su cierre
+        procesadas = fechas[desde + (entrada is not None):n]
+        finales = procesadas[procesadas <= ultima_final]
+        candidatas = [str(finales[-1])] if len(finales) else []
+        if ultimo_evento is not None:
+            candidatas.append(str(fechas[ultimo_evento]))
+        if candidatas:
+            trade['ultima_barra'] = max(candidatas)
+    return eventos
+
+
+def arrays_barras(barras):
+    return {c: barras[c].to_numpy(dtype=np.float64) for c in ('Open', 'High', 'Low', 'Close')}
+
+
+def procesar_portfolio(portfolio, barras, config=None, ultima_final=None):
+    """Procesa todas las órdenes y posiciones abiertas del portfolio.
+
+    `barras`: {ticker: DataFrame} o {ticker: (DataFrame, fechas)}. Los arrays de cada
+    ticker se extraen una sola vez para todos sus trades. Devuelve los eventos ejecutados.
+    """
+    config = config or config_broker(portfolio)
+    ultima_final = ultima_final or ultima_sesion_final()
+    preparados, eventos = {}, []
+    for trade in portfolio['trades']:
+        if trade['status'] not in (ESTADO_ACTIVA, ESTADO_PENDIENTE) or trade['ticker'] not in barras:
+            continue
+        if trade['ticker'] not in preparados:
+            datos = barras[trade['ticker']]
+            df, fechas = datos if isinstance(datos, tuple) else (datos, fechas_barras(datos))
+            preparados[trade['ticker']] = (arrays_barras(df), fechas)
+        a, fechas = preparados[trade['ticker']]
+        eventos.extend(procesar_barras(portfolio, trade, a, fechas, config, ultima_final))
+    return eventos
+
+
+def procesar_precio(portfolio, trade, precio, config=None):
+    """Evalúa un tick de precio como una barra plana (sin checkpoint). Devuelve el estado."""
+    plana = np.array([precio], dtype=np.float64)
+    a = {'Open': plana, 'High': plana, 'Low': plana, 'Close': plana}
+    procesar_barras(portfolio, trade, a, np.array([ahora_ny().date().isoformat()]), config, checkpoint=False)
+    return trade['status']
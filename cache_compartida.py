@@ -0,0 +1,207 @@
+"""Caché en memoria compartida por todas las sesiones de Streamlit del proceso.
+
+Streamlit atiende cada sesión en un hilo del mismo proceso, así que un objeto de
+módulo es visible para todas: diez traders mirando NVDA comparten una sola copia
+de sus barras, su cotización y sus fundamentales.
+
+- Cada entrada guarda cuándo se obtuvo y una función de vigencia propia
+  (`ttl(segundos)` o la del calendario NYSE, `barras_vigentes`).
+- Coalescencia: si varias sesiones piden a la vez una clave que falta, solo una
+  la descarga y el resto espera su resultado (también dentro de un lote).
+- Memoria acotada: por encima de `LIMITE_MB_DEFAULT` se desalojan las entradas
+  menos usadas recientemente (LRU).
+- `estadisticas()` da aciertos, descargas, peticiones agrupadas, desalojos y
+  memoria por espacio (barras, cotizaciones, info...).
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+LIMITE_MB_DEFAULT = 256
+# Segundos que una sesión espera la descarga de otra antes de rendirse
+ESPERA_MAXIMA = 120
+
+CONTADORES = ('aciertos', 'fallos', 'agrupadas', 'caducadas', 'desalojos', 'errores')
+
+
+def ttl(segundos):
+    """Vigencia fija: la entrada vale `segundos` desde que se obtuvo"""
+    return lambda creado: time.time() - creado < segundos
+
+
+def tamano(valor):
+    """Bytes aproximados de un valor (DataFrames, arrays, dicts, objetos con __slots__)"""
+    if hasattr(valor, 'memory_usage'):
+        uso = valor.memory_usage(deep=True)
+        return int(uso.sum()) if hasattr(uso, 'sum') else int(uso)
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamano(k) + tamano(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple, set)):
+        return sys.getsizeof(valor) + sum(tamano(v) for v in valor)
+    if hasattr(valor, '__slots__'):
+        return sum(tamano(getattr(valor, a, None)) for a in valor.__slots__)
+    return sys.getsizeof(valor)
+
+
+class _Entrada:
+    __slots__ = ('valor', 'creado', 'vigente', 'tamano')
+
+    def __init__(self, valor, creado, vigente, tamano):
+        self.valor = valor
+        self.creado = creado
+        self.vigente = vigente
+        self.tamano = tamano
+
+
+class CacheCompartida:
+    """Caché LRU acotada en bytes, con vigencia por entrada y coalescencia de descargas"""
+
+    def __init__(self, limite_mb=LIMITE_MB_DEFAULT):
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        self._entradas = OrderedDict()  # (espacio, clave) -> _Entrada, de la menos a la más usada
+        self._en_vuelo = {}             # (espacio, clave) -> Event de la descarga en curso
+        self._bytes = 0
+        self._contadores = defaultdict(lambda: dict.fromkeys(CONTADORES, 0))
+        self._lock = threading.Lock()
+
+    # --- LECTURA Y ESCRITURA (con el lock tomado) ---
+    def _consultar(self, espacio, clave, valida):
+        entrada = self._entradas.get((espacio, clave))
+        if entrada is None:
+            return None
+        if not entrada.vigente(entrada.creado) or (valida is not None and not valida(entrada.valor)):
+            self._quitar((espacio, clave))
+            self._contadores[espacio]['caducadas'] += 1
+            return None
+        self._entradas.move_to_end((espacio, clave))
+        return entrada
+
+    def _quitar(self, k):
+        entrada = self._entradas.pop(k, None)
+        if entrada is not None:
+            self._bytes -= entrada.tamano
+
+    def _guardar(self, espacio, clave, valor, creado, vigente):
+        k = (espacio, clave)
+        self._quitar(k)
+        entrada = _Entrada(valor, creado, vigente, tamano(valor))
+        self._entradas[k] = entrada
+        self._bytes += entrada.tamano
+        # La entrada recién guardada no se desaloja aunque sola supere el límite
+        while self._bytes > self.limite_bytes and len(self._entradas) > 1:
+            (espacio_viejo, _), viejo = self._entradas.popitem(last=False)
+            self._bytes -= viejo.tamano
+            self._contadores[espacio_viejo]['desalojos'] += 1
+
+    # --- API ---
+    def guardar(self, espacio, clave, valor, vigente, creado=None):
+        with self._lock:
+            self._guardar(espacio, clave, valor, time.time() if creado is None else creado, vigente)
+
+    def consultar(self, espacio, clave):
+        """Valor vigente de una clave sin cargarlo nunca (None si falta o caducó)"""
+        with self._lock:
+            entrada = self._consultar(espacio, clave, None)
+            if entrada is None:
+                return None
+            self._contadores[espacio]['aciertos'] += 1
+            return entrada.valor
+
+    def invalidar(self, espacio=None, clave=None):
+        """Borra una clave, un espacio entero o (sin argumentos) toda la caché.
+
+        `clave` también puede ser una función que decide qué claves se borran.
+        """
+        coincide = clave if callable(clave) else (lambda c: clave is None or c == clave)
+        with self._lock:
+            for k in [k for k in self._entradas if (espacio is None or k[0] == espacio) and coincide(k[1])]:
+                self._quitar(k)
+
+    def obtener_lote(self, espacio, claves, cargar, vigente, refrescar=False, valida=None):
+        """{clave: valor} de varias claves; las que faltan se piden en una sola llamada.
+
+        `cargar(claves)` devuelve {clave: (creado, valor)} (las que no tienen datos no
+        aparecen ni se cachean). Una clave que otra sesión ya está descargando no se
+        vuelve a pedir: se espera su resultado. `valida(valor)` descarta entradas que
+        ya no sirven para esta petición aunque sigan vigentes.
+        """
+        resultado, propias, ajenas = {}, [], {}
+        with self._lock:
+            contadores = self._contadores[espacio]
+            for clave in claves:
+                entrada = None if refrescar else self._consultar(espacio, clave, valida)
+                if entrada is not None:
+                    resultado[clave] = entrada.valor
+                    contadores['aciertos'] += 1
+                elif (espacio, clave) in self._en_vuelo:
+                    ajenas[clave] = self._en_vuelo[(espacio, clave)]
+                    contadores['agrupadas'] += 1
+                else:
+                    self._en_vuelo[(espacio, clave)] = threading.Event()
+                    propias.append(clave)
+                    contadores['fallos'] += 1
+
+        if propias:
+            try:
+                cargados = cargar(propias)
+                with self._lock:
+                    for clave, (creado, valor) in cargados.items():
+                        self._guardar(espacio, clave, valor, creado, vigente)
+                        resultado[clave] = valor
+            except Exception:
+                with self._lock:
+                    self._contadores[espacio]['errores'] += 1
+                raise
+            finally:
+                with self._lock:
+                    for clave in propias:
+                        self._en_vuelo.pop((espacio, clave)).set()
+
+        insuficientes = []
+        for clave, evento in ajenas.items():
+            evento.wait(ESPERA_MAXIMA)
+            with self._lock:
+                entrada = self._entradas.get((espacio, clave))
+            if entrada is None:
+                continue
+            if valida is None or valida(entrada.valor):
+                resultado[clave] = entrada.valor
+            else:
+                insuficientes.append(clave)
+        # La descarga ajena no cubría esta petición (p. ej. empezaba más tarde): se pide aparte
+        if insuficientes:
+            cargados = cargar(insuficientes)
+            with self._lock:
+                for clave, (creado, valor) in cargados.items():
+                    self._guardar(espacio, clave, valor, creado, vigente)
+                    resultado[clave] = valor
+        return resultado
+
+    def obtener(self, espacio, clave, cargar, vigente, refrescar=False, valida=None):
+        """Valor de una clave; `cargar()` devuelve (creado, valor) o None si no hay datos"""
+        def cargar_una(_):
+            cargado = cargar()
+            return {} if cargado is None else {clave: cargado}
+        return self.obtener_lote(espacio, [clave], cargar_una, vigente, refrescar, valida).get(clave)
+
+    def estadisticas(self):
+        """Contadores, entradas y memoria por espacio más los totales"""
+        with self._lock:
+            espacios = {e: dict(c, entradas=0, bytes=0) for e, c in self._contadores.items()}
+            for (espacio, _), entrada in self._entradas.items():
+                espacios.setdefault(espacio, dict(dict.fromkeys(CONTADORES, 0), entradas=0, bytes=0))
+                espacios[espacio]['entradas'] += 1
+                espacios[espacio]['bytes'] += entrada.tamano
+            total = {c: sum(e[c] for e in espacios.values()) for c in CONTADORES}
+            total.update(entradas=len(self._entradas), bytes=self._bytes, limite_bytes=self.limite_bytes)
+        peticiones = total['aciertos'] + total['fallos'] + total['agrupadas']
+        total['tasa_aciertos'] = (total['aciertos'] + total['agrupadas']) / peticiones if peticiones else None
+        return {'total': total, 'espacios': espacios}
+
+
+CACHE = CacheCompartida()
@@ -0,0 +1,190 @@
+"""Calendario de sesiones del NYSE calculado localmente (sin peticiones).
+
+Festivos y cierres anticipados salen de las reglas de la bolsa; las horas se
+manejan en America/New_York con `zoneinfo`, así que el horario de verano se
+resuelve solo. Sirve para no pedir precios cuando el mercado no puede haberlos
+cambiado y para saber hasta qué barra diaria los datos son definitivos.
+
+Fases: 'cerrado' (fin de semana/festivo), 'pre', 'sesion', 'post' y 'noche'.
+"""
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+ZONA_NY = ZoneInfo('America/New_York')
+
+APERTURA = time(9, 30)
+CIERRE = time(16, 0)
+CIERRE_ANTICIPADO = time(13, 0)
+INICIO_PRE = time(4, 0)
+FIN_POST = time(20, 0)
+# Margen tras el cierre para que Yahoo publique la barra diaria definitiva
+MARGEN_BARRA_FINAL = timedelta(minutes=15)
+
+# Cierres extraordinarios (duelos nacionales, etc.) que no salen de las reglas
+CIERRES_ESPECIALES = {date(2018, 12, 5), date(2025, 1, 9)}
+
+# Segundos entre refrescos automáticos según la fase del mercado
+CADENCIA_REFRESCO = {'sesion': 300, 'pre': 900, 'post': 900, 'noche': 3600, 'cerrado': 3600}
+
+
+# --- FESTIVOS ---
+def _domingo_pascua(anio):
+    """Algoritmo anónimo gregoriano"""
+    a, b, c = anio % 19, anio // 100, anio % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes = (h + l - 7 * m + 114) // 31
+    dia = (h + l - 7 * m + 114) % 31 + 1
+    return date(anio, mes, dia)
+
+
+def _n_dia_semana(anio, mes, dia_semana, n):
+    """n-ésimo día de la semana del mes (n=-1: el último)"""
+    if n > 0:
+        primero = date(anio, mes, 1)
+        return primero + timedelta(days=(dia_semana - primero.weekday()) % 7 + 7 * (n - 1))
+    siguiente = date(anio + mes // 12, mes % 12 + 1, 1)
+    ultimo = siguiente - timedelta(days=1)
+    return ultimo - timedelta(days=(ultimo.weekday() - dia_semana) % 7)
+
+
+def _observado(fecha):
+    """Sábado -> viernes anterior, domingo -> lunes siguiente"""
+    if fecha.weekday() == 5:
+        return fecha - timedelta(days=1)
+    if fecha.weekday() == 6:
+        return fecha + timedelta(days=1)
+    return fecha
+
+
+@lru_cache(maxsize=None)
+def festivos(anio):
+    dias = {
+        _n_dia_semana(anio, 1, 0, 3),              # Martin Luther King Jr.
+        _n_dia_semana(anio, 2, 0, 3),              # Washington's Birthday
+        _domingo_pascua(anio) - timedelta(days=2), # Viernes Santo
+        _n_dia_semana(anio, 5, 0, -1),             # Memorial Day
+        _observado(date(anio, 7, 4)),              # Independence Day
+        _n_dia_semana(anio, 9, 0, 1),              # Labor Day
+        _n_dia_semana(anio, 11, 3, 4),             # Thanksgiving
+        _observado(date(anio, 12, 25)),            # Navidad
+    }
+    # Año Nuevo en sábado no se traslada al viernes (caería en el año anterior)
+    if date(anio, 1, 1).weekday() != 5:
+        dias.add(_observado(date(anio, 1, 1)))
+    if anio >= 2022:
+        dias.add(_observado(date(anio, 6, 19)))    # Juneteenth
+    dias.update(d for d in CIERRES_ESPECIALES if d.year == anio)
+    return frozenset(dias)
+
+
+@lru_cache(maxsize=None)
+def cierres_anticipados(anio):
+    """Sesiones que cierran a las 13:00 (víspera del 4 de julio, viernes negro, Nochebuena)"""
+    candidatos = {date(anio, 7, 3), _n_dia_semana(anio, 11, 3, 4) + timedelta(days=1), date(anio, 12, 24)}
+    return frozenset(d for d in candidatos if es_dia_habil(d))
+
+
+def es_dia_habil(fecha):
+    return fecha.weekday() < 5 and fecha not in festivos(fecha.year)
+
+
+def hora_cierre(fecha):
+    return CIERRE_ANTICIPADO if fecha in cierres_anticipados(fecha.year) else CIERRE
+
+
+def sesion_anterior(fecha):
+    """Último día hábil estrictamente anterior a `fecha`"""
+    fecha -= timedelta(days=1)
+    while not es_dia_habil(fecha):
+        fecha -= timedelta(days=1)
+    return fecha
+
+
+def sesion_siguiente(fecha):
+    """Primer día hábil estrictamente posterior a `fecha`"""
+    fecha += timedelta(days=1)
+    while not es_dia_habil(fecha):
+        fecha += timedelta(days=1)
+    return fecha
+
+
+# --- FASES ---
+def ahora_ny(ahora=None):
+    if ahora is None:
+        return datetime.now(ZONA_NY)
+    if ahora.tzinfo is None:
+        ahora = ahora.astimezone()
+    return ahora.astimezone(ZONA_NY)
+
+
+def _en_ny(fecha, hora):
+    return datetime.combine(fecha, hora, tzinfo=ZONA_NY)
+
+
+def fase_mercado(ahora=None):
+    ahora = ahora_ny(ahora)
+    hoy = ahora.date()
+    if not es_dia_habil(hoy):
+        return 'cerrado'
+    hora = ahora.time()
+    if hora < INICIO_PRE:
+        return 'noche'
+    if hora < APERTURA:
+        return 'pre'
+    if hora < hora_cierre(hoy):
+        return 'sesion'
+    if hora < FIN_POST:
+        return 'post'
+    return 'noche'
+
+
+def corte_barras_finales(ahora=None):
+    """Instante (NY) desde el que la última barra diaria publicada es definitiva"""
+    ahora = ahora_ny(ahora)
+    hoy = ahora.date()
+    if es_dia_habil(hoy):
+        corte = _en_ny(hoy, hora_cierre(hoy)) + MARGEN_BARRA_FINAL
+        if ahora >= corte:
+            return corte
+    anterior = sesion_anterior(hoy)
+    return _en_ny(anterior, hora_cierre(anterior)) + MARGEN_BARRA_FINAL
+
+
+def ultima_sesion_final(ahora=None):
+    """Fecha (YYYY-MM-DD) de la última sesión cuya barra diaria ya es definitiva"""
+    return corte_barras_finales(ahora).date().isoformat()
+
+
+def precios_en_movimiento(ahora=None):
+    """True desde la apertura hasta que la barra del día es definitiva"""
+    ahora = ahora_ny(ahora)
+    hoy = ahora.date()
+    return (es_dia_habil(hoy)
+            and _en_ny(hoy, APERTURA) <= ahora < _en_ny(hoy, hora_cierre(hoy)) + MARGEN_BARRA_FINAL)
+
+
+def barras_vigentes(descargadas_en, ahora=None):
+    """Unas barras descargadas en `descargadas_en` (timestamp) siguen sirviendo si se
+    bajaron después del último corte: nada definitivo ha cambiado desde entonces"""
+    return descargadas_en >= corte_barras_finales(ahora).timestamp()
+
+
+def segundos_hasta_refresco(ahora=None):
+    """Espera del auto-refresco: la cadencia de la fase, sin pasarse de la apertura ni del corte"""
+    ahora = ahora_ny(ahora)
+    espera = CADENCIA_REFRESCO[fase_mercado(ahora)]
+    hoy = ahora.date()
+    proxima = hoy if es_dia_habil(hoy) else sesion_siguiente(hoy)
+    for evento in (_en_ny(proxima, APERTURA),
+                   _en_ny(proxima, hora_cierre(proxima)) + MARGEN_BARRA_FINAL):
+        if evento > ahora:
+            espera = min(espera, (evento - ahora).total_seconds())
+            break
+    return max(1, int(espera))
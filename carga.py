@@ -0,0 +1,386 @@
+"""Prueba de carga: N sesiones headless de la app a la vez contra datos de replay locales.
+
+Cada sesión es un `AppTest` de Streamlit en su propio hilo que repite el flujo
+de un trader: analizar un ticker, rellenar TipRanks, calcular la posición,
+guardarla, pasar por las pestañas y refrescar el portfolio. Las barras y los
+precios salen de ticks de replay (un CSV de `streaming.py` o un random walk con
+semilla), así que no se toca Yahoo y los resultados son repetibles.
+
+`AppTest` instala un Runtime global en cada run, así que dentro de un proceso
+los reruns se ejecutan de uno en uno (como un servidor Streamlit bajo el GIL) y
+la espera en cola cuenta en la latencia. Con `--procesos` las sesiones se
+reparten entre varios procesos sobre el mismo directorio, que es donde aparece
+la contención real de archivos (varios servidores detrás de un balanceador).
+
+Todo se ejecuta en un directorio temporal: los portfolios y la caché de barras
+reales no se tocan. El informe da throughput, latencias p50/p95 por paso,
+memoria por sesión, errores de contención de archivos y escrituras perdidas
+(trades guardados que no acabaron en el archivo del portfolio).
+
+Uso sin UI:
+    python carga.py --sesiones 8 --iteraciones 3
+    python carga.py --sesiones 16 --procesos 4 --replay ticks.csv
+    python carga.py --sesiones 16 --portfolio-por-sesion
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import datos_mercado
+from almacen_portfolio import USUARIO_DEFAULT, crear_portfolio, leer, ruta_portfolio
+from archivo_trades import resumen_archivo
+from cache_compartida import CACHE
+from calendario import sesion_anterior, ultima_sesion_final
+from streaming import cargar_ticks_csv
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+TICKERS_DEFAULT = ['AAPL', 'MSFT', 'NVDA', 'AMZN', 'META', 'GOOGL', 'JPM', 'XOM']
+SESIONES_DEFAULT = 4
+ITERACIONES_DEFAULT = 3
+TICKS_POR_BARRA = 8
+BARRAS_SINTETICAS = 500
+TIMEOUT_RERUN = 120
+PORTFOLIO_CARGA = 'carga'
+
+PESTANAS = ["🩸 Nueva Operación", "📊 Historial", "📈 Dashboard", "💼 Portfolio"]
+# Errores que delatan dos sesiones pisándose el mismo archivo
+ERRORES_CONTENCION = ('JSONDecodeError', 'FileNotFoundError', 'PermissionError',
+                      'BlockingIOError', 'OSError', 'EOFError', 'UnpicklingError')
+
+
+# --- DATOS DE REPLAY ---
+def ticks_sinteticos(tickers, barras=BARRAS_SINTETICAS, semilla=0):
+    """Random walk de (ticker, precio) con `TICKS_POR_BARRA` ticks por sesión"""
+    rng = np.random.default_rng(semilla)
+    ticks = []
+    for ticker in tickers:
+        inicial = rng.uniform(20, 400)
+        retornos = rng.normal(0.0003, 0.004, barras * TICKS_POR_BARRA)
+        ticks.extend((ticker, round(float(p), 2)) for p in inicial * np.exp(np.cumsum(retornos)))
+    return ticks
+
+
+def barras_desde_ticks(ticks, ticks_por_barra=TICKS_POR_BARRA):
+    """{ticker: barras diarias} agrupando los ticks de cada ticker en sesiones NYSE que
+    terminan en la última sesión definitiva (OHLC de cada grupo, volumen por tick)"""
+    por_ticker = defaultdict(list)
+    for ticker, precio in ticks:
+        por_ticker[ticker.upper()].append(precio)
+
+    barras = {}
+    for ticker, precios in por_ticker.items():
+        n = len(precios) // ticks_por_barra
+        if n < 2:
+            continue
+        grupos = np.asarray(precios[-n * ticks_por_barra:]).reshape(n, ticks_por_barra)
+        fechas = [pd.Timestamp(ultima_sesion_final()).date()]
+        while len(fechas) < n:
+            fechas.append(sesion_anterior(fechas[-1]))
+        barras[ticker] = pd.DataFrame({
+            'Open': grupos[:, 0], 'High': grupos.max(axis=1), 'Low': grupos.min(axis=1),
+            'Close': grupos[:, -1], 'Volume': np.abs(np.diff(grupos, axis=1)).sum(axis=1) * 1e6,
+        }, index=pd.DatetimeIndex(fechas[::-1], name='Date'))
+    return barras
+
+
+def escribir_cache_replay(barras):
+    """Deja las barras y fundamentales del replay en la caché local (vigentes hasta el próximo cierre)"""
+    for ticker, df in barras.items():
+        datos_mercado._escribir_cache_disco(ticker, df)
+        cierre = float(df['Close'].iloc[-1])
+        datos_mercado._escribir_atomico(datos_mercado.ruta_cache_info(ticker), datos_mercado._guardar_json({
+            'symbol': ticker, 'currentPrice': cierre, 'targetMeanPrice': round(cierre * 1.2, 2),
+            'recommendationKey': 'buy', 'numberOfAnalystOpinions': 20}))
+
+
+def usar_replay(barras):
+    """Sustituye las descargas de Yahoo del proceso por lecturas del replay: las sesiones
+    nunca salen a la red (tampoco al refrescar trades ni al pedir el precio en vivo)"""
+    def descargar_replay(tickers, inicio=None, periodo='1mo', intervalo='1d'):
+        resultado = {}
+        for ticker in {t.upper() for t in tickers}:
+            df = barras.get(ticker)
+            if df is not None and inicio is not None:
+                df = df[df.index >= pd.Timestamp(inicio)]
+            if df is not None and not df.empty:
+                resultado[ticker] = df
+        return resultado
+
+    def precio_replay(ticker):
+        df = barras.get(ticker.upper())
+        return None if df is None else float(df['Close'].iloc[-1])
+
+    datos_mercado.descargar_barras = descargar_replay
+    datos_mercado._cotizacion_yahoo = precio_replay
+
+
+# --- SESIONES ---
+# Un rerun de AppTest a la vez por proceso (ver docstring del módulo)
+_turno_rerun = threading.Lock()
+
+
+def _rss_mb():
+    """Memoria residente actual del proceso en MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _boton(at, texto):
+    for boton in at.button:
+        if texto in boton.label:
+            return boton
+    raise LookupError(f"No aparece el botón '{texto}'")
+
+
+class SesionCarga:
+    """Una sesión headless que repite el flujo de un trader y mide cada rerun"""
+
+    def __init__(self, numero, tickers, portfolio=None):
+        from streamlit.testing.v1 import AppTest
+
+        self.numero = numero
+        self.tickers = tickers
+        self.at = AppTest.from_file(RUTA_APP, default_timeout=TIMEOUT_RERUN)
+        if portfolio is not None:
+            self.at.session_state['portfolio_activo'] = portfolio
+        self.latencias = defaultdict(list)
+        self.errores = []
+        self.contencion = []
+        self.guardados = 0
+
+    def _rerun(self, paso, preparar=None):
+        try:
+            if preparar is not None:
+                preparar(self.at)
+            inicio = time.perf_counter()
+            with _turno_rerun:
+                self.at.run()
+            self.latencias[paso].append(time.perf_counter() - inicio)
+            excepciones = [e.value for e in self.at.exception]
+        except Exception as e:
+            excepciones = [f"{type(e).__name__}: {e}"]
+        for mensaje in excepciones:
+            destino = self.contencion if any(x in mensaje for x in ERRORES_CONTENCION) else self.errores
+            destino.append(f"sesión {self.numero} · {paso}: {mensaje}")
+        return not excepciones
+
+    def _pestana(self, paso, pestana):
+        def preparar(at):
+            at.session_state['pestana_activa'] = pestana
+        return self._rerun(paso, preparar)
+
+    def iteracion(self, i):
+        ticker = self.tickers[(self.numero + i) % len(self.tickers)]
+
+        def analizar(at):
+            at.text_input(key='ticker_input').set_value(ticker)
+            _boton(at, 'ANALIZAR TODO').click()
+
+        def tipranks(at):
+            at.number_input(key='smart_score_input').set_value(9)
+            precio = at.session_state['precio_entrada'] if 'precio_entrada' in at.session_state else 100.0
+            at.number_input(key='price_target_input').set_value(round(precio * 1.25, 2))
+            at.selectbox(key='consensus_input').set_value("Strong Buy")
+
+        if not self._pestana('pestana_operacion', PESTANAS[0]):
+            return
+        if not (self._rerun('analizar', analizar) and self._rerun('tipranks', tipranks)
+                and self._rerun('calcular', lambda at: _boton(at, 'CALCULAR POSICIÓN').click())):
+            return
+        # La app borra la posición calculada al guardar
+        if (self._rerun('guardar', lambda at: _boton(at, 'GUARDAR EN HISTORIAL').click())
+                and 'posicion_calculada' not in self.at.session_state):
+            self.guardados += 1
+        self._pestana('pestana_historial', PESTANAS[1])
+        self._pestana('pestana_dashboard', PESTANAS[2])
+        if self._pestana('pestana_portfolio', PESTANAS[3]):
+            self._rerun('refrescar', lambda at: _boton(at, 'Actualizar Precios Portfolio').click())
+
+    def ejecutar(self, iteraciones):
+        if not self._rerun('inicio'):
+            return
+        for i in range(iteraciones):
+            self.iteracion(i)
+
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] * 1000
+
+
+def _trades_en_archivo(portfolio):
+    data = leer(ruta_portfolio(*portfolio))
+    # Los que el broker ya cerró están en el archivo frío
+    return 0 if data is None else len(data['trades']) + resumen_archivo(data)['trades']
+
+
+def portfolio_sesion(numero, portfolio_por_sesion):
+    return (PORTFOLIO_CARGA, f"sesion_{numero}") if portfolio_por_sesion else (USUARIO_DEFAULT, PORTFOLIO_CARGA)
+
+
+def ejecutar_sesiones(numeros, iteraciones, tickers, portfolio_por_sesion=False):
+    """Corre las sesiones `numeros` en hilos de este proceso y devuelve sus mediciones en bruto"""
+    # Un primer run fuera de la medición importa la app: la memoria base ya la incluye
+    SesionCarga(-1, tickers).ejecutar(0)
+    memoria_inicial = _rss_mb()
+    carga = [SesionCarga(n, tickers, portfolio_sesion(n, portfolio_por_sesion)) for n in numeros]
+    hilos = [threading.Thread(target=s.ejecutar, args=(iteraciones,), name=f"carga-{s.numero}")
+             for s in carga]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    latencias = defaultdict(list)
+    guardados = defaultdict(int)
+    for sesion in carga:
+        for paso, valores in sesion.latencias.items():
+            latencias[paso].extend(valores)
+        guardados[tuple(sesion.at.session_state['portfolio_activo'])] += sesion.guardados
+    return {
+        'latencias': dict(latencias),
+        'guardados': dict(guardados),
+        'memoria_mb': _rss_mb(),
+        'memoria_sesiones_mb': _rss_mb() - memoria_inicial,
+        'errores_contencion': [e for s in carga for e in s.contencion],
+        'errores': [e for s in carga for e in s.errores],
+        'cache': CACHE.estadisticas()['total'],
+    }
+
+
+def _trabajador(directorio, barras, numeros, iteraciones, portfolio_por_sesion):
+    """Proceso hijo: mismo directorio y mismo replay que el resto"""
+    os.chdir(directorio)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    usar_replay(barras)
+    return ejecutar_sesiones(numeros, iteraciones, sorted(barras), portfolio_por_sesion)
+
+
+def prueba_carga(sesiones=SESIONES_DEFAULT, iteraciones=ITERACIONES_DEFAULT, ticks=None,
+                 tickers=TICKERS_DEFAULT, portfolio_por_sesion=False, procesos=1):
+    """Lanza `sesiones` sesiones concurrentes repartidas en `procesos` y devuelve el informe.
+
+    Se ejecuta en el directorio de trabajo actual: usar un directorio temporal.
+    Por defecto todas las sesiones escriben en el mismo portfolio (una mesa de
+    trading compartida); con `portfolio_por_sesion` cada una tiene el suyo.
+    """
+    barras = barras_desde_ticks(ticks if ticks is not None else ticks_sinteticos(tickers))
+    if not barras:
+        raise ValueError("El replay no tiene ticks suficientes para construir barras")
+    escribir_cache_replay(barras)
+    # El selector del sidebar solo ofrece portfolios que ya existen en disco
+    for portfolio in {portfolio_sesion(n, portfolio_por_sesion) for n in range(sesiones)}:
+        if not os.path.exists(ruta_portfolio(*portfolio)):
+            crear_portfolio(*portfolio)
+    procesos = max(1, min(procesos, sesiones))
+    repartos = [list(range(p, sesiones, procesos)) for p in range(procesos)]
+
+    inicio = time.perf_counter()
+    if procesos == 1:
+        usar_replay(barras)
+        resultados = [ejecutar_sesiones(repartos[0], iteraciones, sorted(barras), portfolio_por_sesion)]
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = [pool.submit(_trabajador, os.getcwd(), barras, numeros, iteraciones, portfolio_por_sesion)
+                       for numeros in repartos]
+            resultados = [f.result() for f in futuros]
+    duracion = time.perf_counter() - inicio
+
+    latencias = defaultdict(list)
+    guardados = defaultdict(int)
+    for resultado in resultados:
+        for paso, valores in resultado['latencias'].items():
+            latencias[paso].extend(valores)
+        for portfolio, n in resultado['guardados'].items():
+            guardados[portfolio] += n
+    todas = [v for valores in latencias.values() for v in valores]
+    total_guardados = sum(guardados.values())
+
+    return {
+        'sesiones': sesiones,
+        'procesos': procesos,
+        'iteraciones': iteraciones,
+        'duracion_s': duracion,
+        'reruns': len(todas),
+        'reruns_por_s': len(todas) / duracion if duracion else None,
+        'guardados': total_guardados,
+        'flujos_por_s': total_guardados / duracion if duracion else None,
+        'latencia_p50_ms': _percentil(todas, 0.5),
+        'latencia_p95_ms': _percentil(todas, 0.95),
+        'latencia_max_ms': max(todas) * 1000 if todas else None,
+        'pasos': {paso: {'reruns': len(v), 'p50_ms': _percentil(v, 0.5), 'p95_ms': _percentil(v, 0.95)}
+                  for paso, v in latencias.items()},
+        'memoria_mb': sum(r['memoria_mb'] for r in resultados),
+        'memoria_por_sesion_mb': sum(r['memoria_sesiones_mb'] for r in resultados) / sesiones,
+        'errores_contencion': [e for r in resultados for e in r['errores_contencion']],
+        'escrituras_perdidas': sum(max(0, n - _trades_en_archivo(p)) for p, n in guardados.items()),
+        'errores': [e for r in resultados for e in r['errores']],
+        'cache': {c: sum(r['cache'][c] for r in resultados) for c in ('aciertos', 'agrupadas', 'fallos', 'desalojos')},
+    }
+
+
+def formatear_informe(informe):
+    """Informe en texto: una línea por paso, totales y errores"""
+    def ms(valor):
+        return f"{valor:8.0f}" if valor is not None else "       -"
+
+    lineas = [f"{'Paso':<20} {'Reruns':>6} {'p50 ms':>8} {'p95 ms':>8}"]
+    for paso, datos in informe['pasos'].items():
+        lineas.append(f"{paso:<20} {datos['reruns']:>6} {ms(datos['p50_ms'])} {ms(datos['p95_ms'])}")
+    lineas.append(f"{'TOTAL':<20} {informe['reruns']:>6} {ms(informe['latencia_p50_ms'])} "
+                  f"{ms(informe['latencia_p95_ms'])}  (máx {informe['latencia_max_ms'] or 0:.0f} ms)")
+    lineas.append(f"⏱️ {informe['sesiones']} sesiones x {informe['iteraciones']} iteraciones "
+                  f"({informe['procesos']} proceso{'s' if informe['procesos'] > 1 else ''}) en "
+                  f"{informe['duracion_s']:.1f} s: {informe['reruns_por_s']:.1f} reruns/s, "
+                  f"{informe['flujos_por_s']:.2f} operaciones guardadas/s")
+    lineas.append(f"🧠 {informe['memoria_por_sesion_mb']:.1f} MB por sesión "
+                  f"({informe['memoria_mb']:.0f} MB de RSS al terminar)")
+    lineas.append(f"🔒 {len(informe['errores_contencion'])} errores de contención de archivos, "
+                  f"{informe['escrituras_perdidas']} de {informe['guardados']} trades guardados "
+                  f"no llegaron al archivo")
+    cache = informe['cache']
+    lineas.append(f"🗄️ Caché compartida: {cache['aciertos']} aciertos, {cache['agrupadas']} peticiones agrupadas, "
+                  f"{cache['fallos']} descargas, {cache['desalojos']} desalojos")
+    for error in (informe['errores_contencion'] + informe['errores'])[:10]:
+        lineas.append(f"⚠️ {error[:200]}")
+    if not informe['errores']:
+        lineas.append("✅ Sin excepciones en la app")
+    return '\n'.join(lineas)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prueba de carga de sesiones concurrentes de la app")
+    parser.add_argument('--sesiones', type=int, default=SESIONES_DEFAULT)
+    parser.add_argument('--iteraciones', type=int, default=ITERACIONES_DEFAULT)
+    parser.add_argument('--procesos', type=int, default=1,
+                        help="Reparte las sesiones entre varios procesos (contención real de archivos)")
+    parser.add_argument('--replay', help="CSV de ticks (ticker, precio) como en streaming.py")
+    parser.add_argument('--tickers', nargs='*', default=TICKERS_DEFAULT,
+                        help="Tickers del replay sintético (si no hay --replay)")
+    parser.add_argument('--portfolio-por-sesion', action='store_true',
+                        help="Cada sesión guarda en su propio portfolio (por defecto uno compartido)")
+    parser.add_argument('--directorio', help="Directorio de trabajo (por defecto uno temporal)")
+    args = parser.parse_args()
+    # Los avisos de Streamlit de cada rerun taparían el informe
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+    ticks = cargar_ticks_csv(os.path.abspath(args.replay)) if args.replay else None
+    with tempfile.TemporaryDirectory(prefix='swing-lab-carga-') as temporal:
+        os.chdir(args.directorio or temporal)
+        print(formatear_informe(prueba_carga(args.sesiones, args.iteraciones, ticks,
+                                             [t.upper() for t in args.tickers], args.portfolio_por_sesion,
+                                             args.procesos)))
@@ -0,0 +1,299 @@
+"""Acceso a datos de mercado de Yahoo Finance en lotes.
+
+Barras, cotizaciones y fundamentales pasan por la caché compartida del proceso
+(`cache_compartida.CACHE`), así que todas las sesiones de Streamlit reutilizan la
+misma descarga y las peticiones simultáneas de un ticker se agrupan en una.
+Cada descarga trae también splits y dividendos: si aparece uno nuevo se descarta
+la caché de ese ticker (ver `acciones_corporativas`).
+"""
+import json
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+import yfinance as yf
+
+from acciones_corporativas import acciones_en, invalidar_cache_ticker, registrar_acciones
+from cache_compartida import CACHE, ttl
+from calendario import ahora_ny, barras_vigentes, precios_en_movimiento, ultima_sesion_final
+from operaciones import (ESTADO_ACTIVA, ESTADO_PENDIENTE, fechas_barras, inicio_escaneo,
+                         necesita_escaneo)
+
+COLUMNAS_OHLCV = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+DIRECTORIO_CACHE_BARRAS = 'cache_barras'
+PERIODO_CACHE = '2y'
+
+# Vigencia de lo que cambia durante la sesión (fuera de ella manda el calendario)
+TTL_COTIZACION = 15
+TTL_BARRAS_SESION = 60
+
+
+def descargar_barras(tickers, inicio=None, periodo='1mo', intervalo='1d', ajustadas=True):
+    """Descarga barras OHLCV de varios tickers en una sola llamada.
+
+    Devuelve {ticker: DataFrame}; los tickers sin datos no aparecen. Los splits y
+    dividendos que traiga se registran, y los tickers con alguno nuevo pierden sus
+    copias cacheadas (quedaron en la escala de antes del ajuste).
+    Con `ajustadas=False` los precios solo van ajustados por splits (no por dividendos):
+    son los que se comparan con los niveles de los trades, que no se tocan por un dividendo.
+    """
+    tickers = sorted(set(tickers))
+    if not tickers:
+        return {}
+
+    if inicio is not None:
+        datos = yf.download(tickers, start=inicio, interval=intervalo, group_by='ticker',
+                            auto_adjust=ajustadas, actions=True, progress=False, threads=True)
+    else:
+        datos = yf.download(tickers, period=periodo, interval=intervalo, group_by='ticker',
+                            auto_adjust=ajustadas, actions=True, progress=False, threads=True)
+
+    barras, acciones = {}, {}
+    for ticker in tickers:
+        try:
+            df = datos[ticker] if isinstance(datos.columns, pd.MultiIndex) else datos
+        except KeyError:
+            continue
+        acciones[ticker] = acciones_en(df)
+        df = df[COLUMNAS_OHLCV].dropna(subset=['Close'])
+        if not df.empty:
+            barras[ticker] = df
+    for ticker in registrar_acciones(acciones):
+        invalidar_ticker(ticker)
+    return barras
+
+
+# --- CACHÉ LOCAL DE BARRAS DIARIAS ---
+def ruta_cache_barras(ticker):
+    return os.path.join(DIRECTORIO_CACHE_BARRAS, f"{ticker.upper()}.pkl")
+
+
+def ruta_cache_info(ticker):
+    return os.path.join(DIRECTORIO_CACHE_BARRAS, f"{ticker.upper()}.info.json")
+
+
+def ruta_cache_analisis(ticker):
+    return os.path.join(DIRECTORIO_CACHE_BARRAS, f"{ticker.upper()}.analisis.pkl")
+
+
+def _vigente_en_disco(ruta):
+    """Timestamp del archivo si sigue vigente según el calendario, si no None"""
+    try:
+        modificado = os.path.getmtime(ruta)
+    except OSError:
+        return None
+    return modificado if barras_vigentes(modificado) else None
+
+
+def _leer_cache_disco(ticker):
+    ruta = ruta_cache_barras(ticker)
+    modificado = _vigente_en_disco(ruta)
+    if modificado is None:
+        return None, None
+    try:
+        return modificado, pd.read_pickle(ruta)
+    except (OSError, ValueError):
+        return None, None
+
+
+def _escribir_atomico(ruta, escribir):
+    os.makedirs(DIRECTORIO_CACHE_BARRAS, exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    escribir(temporal)
+    os.replace(temporal, ruta)
+
+
+def _escribir_cache_disco(ticker, barras):
+    _escribir_atomico(ruta_cache_barras(ticker), barras.to_pickle)
+
+
+def leer_cache_analisis(ticker):
+    """(firma, análisis) guardado en disco si sigue vigente, si no None"""
+    ruta = ruta_cache_analisis(ticker)
+    if _vigente_en_disco(ruta) is None:
+        return None
+    try:
+        return pd.read_pickle(ruta)
+    except Exception:
+        return None
+
+
+def guardar_cache_analisis(ticker, firma, analisis):
+    """Persiste los indicadores precalculados para que los vea el siguiente proceso"""
+    def escribir(ruta):
+        with open(ruta, 'wb') as f:
+            pickle.dump((firma, analisis), f, protocol=pickle.HIGHEST_PROTOCOL)
+    _escribir_atomico(ruta_cache_analisis(ticker), escribir)
+
+
+def invalidar_ticker(ticker):
+    """Descarta las copias de un ticker en disco y en la caché compartida (el resto no se toca)"""
+    for ruta in (ruta_cache_barras(ticker), ruta_cache_info(ticker), ruta_cache_analisis(ticker)):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+    invalidar_cache_ticker(ticker)
+
+
+def barras_cacheadas(tickers, refrescar=False):
+    """Barras diarias de `PERIODO_CACHE` por ticker: caché compartida -> disco -> Yahoo.
+
+    Cada ticker se descarga una vez por proceso: la caché vale mientras no haya una
+    barra diaria definitiva nueva (calendario NYSE), así que fines de semana, festivos
+    y noches no generan peticiones. Los que faltan se piden en un solo lote, y si otra
+    sesión ya los está pidiendo se espera a su descarga.
+    Devuelve {ticker: DataFrame}; los tickers sin datos no aparecen.
+    """
+    def cargar(faltan):
+        cargadas, pedir = {}, []
+        for ticker in faltan:
+            modificado, en_disco = (None, None) if refrescar else _leer_cache_disco(ticker)
+            if en_disco is not None:
+                cargadas[ticker] = (modificado, en_disco)
+            else:
+                pedir.append(ticker)
+        if pedir:
+            descargadas_en = time.time()
+            for ticker, df in descargar_barras(pedir, periodo=PERIODO_CACHE).items():
+                _escribir_cache_disco(ticker, df)
+                cargadas[ticker] = (descargadas_en, df)
+        return cargadas
+
+    return CACHE.obtener_lote('barras', sorted({t.upper() for t in tickers}), cargar,
+                              barras_vigentes, refrescar)
+
+
+def barras_ticker(ticker, refrescar=False):
+    """Barras cacheadas de un solo ticker (None si Yahoo no tiene datos)"""
+    return barras_cacheadas([ticker], refrescar).get(ticker.upper())
+
+
+def barras_en_curso(ticker):
+    """Barras cacheadas del ticker más la barra de la sesión en curso.
+
+    La caché diaria no cambia hasta el corte de después del cierre; mientras el mercado
+    se mueve se le añade la barra de hoy (compartida y vigente `TTL_BARRAS_SESION` s),
+    así que el análisis en vivo no se queda en el cierre anterior. Fuera de sesión son
+    las barras cacheadas sin más.
+    """
+    barras = barras_ticker(ticker)
+    if barras is None or not precios_en_movimiento():
+        return barras
+    sesion = barras_desde([ticker], ahora_ny().date().isoformat()).get(ticker.upper())
+    if sesion is None or sesion.empty:
+        return barras
+
+    def cargar():
+        combinadas = pd.concat([barras[barras.index < sesion.index[0]], sesion])
+        return time.time(), (barras, sesion, combinadas)
+
+    # Se recombinan solo si cambia alguna de las dos partes
+    _, _, combinadas = CACHE.obtener('barras_en_curso', ticker.upper(), cargar, ttl(TTL_BARRAS_SESION),
+                                     valida=lambda valor: valor[0] is barras and valor[1] is sesion)
+    return combinadas
+
+
+def _vigencia_sesion(creado):
+    if precios_en_movimiento():
+        return time.time() - creado < TTL_BARRAS_SESION
+    return barras_vigentes(creado)
+
+
+def barras_desde(tickers, inicio):
+    """Barras diarias desde `inicio` (YYYY-MM-DD) en un solo lote, compartidas entre sesiones.
+
+    Una descarga que empieza en `inicio` o antes sirve a cualquier petición posterior.
+    En sesión vale `TTL_BARRAS_SESION` segundos; fuera de ella, hasta el próximo corte.
+    Son barras sin ajustar por dividendos: tras una fecha ex-dividendo las anteriores
+    no bajan, así que el escaneo de Stop/TP no ve toques falsos.
+    """
+    inicio = str(inicio)[:10]
+
+    def cargar(faltan):
+        descargadas_en = time.time()
+        return {ticker: (descargadas_en, (inicio, df))
+                for ticker, df in descargar_barras(faltan, inicio=inicio, ajustadas=False).items()}
+
+    lote = CACHE.obtener_lote('barras_desde', sorted({t.upper() for t in tickers}), cargar,
+                              _vigencia_sesion, valida=lambda valor: valor[0] <= inicio)
+    return {ticker: df for ticker, (_, df) in lote.items()}
+
+
+def descargar_barras_pendientes(trades):
+    """Descarga en una sola llamada las barras diarias nuevas de todos los trades activos.
+
+    Fuera de sesión solo se piden los trades con barras definitivas sin escanear; si no
+    hay ninguno (fin de semana, noche, festivo) no se hace ninguna petición. Las barras
+    se comparten entre sesiones: si otra ya las bajó hace poco no se vuelven a pedir.
+    Devuelve {ticker: (barras, fechas)}.
+    """
+    en_movimiento, ultima_final = precios_en_movimiento(), ultima_sesion_final()
+    activos = [t for t in trades if t['status'] in (ESTADO_ACTIVA, ESTADO_PENDIENTE)
+               and necesita_escaneo(t, ultima_final, en_movimiento)]
+    if not activos:
+        return {}
+    inicio = min(inicio_escaneo(t) for t in activos)
+    barras = barras_desde([t['ticker'] for t in activos], inicio)
+    return {ticker: (df, fechas_barras(df)) for ticker, df in barras.items()}
+
+
+def _cotizacion_yahoo(ticker):
+    try:
+        hist = yf.Ticker(ticker).history(period="1d")
+    except Exception:
+        return None
+    return None if hist.empty else float(hist['Close'].iloc[-1])
+
+
+def precio_en_vivo(ticker):
+    """Último precio de la sesión (una petición ligera cada `TTL_COTIZACION` s por ticker
+    para todo el proceso); None si Yahoo no responde o si el mercado no se mueve
+    (entonces vale el último cierre de la caché)"""
+    if not precios_en_movimiento():
+        return None
+
+    def cargar():
+        precio = _cotizacion_yahoo(ticker)
+        return None if precio is None else (time.time(), precio)
+
+    return CACHE.obtener('cotizaciones', ticker.upper(), cargar, ttl(TTL_COTIZACION))
+
+
+# --- CACHÉ LOCAL DE FUNDAMENTALES (yf.Ticker.info) ---
+def _guardar_json(data):
+    def escribir(ruta):
+        with open(ruta, 'w') as f:
+            json.dump(data, f, default=str)
+    return escribir
+
+
+def info_cacheada(ticker, refrescar=False):
+    """`yf.Ticker(ticker).info` con la misma política que las barras: caché compartida -> disco -> Yahoo.
+
+    Si Yahoo falla devuelve {} y no cachea nada, así que el próximo intento vuelve a pedirlo.
+    """
+    ticker = ticker.upper()
+
+    def cargar():
+        ruta = ruta_cache_info(ticker)
+        modificado = None if refrescar else _vigente_en_disco(ruta)
+        if modificado is not None:
+            try:
+                with open(ruta, 'r') as f:
+                    return modificado, json.load(f)
+            except (OSError, ValueError):
+                pass
+        try:
+            info = yf.Ticker(ticker).info or {}
+        except Exception:
+            return None
+        if not info:
+            return None
+        _escribir_atomico(ruta, _guardar_json(info))
+        return time.time(), info
+
+    return CACHE.obtener('info', ticker, cargar, barras_vigentes, refrescar) or {}
@@ -0,0 +1,324 @@
+"""Eficacia de cada filtro: qué compuertas predicen de verdad los trades ganadores.
+
+Cada análisis evaluado en la pestaña de operación deja un registro "sombra" con el
+valor de todas las compuertas (Smart Score, upside, consenso, volumen relativo,
+RSI y régimen), se guarde o no la operación. Los registros se escriben en
+`ARCHIVO_SOMBRAS` (CSV) en cuanto se evalúan: cada cambio añade una línea y al
+leer gana la última de cada id, así que escribir nunca reescribe el archivo.
+
+El resultado de cada registro sale del trade real si se guardó y ya cerró (P/L en
+múltiplos del riesgo, R) y si no de un backtest vectorizado sobre las barras
+diarias cacheadas: primer toque de Stop (-1R) o TP 1:2 (+2R) en las
+`HORIZONTE_SESIONES` siguientes, o el cierre al final del horizonte. Después, por
+cada filtro y tramo de valores, win rate y esperanza (R medio) con group-bys de
+pandas, más la comparación de los que pasan el umbral actual contra los que no.
+
+Uso sin UI:
+    python eficacia_filtros.py [--archivo sombras_filtros.csv]
+"""
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from alertas import clave_trade
+from almacen_portfolio import bloqueo, firma_archivo
+from cache_compartida import CACHE
+from operaciones import fechas_barras
+from regimen import REGIMENES_FAVORABLES
+
+ARCHIVO_SOMBRAS = 'sombras_filtros.csv'
+HORIZONTE_SESIONES = 40
+MINIMO_TRAMO = 5  # por debajo, el tramo se muestra pero sin conclusiones
+
+# Umbrales actuales de las compuertas (los usa `validar_filtros_tipranks`)
+UMBRAL_SMART_SCORE = 8
+UMBRAL_UPSIDE = 10
+UMBRAL_VOLUMEN = 100
+RANGO_RSI = (30, 65)
+CONSENSOS_VALIDOS = ('Strong Buy', 'Moderate Buy')
+
+COLUMNAS_SOMBRA = ['id', 'registrada', 'ticker', 'fecha_analisis', 'precio', 'stop_loss',
+                   'smart_score', 'upside', 'consensus', 'volumen_relativo', 'rsi', 'regimen',
+                   'aprobada', 'decision', 'trade']
+TIPOS_SOMBRA = {'id': str, 'registrada': str, 'ticker': 'category', 'fecha_analisis': str,
+                'precio': float, 'stop_loss': float, 'smart_score': float, 'upside': float,
+                'consensus': 'category', 'volumen_relativo': float, 'rsi': float,
+                'regimen': 'category', 'aprobada': bool, 'decision': 'category', 'trade': str}
+
+# Tramos de cada filtro: límites para los numéricos (intervalos [a, b)), None para categóricos
+TRAMOS = {
+    'smart_score': [1, 4, 6, 7, 8, 9, 10, 11],
+    'upside': [-np.inf, 0, 5, 10, 15, 20, 30, np.inf],
+    'volumen_relativo': [0, 50, 80, 100, 150, 200, np.inf],
+    'rsi': [0, 30, 40, 50, 60, 65, 70, 101],
+    'consensus': None,
+    'regimen': None,
+}
+NOMBRES_FILTRO = {'smart_score': "Smart Score", 'upside': "Upside (%)", 'volumen_relativo': "Volumen relativo (%)",
+                  'rsi': "RSI", 'consensus': "Consenso", 'regimen': "Régimen"}
+
+
+# --- COMPUERTAS ---
+def pasa_compuertas(df):
+    """DataFrame booleano (una columna por filtro) con el umbral actual; NaN si falta el valor"""
+    pasa = pd.DataFrame(index=df.index)
+    pasa['smart_score'] = (df['smart_score'] >= UMBRAL_SMART_SCORE).where(df['smart_score'].notna())
+    pasa['upside'] = (df['upside'] >= UMBRAL_UPSIDE).where(df['upside'].notna())
+    pasa['consensus'] = df['consensus'].isin(CONSENSOS_VALIDOS)
+    pasa['volumen_relativo'] = (df['volumen_relativo'] >= UMBRAL_VOLUMEN).where(df['volumen_relativo'].notna())
+    pasa['rsi'] = df['rsi'].between(*RANGO_RSI).where(df['rsi'].notna())
+    pasa['regimen'] = df['regimen'].isin(REGIMENES_FAVORABLES).where(df['regimen'].notna())
+    return pasa
+
+
+def validar_filtros_tipranks(smart_score, upside, consensus, volumen_relativo=None, rsi=None, regimen=None):
+    """Valida los filtros de TipRanks + Técnicos (Volumen + RSI) + Régimen opcional.
+
+    Los que llegan como None no se evalúan (p. ej. sin datos de TipRanks en la API).
+    Devuelve ({filtro: {'pasa', 'mensaje'}}, todos_pasan).
+    """
+    filtros = {}
+    if smart_score is not None:
+        filtros['smart_score'] = {
+            'pasa': smart_score >= UMBRAL_SMART_SCORE,
+            'mensaje': f"Smart Score: {smart_score}/10 {'✅' if smart_score >= UMBRAL_SMART_SCORE else '❌'}"
+        }
+    if upside is not None:
+        filtros['upside'] = {
+            'pasa': upside >= UMBRAL_UPSIDE,
+            'mensaje': f"Upside: {upside:.1f}% {'✅' if upside >= UMBRAL_UPSIDE else f'❌ (mínimo {UMBRAL_UPSIDE}%)'}"
+        }
+    if consensus is not None:
+        filtros['consensus'] = {
+            'pasa': consensus in CONSENSOS_VALIDOS,
+            'mensaje': f"Consenso: {consensus} {'✅' if consensus in CONSENSOS_VALIDOS else '❌'}"
+        }
+
+    # Volumen por encima del promedio (> 100%)
+    if volumen_relativo is not None:
+        volumen_ok = volumen_relativo >= UMBRAL_VOLUMEN
+        filtros['volumen'] = {
+            'pasa': volumen_ok,
+            'mensaje': f"Volumen: {volumen_relativo:.0f}% {'✅' if volumen_ok else '❌ (bajo promedio)'}"
+        }
+
+    # RSI en la zona óptima swing (30-65)
+    if rsi is not None:
+        rsi_optimo = RANGO_RSI[0] <= rsi <= RANGO_RSI[1]
+        filtros['rsi'] = {
+            'pasa': rsi_optimo,
+            'mensaje': f"RSI: {rsi:.1f} {'✅' if rsi_optimo else f'❌ (óptimo {RANGO_RSI[0]}-{RANGO_RSI[1]})'}"
+        }
+
+    # Régimen de mercado (SPY vs medias 50/200, amplitud, VIX)
+    if regimen is not None:
+        filtros['regimen'] = {
+            'pasa': regimen['favorable'],
+            'mensaje': f"Mercado: {regimen['regimen']} {'✅' if regimen['favorable'] else '❌ (régimen bajista)'}"
+        }
+
+    todos_pasan = all(f['pasa'] for f in filtros.values())
+    return filtros, todos_pasan
+
+
+# --- REGISTROS SOMBRA ---
+def registro_sombra(ticker, fecha_analisis, precio, stop_loss, smart_score, upside, consensus,
+                    volumen_relativo=None, rsi=None, regimen=None, aprobada=False):
+    """Registro de un análisis con el valor de todas sus compuertas (aún sin decisión)"""
+    return {
+        'id': uuid.uuid4().hex[:12],
+        'registrada': None,
+        'ticker': ticker.upper(),
+        'fecha_analisis': str(fecha_analisis)[:10],
+        'precio': round(float(precio), 2),
+        'stop_loss': round(float(stop_loss), 2),
+        'smart_score': smart_score,
+        'upside': round(float(upside), 2),
+        'consensus': consensus,
+        'volumen_relativo': volumen_relativo,
+        'rsi': rsi,
+        'regimen': regimen,
+        'aprobada': bool(aprobada),
+        'decision': 'descartada',
+        'trade': None,
+    }
+
+
+def guardar_sombra(registro, ruta=ARCHIVO_SOMBRAS):
+    """Añade el registro al final del CSV (la cabecera si el archivo es nuevo).
+
+    Un registro que ya estaba (el análisis cambió o se guardó la operación) se añade
+    otra vez con el mismo id: `leer_sombras` se queda con la última línea de cada id.
+    """
+    registro = dict(registro, registrada=datetime.now().strftime('%Y-%m-%d %H:%M'))
+    fila = pd.DataFrame([registro], columns=COLUMNAS_SOMBRA)
+    with bloqueo(ruta):
+        fila.to_csv(ruta, mode='a', header=not os.path.exists(ruta), index=False)
+
+
+def leer_sombras(ruta=ARCHIVO_SOMBRAS):
+    """Registros sombra como DataFrame tipado, la última versión de cada id (releído solo si el archivo cambió)"""
+    firma = firma_archivo(ruta)
+    if firma is None:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in TIPOS_SOMBRA.items()})
+
+    def cargar():
+        df = pd.read_csv(ruta, dtype=TIPOS_SOMBRA, keep_default_na=True)
+        df = df.drop_duplicates('id', keep='last').reset_index(drop=True)
+        return time.time(), (firma, df)
+
+    return CACHE.obtener('sombras', os.path.abspath(ruta), cargar, lambda creado: True,
+                         valida=lambda valor: valor[0] == firma)[1]
+
+
+# --- RESULTADOS ---
+def resultados_reales(trades):
+    """{clave del trade: R realizado} de los trades cerrados con riesgo conocido"""
+    reales = {}
+    for trade in trades:
+        if not str(trade.get('status', '')).startswith('Cerrada'):
+            continue
+        stop = trade.get('stop_inicial', trade['stop_loss'])
+        riesgo = trade['acciones'] * (trade['entrada'] - stop)
+        if riesgo > 0 and trade.get('pl_actual') is not None:
+            reales[clave_trade(trade)] = trade['pl_actual'] / riesgo
+    return reales
+
+
+def backtest_sombras(sombras, barras, horizonte=HORIZONTE_SESIONES):
+    """Resultado simulado (R, salida) de cada registro sobre las barras diarias posteriores.
+
+    Entrada al precio analizado, Stop al stop_loss y objetivo en TP 1:2. Si una barra
+    toca ambos se asume el Stop; con gap bajo el Stop se sale a la apertura. Sin toque
+    en `horizonte` sesiones se sale al cierre; con menos barras el registro sigue abierto (NaN).
+    """
+    r = np.full(len(sombras), np.nan)
+    salida = np.full(len(sombras), None, dtype=object)
+    precio = sombras['precio'].to_numpy(np.float64)
+    stop = sombras['stop_loss'].to_numpy(np.float64)
+    riesgo = precio - stop
+    tp = precio + 2 * riesgo
+    validos = riesgo > 0
+    fechas_analisis = sombras['fecha_analisis'].to_numpy(dtype='U10')
+
+    for ticker, posiciones in sombras.groupby('ticker', observed=True).indices.items():
+        df = barras.get(ticker)
+        if df is None or df.empty:
+            continue
+        posiciones = posiciones[validos[posiciones]]
+        if not len(posiciones):
+            continue
+        fechas = fechas_barras(df)
+        n = len(fechas)
+        relleno = np.full(horizonte, np.nan)
+        columna = lambda nombre: np.concatenate([df[nombre].to_numpy(np.float64), relleno])
+        # La entrada es al cierre del día analizado: se evalúa desde la sesión siguiente
+        inicios = np.searchsorted(fechas, fechas_analisis[posiciones], side='right')
+        minimos = sliding_window_view(columna('Low'), horizonte)[inicios]
+        maximos = sliding_window_view(columna('High'), horizonte)[inicios]
+
+        toca_stop = minimos <= stop[posiciones, None]
+        toca_tp = maximos >= tp[posiciones, None]
+        primer_stop = np.where(toca_stop.any(axis=1), toca_stop.argmax(axis=1), horizonte)
+        primer_tp = np.where(toca_tp.any(axis=1), toca_tp.argmax(axis=1), horizonte)
+
+        por_stop = (primer_stop < horizonte) & (primer_stop <= primer_tp)
+        por_tp = (primer_tp < horizonte) & ~por_stop
+        completos = n - inicios >= horizonte
+        por_tiempo = ~por_stop & ~por_tp & completos
+
+        precio_stop = np.fmin(columna('Open')[inicios + np.minimum(primer_stop, horizonte - 1)], stop[posiciones])
+        resultado = np.full(len(posiciones), np.nan)
+        resultado[por_stop] = ((precio_stop - precio[posiciones]) / riesgo[posiciones])[por_stop]
+        resultado[por_tp] = 2.0
+        resultado[por_tiempo] = ((columna('Close')[inicios + horizonte - 1] - precio[posiciones]) / riesgo[posiciones])[por_tiempo]
+        r[posiciones] = resultado
+        salida[posiciones[por_stop]] = 'Stop Loss'
+        salida[posiciones[por_tp]] = 'TP 1:2'
+        salida[posiciones[por_tiempo]] = 'Tiempo'
+    return r, salida
+
+
+def con_resultados(sombras, barras, trades=(), horizonte=HORIZONTE_SESIONES):
+    """Registros con 'r' y 'origen' ('real' si el trade guardado ya cerró, 'backtest' si no)"""
+    df = sombras.copy()
+    r, salida = backtest_sombras(df, barras, horizonte)
+    df['r'], df['salida'], df['origen'] = r, salida, np.where(np.isnan(r), None, 'backtest')
+    reales = df['trade'].map(resultados_reales(trades)) if len(trades) else pd.Series(np.nan, index=df.index)
+    hay_real = reales.notna().to_numpy()
+    df.loc[hay_real, 'r'] = reales[hay_real]
+    df.loc[hay_real, 'salida'] = 'Real'
+    df.loc[hay_real, 'origen'] = 'real'
+    return df
+
+
+# --- ESTADÍSTICAS ---
+def _agregar(grupos):
+    tabla = grupos.agg(n=('r', 'count'), win_rate=('gana', 'mean'), esperanza_r=('r', 'mean'))
+    tabla['win_rate'] = (tabla['win_rate'] * 100).round(1)
+    tabla['esperanza_r'] = tabla['esperanza_r'].round(2)
+    tabla['suficiente'] = tabla['n'] >= MINIMO_TRAMO
+    return tabla
+
+
+def eficacia_por_tramo(df, filtro):
+    """Win rate y esperanza (R) por tramo de valores de un filtro (solo registros con resultado)"""
+    con_r = df[df['r'].notna() & df[filtro].notna()].assign(gana=lambda d: d['r'] > 0)
+    limites = TRAMOS[filtro]
+    if limites is None:
+        tramo = con_r[filtro].astype(str)
+    else:
+        tramo = pd.cut(con_r[filtro].astype(float), limites, right=False)
+    tabla = _agregar(con_r.groupby(tramo, observed=True))
+    tabla.index = tabla.index.astype(str)
+    return tabla
+
+
+def eficacia_umbral(df):
+    """Por filtro: resultados de los que pasan el umbral actual contra los que no"""
+    con_r = df[df['r'].notna()].assign(gana=lambda d: d['r'] > 0)
+    pasa = pasa_compuertas(con_r)
+    filas = []
+    for filtro in TRAMOS:
+        tabla = _agregar(con_r.groupby(pasa[filtro].map({True: 'Pasa', False: 'No pasa'}), dropna=True))
+        for etiqueta, fila in tabla.iterrows():
+            filas.append(dict(filtro=NOMBRES_FILTRO[filtro], grupo=etiqueta, **fila))
+    return pd.DataFrame(filas, columns=['filtro', 'grupo', 'n', 'win_rate', 'esperanza_r', 'suficiente'])
+
+
+def informe_eficacia(sombras, barras, trades=(), horizonte=HORIZONTE_SESIONES):
+    """{'registros', 'con_resultado', 'umbral': DataFrame, 'tramos': {filtro: DataFrame}}"""
+    df = con_resultados(sombras, barras, trades, horizonte)
+    # Los group-bys solo necesitan el resultado y las compuertas
+    columnas = df[['r', *TRAMOS]]
+    return {
+        'registros': len(df),
+        'con_resultado': int(df['r'].notna().sum()),
+        'reales': int((df['origen'] == 'real').sum()),
+        'umbral': eficacia_umbral(columnas),
+        'tramos': {filtro: eficacia_por_tramo(columnas, filtro) for filtro in TRAMOS},
+    }
+
+
+if __name__ == '__main__':
+    from datos_mercado import barras_cacheadas
+
+    parser = argparse.ArgumentParser(description="Win rate y esperanza por tramo de cada filtro")
+    parser.add_argument('--archivo', default=ARCHIVO_SOMBRAS)
+    parser.add_argument('--horizonte', type=int, default=HORIZONTE_SESIONES)
+    args = parser.parse_args()
+
+    sombras = leer_sombras(args.archivo)
+    inicio = time.perf_counter()
+    informe = informe_eficacia(sombras, barras_cacheadas(sombras['ticker'].unique()), horizonte=args.horizonte)
+    print(f"📊 {informe['registros']} registros, {informe['con_resultado']} con resultado "
+          f"({time.perf_counter() - inicio:.2f} s)")
+    print(informe['umbral'].to_string(index=False))
+    for filtro, tabla in informe['tramos'].items():
+        print(f"\n{NOMBRES_FILTRO[filtro]}\n{tabla.to_string()}")
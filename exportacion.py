@@ -0,0 +1,163 @@
+"""Exportación del historial y del portfolio en CSV, Parquet o Arrow, por bloques.
+
+Los trades se convierten a DataFrame de a `TAMANO_BLOQUE` filas y cada bloque se
+escribe directamente al destino, así que nunca se tiene la exportación completa
+en memoria dos veces (lista de trades + archivo final). Los trades pueden llegar
+como una función que devuelve un iterable (p. ej. `todos_los_trades`, que lee el
+archivo frío partición a partición): así tampoco hace falta la lista completa.
+
+Uso sin UI:
+    python exportacion.py --usuario ana --portfolio momentum --formato parquet --salida momentum.parquet
+"""
+import argparse
+import tempfile
+from itertools import islice
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+TAMANO_BLOQUE = 5000
+
+COLUMNAS_STOCK_MASTER = ['ticker', 'acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3']
+
+FORMATOS = {
+    'CSV': {'extension': 'csv', 'mime': 'text/csv'},
+    'Parquet': {'extension': 'parquet', 'mime': 'application/vnd.apache.parquet'},
+    'Arrow': {'extension': 'arrow', 'mime': 'application/vnd.apache.arrow.stream'},
+}
+
+COLUMNAS_NUMERICAS = {
+    'acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3', 'inversion', 'riesgo',
+    'precio_actual', 'pl_actual', 'upside', 'smart_score', 'precio_cierre', 'volumen_relativo', 'rsi'
+}
+
+
+def formatos_disponibles():
+    """CSV siempre; Parquet y Arrow solo si pyarrow está instalado"""
+    return list(FORMATOS) if pa is not None else ['CSV']
+
+
+def columnas_trades(trades):
+    """Unión de las claves de todos los trades, en orden de aparición"""
+    columnas = {}
+    for trade in trades:
+        for clave in trade:
+            columnas.setdefault(clave, None)
+    return list(columnas)
+
+
+def bloques(trades, columnas=None, tamano=TAMANO_BLOQUE):
+    """Genera DataFrames de como mucho `tamano` filas con columnas fijas (`trades` es cualquier iterable)"""
+    columnas = columnas or columnas_trades(trades)
+    trades = iter(trades)
+    while bloque := list(islice(trades, tamano)):
+        yield pd.DataFrame(bloque, columns=columnas)
+
+
+def escribir_csv(trades, destino, columnas=None):
+    vacio = True
+    for i, bloque in enumerate(bloques(trades, columnas)):
+        destino.write(bloque.to_csv(index=False, header=(i == 0)).encode('utf-8'))
+        vacio = False
+    if vacio and columnas:
+        destino.write((','.join(columnas) + '\n').encode('utf-8'))
+
+
+def esquema_arrow(columnas):
+    """Esquema fijo para que todos los bloques tengan los mismos tipos"""
+    campos = []
+    for columna in columnas:
+        if columna in COLUMNAS_NUMERICAS:
+            campos.append(pa.field(columna, pa.float64()))
+        elif columna == 'fecha':
+            campos.append(pa.field(columna, pa.timestamp('s')))
+        else:
+            campos.append(pa.field(columna, pa.string()))
+    return pa.schema(campos)
+
+
+def _tabla_arrow(bloque, esquema):
+    for campo in esquema:
+        if campo.name == 'fecha':
+            bloque['fecha'] = pd.to_datetime(bloque['fecha'], format='%Y-%m-%d %H:%M', errors='coerce')
+        elif pa.types.is_string(campo.type):
+            bloque[campo.name] = bloque[campo.name].map(lambda v: None if v is None or v != v else str(v))
+        else:
+            bloque[campo.name] = pd.to_numeric(bloque[campo.name], errors='coerce')
+    return pa.Table.from_pandas(bloque, schema=esquema, preserve_index=False)
+
+
+def escribir_parquet(trades, destino, columnas=None):
+    columnas = columnas or columnas_trades(trades)
+    esquema = esquema_arrow(columnas)
+    with pq.ParquetWriter(destino, esquema, compression='zstd') as writer:
+        for bloque in bloques(trades, columnas):
+            writer.write_table(_tabla_arrow(bloque, esquema))
+
+
+def escribir_arrow(trades, destino, columnas=None):
+    columnas = columnas or columnas_trades(trades)
+    esquema = esquema_arrow(columnas)
+    with pa.ipc.new_stream(destino, esquema) as writer:
+        for bloque in bloques(trades, columnas):
+            writer.write_table(_tabla_arrow(bloque, esquema))
+
+
+ESCRITORES = {'CSV': escribir_csv, 'Parquet': escribir_parquet, 'Arrow': escribir_arrow}
+
+
+def exportar(trades, formato='CSV', columnas=None, destino=None):
+    """Exporta los trades al destino (o a un archivo temporal que pasa a disco si crece).
+
+    `trades` es una lista o una función que devuelve un iterable nuevo en cada llamada;
+    con una función se recorre dos veces (columnas y datos) sin tenerlos todos a la vez.
+    Devuelve el archivo posicionado al inicio, listo para leer o descargar.
+    """
+    if callable(trades):
+        columnas = columnas or columnas_trades(trades())
+        trades = trades()
+    if destino is None:
+        destino = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    ESCRITORES[formato](trades, destino, columnas)
+    destino.seek(0)
+    return destino
+
+
+def activos_stock_master(trades):
+    """Trades activos con las acciones que siguen abiertas (tras una salida parcial no son todas)"""
+    return [dict(t, acciones=t.get('acciones_abiertas', t['acciones'])) for t in trades if t['status'] == 'Activa']
+
+
+def exportar_stock_master(trades, destino=None):
+    """CSV de trades activos en el formato de importación de Stock Master"""
+    return exportar(activos_stock_master(trades), 'CSV', COLUMNAS_STOCK_MASTER, destino)
+
+
+if __name__ == '__main__':
+    from almacen_portfolio import PORTFOLIO_DEFAULT, USUARIO_DEFAULT, cargar_portfolio, ruta_portfolio
+    from archivo_trades import resumen_archivo, todos_los_trades
+
+    parser = argparse.ArgumentParser(description="Exporta los trades de un portfolio")
+    parser.add_argument('--usuario', default=USUARIO_DEFAULT)
+    parser.add_argument('--portfolio', default=PORTFOLIO_DEFAULT)
+    parser.add_argument('--formato', choices=list(FORMATOS), default='CSV')
+    parser.add_argument('--stock-master', action='store_true', help="Solo activos, formato Stock Master")
+    parser.add_argument('--salida', required=True)
+    args = parser.parse_args()
+
+    portfolio = cargar_portfolio(args.usuario, args.portfolio) or {'trades': []}
+    ruta = ruta_portfolio(args.usuario, args.portfolio)
+    with open(args.salida, 'wb') as salida:
+        # Stock Master solo quiere los activos; el resto recorre también el archivo frío
+        if args.stock_master:
+            n = len(activos_stock_master(portfolio['trades']))
+            exportar_stock_master(portfolio['trades'], destino=salida)
+        else:
+            n = len(portfolio['trades']) + resumen_archivo(portfolio)['trades']
+            exportar(lambda: todos_los_trades(ruta, portfolio), args.formato, destino=salida)
+    print(f"✅ {n} trades exportados a {args.salida}")
@@ -0,0 +1,157 @@
+"""Importación masiva de trades desde CSV (formato Stock Master o fills de broker).
+
+Toda la validación es vectorizada sobre el DataFrame completo; los stops que
+faltan se rellenan con la regla de soporte de 20 días usando una sola descarga
+de barras para todos los tickers.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from datos_mercado import descargar_barras
+from libro_caja import registrar_trades
+
+VENTANA_SOPORTE = 20
+COLCHON_STOP = 0.98
+MAX_PCT_CAPITAL_POR_TRADE = 0.25
+
+# Alias de columnas (en minúsculas) -> nombre interno
+ALIAS_COLUMNAS = {
+    'ticker': 'ticker', 'symbol': 'ticker', 'simbolo': 'ticker', 'símbolo': 'ticker',
+    'acciones': 'acciones', 'shares': 'acciones', 'quantity': 'acciones', 'qty': 'acciones',
+    'filled qty': 'acciones', 'cantidad': 'acciones',
+    'entrada': 'entrada', 'price': 'entrada', 'fill price': 'entrada', 'avg price': 'entrada',
+    'avg fill price': 'entrada', 'precio': 'entrada',
+    'stop_loss': 'stop_loss', 'stop loss': 'stop_loss', 'stop': 'stop_loss',
+    'tp_1_2': 'tp_1_2', 'take profit 1': 'tp_1_2', 'tp1': 'tp_1_2',
+    'tp_1_3': 'tp_1_3', 'take profit 2': 'tp_1_3', 'tp2': 'tp_1_3',
+    'fecha': 'fecha', 'date': 'fecha', 'time': 'fecha', 'filled time': 'fecha', 'fill time': 'fecha',
+    'side': 'lado', 'action': 'lado', 'lado': 'lado',
+    'status': 'status', 'precio_actual': 'precio_actual', 'pl_actual': 'pl_actual',
+    'smart_score': 'smart_score', 'upside': 'upside',
+    'consensus': 'consensus', 'recomendacion': 'consensus',
+}
+
+# Lados que cuentan como compra en un export de broker (en minúsculas); el resto se descarta
+LADOS_COMPRA = {'buy', 'b', 'bot', 'bought', 'buy to open', 'long', 'compra', 'comprar'}
+
+COLUMNAS_NUMERICAS = ['acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3',
+                      'precio_actual', 'pl_actual', 'smart_score', 'upside']
+
+
+def normalizar_columnas(df):
+    """Renombra columnas conocidas y descarta las ventas de un export de broker"""
+    df = df.rename(columns=lambda c: ALIAS_COLUMNAS.get(str(c).strip().lower(), str(c).strip()))
+    df = df.loc[:, ~df.columns.duplicated()].copy()
+    for columna in COLUMNAS_NUMERICAS + ['fecha', 'status', 'consensus', 'lado']:
+        if columna not in df.columns:
+            df[columna] = np.nan
+    if df['lado'].notna().any():
+        df = df[df['lado'].isna() | df['lado'].astype(str).str.strip().str.lower().isin(LADOS_COMPRA)]
+    for columna in COLUMNAS_NUMERICAS:
+        df[columna] = pd.to_numeric(df[columna], errors='coerce').astype(float)
+    df['ticker'] = df['ticker'].astype(str).str.strip().str.upper()
+    fechas = pd.to_datetime(df['fecha'], errors='coerce')
+    df['fecha'] = fechas.fillna(pd.Timestamp(datetime.now())).dt.strftime('%Y-%m-%d %H:%M')
+    df['status'] = df['status'].where(df['status'].notna(), 'Activa')
+    return df.reset_index(drop=True)
+
+
+def rellenar_stops_soporte(df):
+    """Stop = mínimo de 20 días hasta la fecha del trade * 0.98, con una sola descarga de barras"""
+    faltan = df['stop_loss'].isna()
+    if not faltan.any():
+        return df
+    inicio = (pd.to_datetime(df.loc[faltan, 'fecha']).min() - pd.Timedelta(days=45)).strftime('%Y-%m-%d')
+    # Sin ajuste por dividendos: el stop se compara con precios reales, como la entrada
+    barras = descargar_barras(df.loc[faltan, 'ticker'].unique(), inicio=inicio, ajustadas=False)
+
+    for ticker, filas in df[faltan].groupby('ticker'):
+        if ticker not in barras:
+            continue
+        hist = barras[ticker]
+        soporte = hist['Low'].rolling(VENTANA_SOPORTE, min_periods=1).min().to_numpy()
+        fechas = np.asarray(hist.index.strftime('%Y-%m-%d'))
+        posiciones = np.searchsorted(fechas, filas['fecha'].str[:10].to_numpy(), side='right') - 1
+        validas = posiciones >= 0
+        df.loc[filas.index[validas], 'stop_loss'] = np.round(soporte[posiciones[validas]] * COLCHON_STOP, 2)
+    return df
+
+
+def validar(df, capital_disponible):
+    """Marca cada fila con el motivo de rechazo ('' si es válida). Todo vectorizado."""
+    df['tp_1_2'] = df['tp_1_2'].fillna(df['entrada'] + 2 * (df['entrada'] - df['stop_loss']))
+    df['tp_1_3'] = df['tp_1_3'].fillna(df['entrada'] + 3 * (df['entrada'] - df['stop_loss']))
+    df['inversion'] = df['acciones'] * df['entrada']
+
+    activas = df['status'] == 'Activa'
+    reglas = [
+        (df['ticker'].isin(['', 'NAN']), "Ticker vacío"),
+        (~(df['acciones'] > 0), "Acciones inválidas"),
+        (~(df['entrada'] > 0), "Entrada inválida"),
+        (df['stop_loss'].isna(), "Sin Stop Loss (no hay barras para el soporte 20d)"),
+        (~(df['stop_loss'] < df['entrada']), "Stop Loss debe ser menor que entrada"),
+        (~(df['tp_1_2'] > df['entrada']), "TP 1:2 debe ser mayor que entrada"),
+        (~(df['tp_1_3'] >= df['tp_1_2']), "TP 1:3 debe ser mayor o igual que TP 1:2"),
+        (activas & (df['inversion'] > capital_disponible * MAX_PCT_CAPITAL_POR_TRADE),
+         f"Inversión supera el {MAX_PCT_CAPITAL_POR_TRADE:.0%} del capital"),
+    ]
+    df['motivo'] = ''
+    for mascara, motivo in reversed(reglas):
+        df.loc[mascara.fillna(False), 'motivo'] = motivo
+
+    # Capital: las posiciones activas válidas consumen capital en orden hasta agotarlo
+    consumo = df['inversion'].where(activas & (df['motivo'] == ''), 0).cumsum()
+    df.loc[activas & (df['motivo'] == '') & (consumo > capital_disponible), 'motivo'] = "Capital insuficiente"
+    return df
+
+
+def _redondear(df):
+    df = df.copy()
+    for columna in ['acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3', 'inversion']:
+        df[columna] = df[columna].round(2)
+    df['riesgo'] = (df['acciones'] * (df['entrada'] - df['stop_loss'])).round(2)
+    df['precio_actual'] = df['precio_actual'].fillna(df['entrada']).round(2)
+    df['pl_actual'] = df['pl_actual'].fillna(0.0).round(2)
+    df['smart_score'] = df['smart_score'].fillna(5).astype(int)
+    df['upside'] = df['upside'].fillna(0.0)
+    df['consensus'] = df['consensus'].fillna('Hold')
+    return df.sort_values('fecha', ascending=False, kind='stable')
+
+
+def a_operaciones_historial(df):
+    df = _redondear(df)
+    df['recomendacion'] = df['consensus']
+    return df[['fecha', 'ticker', 'acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3',
+               'inversion', 'riesgo', 'smart_score', 'upside', 'recomendacion', 'status',
+               'precio_actual', 'pl_actual']].to_dict('records')
+
+
+def a_trades_portfolio(df):
+    df = _redondear(df)
+    return df[['fecha', 'ticker', 'acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3',
+               'inversion', 'status', 'precio_actual', 'pl_actual', 'smart_score', 'upside',
+               'consensus']].to_dict('records')
+
+
+def preparar_importacion(archivo_csv, capital_disponible, rellenar_stops=True):
+    """Lee, normaliza, rellena stops y valida. Devuelve (validas, rechazadas) como DataFrames."""
+    df = normalizar_columnas(pd.read_csv(archivo_csv))
+    if rellenar_stops:
+        df = rellenar_stops_soporte(df)
+    df = validar(df, capital_disponible)
+    return df[df['motivo'] == ''].drop(columns='motivo'), df[df['motivo'] != '']
+
+
+def aplicar_importacion(validas, historial, portfolio=None):
+    """Inserta todas las filas válidas en historial y portfolio de una vez.
+
+    El portfolio (si se pasa) se modifica primero; si falla, el historial no se toca.
+    """
+    if portfolio is not None:
+        trades = a_trades_portfolio(validas)
+        registrar_trades(portfolio, trades)
+        portfolio['trades'][:0] = trades
+    historial[:0] = a_operaciones_historial(validas)
+    return len(validas)
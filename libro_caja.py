@@ -0,0 +1,271 @@
+"""Libro de caja de partida doble de cada portfolio, con snapshots de saldos.
+
+Cada evento de efectivo (aportación inicial, entrada ejecutada, salida parcial o
+total, trade importado) es un asiento que solo se añade, nunca se modifica, con
+líneas por cuenta que suman cero:
+  - caja: efectivo disponible
+  - posiciones: coste de las acciones abiertas
+  - comisiones: gasto en comisiones
+  - resultados: P/L realizado (con signo contable: una ganancia es un haber, negativo)
+  - capital: aportación de los socios (haber)
+
+Cada `INTERVALO_SNAPSHOT` asientos se guarda un snapshot con los saldos
+acumulados, así que el saldo actual es el último snapshot más una cola corta, y el
+saldo a una fecha parte del último snapshot anterior a ella. `conciliar` recalcula
+todo contra los trades bajo demanda.
+
+El libro vive dentro del JSON del portfolio (`libro`), así que se escribe en el
+mismo cambio atómico que los trades. Sustituye al antiguo `capital_actual`, que
+se migra la primera vez que se abre el portfolio.
+
+Los asientos anteriores al último snapshot pasan al archivo frío
+(`archivo_trades.archivar_asientos`) y el JSON guarda solo los snapshots y la
+cola: `base` es el `seq` del primer asiento que sigue en el JSON. Las consultas
+que necesitan asientos archivados (saldo a una fecha pasada, conciliación)
+reciben `archivo(desde, hasta)`, que devuelve los de `seq` en [desde, hasta).
+"""
+import bisect
+from collections import defaultdict
+from datetime import datetime
+
+from alertas import clave_trade
+
+CUENTAS = ('caja', 'posiciones', 'comisiones', 'resultados', 'capital')
+INTERVALO_SNAPSHOT = 50
+TOLERANCIA = 0.01
+ESTADOS_SIN_EFECTIVO = ('Pendiente', 'Cancelada')
+
+
+def _fecha(fecha):
+    return (fecha or datetime.now().strftime('%Y-%m-%d'))[:10]
+
+
+# --- ASIENTOS ---
+def libro(portfolio):
+    """Libro del portfolio; lo crea (migrando `capital_actual` y los trades) si no existe"""
+    if 'libro' not in portfolio:
+        _migrar(portfolio)
+    return portfolio['libro']
+
+
+def registrar_asiento(portfolio, fecha, concepto, lineas, trade=None):
+    """Añade un asiento (líneas {cuenta: importe} que deben sumar cero) y snapshotea si toca"""
+    if abs(sum(lineas.values())) > 1e-6:
+        raise ValueError(f"Asiento descuadrado ({concepto}): {lineas}")
+    datos = libro(portfolio)
+    asiento = {'seq': _siguiente(datos), 'fecha': _fecha(fecha), 'concepto': concepto,
+               'lineas': {c: v for c, v in lineas.items() if v}}
+    if trade is not None:
+        asiento['trade'] = clave_trade(trade)
+    datos['asientos'].append(asiento)
+    ultimo = datos['snapshots'][-1]['seq'] if datos['snapshots'] else 0
+    if _siguiente(datos) - ultimo >= INTERVALO_SNAPSHOT:
+        _snapshot(datos)
+    return asiento
+
+
+def _siguiente(datos):
+    """`seq` del próximo asiento (los archivados también cuentan)"""
+    return datos.get('base', 0) + len(datos['asientos'])
+
+
+def _tramo(datos, desde, hasta=None, archivo=None):
+    """Asientos con `seq` en [desde, hasta): los archivados (por debajo de `base`) y los del JSON"""
+    base = datos.get('base', 0)
+    hasta = _siguiente(datos) if hasta is None else hasta
+    tramo = []
+    if desde < base:
+        if archivo is None:
+            raise ValueError("Hacen falta los asientos archivados del libro (`archivo`)")
+        tramo = archivo(desde, min(hasta, base))
+    return tramo + datos['asientos'][max(desde - base, 0):max(hasta - base, 0)]
+
+
+def ultimos_asientos(portfolio, n, archivo=None):
+    """Los `n` asientos más recientes (del archivo si la cola del JSON no llega)"""
+    datos = libro(portfolio)
+    desde = max(_siguiente(datos) - n, 0)
+    if archivo is None:
+        desde = max(desde, datos.get('base', 0))
+    return _tramo(datos, desde, archivo=archivo)
+
+
+def _snapshot(datos):
+    snapshots, asientos = datos['snapshots'], datos['asientos']
+    anterior = snapshots[-1] if snapshots else {'seq': 0, 'saldos': {}, 'fecha_max': ''}
+    # Los asientos se archivan hasta el último snapshot: el bloque sigue en el JSON
+    bloque = asientos[anterior['seq'] - datos.get('base', 0):]
+    saldos = defaultdict(float, anterior['saldos'])
+    for asiento in bloque:
+        for cuenta, importe in asiento['lineas'].items():
+            saldos[cuenta] += importe
+    snapshots.append({'seq': _siguiente(datos), 'saldos': dict(saldos),
+                      'fecha_max': max([anterior['fecha_max']] + [a['fecha'] for a in bloque]),
+                      'fecha_min': min(a['fecha'] for a in bloque)})
+
+
+def asiento_apertura(portfolio, capital, fecha=None):
+    return registrar_asiento(portfolio, fecha, 'apertura', {'caja': capital, 'capital': -capital})
+
+
+def asiento_entrada(portfolio, trade, fecha, coste, comision=0.0):
+    """Compra ejecutada: sale de caja el coste más la comisión"""
+    return registrar_asiento(portfolio, fecha, 'entrada',
+                             {'caja': -(coste + comision), 'posiciones': coste, 'comisiones': comision}, trade)
+
+
+def asiento_salida(portfolio, trade, fecha, acciones, precio, comision=0.0, concepto='salida'):
+    """Venta (parcial o total) al precio dado: sale de posiciones la parte proporcional del coste"""
+    importe = round(acciones * precio, 2)
+    coste = trade['inversion'] * acciones / trade['acciones']
+    return registrar_asiento(portfolio, fecha, concepto,
+                             {'caja': importe - comision, 'posiciones': -coste,
+                              'comisiones': comision, 'resultados': coste - importe}, trade)
+
+
+# --- SALDOS ---
+def saldos(portfolio, fecha=None, archivo=None):
+    """Saldo de cada cuenta (al cierre de `fecha` YYYY-MM-DD, o el actual).
+
+    El actual solo usa el JSON; a una fecha pasada puede necesitar `archivo`.
+    """
+    datos = libro(portfolio)
+    snapshots = datos['snapshots']
+    if fecha is None:
+        base = snapshots[-1] if snapshots else None
+        resultado = defaultdict(float, base['saldos'] if base else {})
+        for asiento in _tramo(datos, base['seq'] if base else 0):
+            for cuenta, importe in asiento['lineas'].items():
+                resultado[cuenta] += importe
+        return {c: resultado[c] for c in CUENTAS}
+
+    fecha = fecha[:10]
+    # Último snapshot cuyos asientos son todos de `fecha` o anteriores
+    i = bisect.bisect_right(snapshots, fecha, key=lambda s: s['fecha_max']) - 1
+    resultado = defaultdict(float, snapshots[i]['saldos'] if i >= 0 else {})
+    desde = snapshots[i]['seq'] if i >= 0 else 0
+    # Los bloques posteriores solo se recorren si tienen asientos con fecha anterior (retroactivos)
+    for snapshot in snapshots[i + 1:]:
+        if snapshot['fecha_min'] <= fecha:
+            for asiento in _tramo(datos, desde, snapshot['seq'], archivo):
+                if asiento['fecha'] <= fecha:
+                    for cuenta, importe in asiento['lineas'].items():
+                        resultado[cuenta] += importe
+        desde = snapshot['seq']
+    for asiento in _tramo(datos, desde, archivo=archivo):
+        if asiento['fecha'] <= fecha:
+            for cuenta, importe in asiento['lineas'].items():
+                resultado[cuenta] += importe
+    return {c: resultado[c] for c in CUENTAS}
+
+
+def saldo_caja(portfolio, fecha=None):
+    return saldos(portfolio, fecha)['caja']
+
+
+# --- MIGRACIÓN Y CONCILIACIÓN ---
+def _comision_entrada(trade):
+    return trade.get('comisiones', 0.0) - sum(s['comision'] for s in trade.get('salidas', []))
+
+
+def caja_esperada_trade(trade):
+    """Efectivo neto que el trade ha movido según sus propios campos"""
+    if trade['status'] in ESTADOS_SIN_EFECTIVO:
+        return 0.0
+    salidas = trade.get('salidas', [])
+    caja = -trade['inversion'] - _comision_entrada(trade)
+    caja += sum(round(s['acciones'] * s['precio'], 2) - s['comision'] for s in salidas)
+    # Trades cerrados sin detalle de salidas (antiguos o importados): vuelve la inversión más el P/L
+    if not salidas and trade['status'] != 'Activa':
+        caja += trade['inversion'] + (trade.get('pl_actual') or 0.0)
+    return caja
+
+
+def _asientos_trade(portfolio, trade):
+    """Asientos que reconstruyen un trade existente al migrar o importar"""
+    if trade['status'] in ESTADOS_SIN_EFECTIVO:
+        return
+    fecha = trade.get('barra_entrada') or trade['fecha']
+    salidas = trade.get('salidas', [])
+    asiento_entrada(portfolio, trade, fecha, trade['inversion'], _comision_entrada(trade))
+    for s in salidas:
+        asiento_salida(portfolio, trade, s['barra'], s['acciones'], s['precio'], s['comision'],
+                       concepto=s['motivo'])
+    if not salidas and trade['status'] != 'Activa':
+        pl = trade.get('pl_actual') or 0.0
+        registrar_asiento(portfolio, trade.get('barra_cierre') or fecha, 'cierre',
+                          {'caja': trade['inversion'] + pl, 'posiciones': -trade['inversion'],
+                           'resultados': -pl}, trade)
+
+
+def registrar_trades(portfolio, trades):
+    """Asientos de trades que entran ya ejecutados (importación)"""
+    for trade in sorted(trades, key=lambda t: t['fecha']):
+        _asientos_trade(portfolio, trade)
+
+
+def _migrar(portfolio):
+    """Crea el libro desde los trades; la deriva del `capital_actual` antiguo queda registrada"""
+    anterior = portfolio.pop('capital_actual', None)
+    portfolio['libro'] = {'asientos': [], 'snapshots': []}
+    trades = portfolio.get('trades', [])
+    apertura = min((t['fecha'] for t in trades), default=None)
+    asiento_apertura(portfolio, portfolio['capital_inicial'], apertura)
+    registrar_trades(portfolio, trades)
+    if anterior is not None:
+        portfolio['libro']['deriva_migracion'] = round(anterior - saldo_caja(portfolio), 2)
+
+
+def conciliar(portfolio, trades=None, archivo=None):
+    """Compara el libro con los trades: saldo de caja, efectivo por trade, cuadre de asientos
+    y snapshots. Devuelve un informe con las diferencias (vacías si todo cuadra).
+
+    `trades`: todos los del portfolio, archivados incluidos (por defecto los del JSON).
+    `archivo`: lector de los asientos archivados, si los hay.
+    """
+    datos = libro(portfolio)
+    # Todos los asientos, desde el primero: la posición en la lista es su `seq`
+    asientos = _tramo(datos, 0, archivo=archivo)
+    descuadrados = [a['seq'] for a in asientos if abs(sum(a['lineas'].values())) > 1e-6]
+
+    por_trade = defaultdict(float)
+    for asiento in asientos:
+        if 'trade' in asiento:
+            por_trade[asiento['trade']] += asiento['lineas'].get('caja', 0.0)
+    diferencias_trades = []
+    esperada_total = portfolio['capital_inicial']
+    vistos = set()
+    for trade in portfolio['trades'] if trades is None else trades:
+        clave = clave_trade(trade)
+        vistos.add(clave)
+        esperada = caja_esperada_trade(trade)
+        esperada_total += esperada
+        if abs(por_trade.get(clave, 0.0) - esperada) > TOLERANCIA:
+            diferencias_trades.append({'trade': clave, 'libro': round(por_trade.get(clave, 0.0), 2),
+                                       'trades': round(esperada, 2)})
+    huerfanos = sorted(c for c in por_trade if c not in vistos and abs(por_trade[c]) > TOLERANCIA)
+
+    acumulado, snapshots_erroneos, desde = defaultdict(float), [], 0
+    for snapshot in datos['snapshots']:
+        for asiento in asientos[desde:snapshot['seq']]:
+            for cuenta, importe in asiento['lineas'].items():
+                acumulado[cuenta] += importe
+        desde = snapshot['seq']
+        if any(abs(acumulado[c] - snapshot['saldos'].get(c, 0.0)) > TOLERANCIA for c in CUENTAS):
+            snapshots_erroneos.append(snapshot['seq'])
+
+    saldo = saldo_caja(portfolio)
+    return {
+        'saldo_libro': round(saldo, 2),
+        'saldo_trades': round(esperada_total, 2),
+        'diferencia': round(saldo - esperada_total, 2),
+        'cuadra': (abs(saldo - esperada_total) <= TOLERANCIA and not descuadrados
+                   and not diferencias_trades and not huerfanos and not snapshots_erroneos),
+        'asientos': len(asientos),
+        'asientos_descuadrados': descuadrados,
+        'trades_con_diferencias': diferencias_trades,
+        'asientos_sin_trade': huerfanos,
+        'snapshots_erroneos': snapshots_erroneos,
+        # Diferencia entre el antiguo `capital_actual` y lo que justificaban los trades al migrar
+        'deriva_migracion': datos.get('deriva_migracion'),
+    }
@@ -0,0 +1,145 @@
+"""Registro de métodos de Stop Loss calculados sobre un único DataFrame de barras.
+
+Cada método recibe las barras y unos intermedios compartidos (rango verdadero, ATR,
+mínimos/máximos móviles) que se calculan una sola vez, y devuelve el nivel de stop
+para cada barra como un array. Así el análisis de un ticker, la comparativa de la UI
+y la evaluación de un universo completo salen de la misma pasada vectorizada, sin
+descargas adicionales.
+
+Para añadir un método basta con `registrar_metodo_stop(...)`.
+"""
+import numpy as np
+import pandas as pd
+
+BARRAS_MES = 21
+COLCHON_STOP = 0.98
+PERIODO_ATR = 14
+MULTIPLO_ATR = 2.0
+PERIODO_CHANDELIER = 22
+MULTIPLO_CHANDELIER = 3.0
+BARRAS_PIVOTE = 3
+PCT_STOP = 0.05
+
+METODO_DEFAULT = 'soporte_20d'
+
+METODOS_STOP = {}
+
+
+def registrar_metodo_stop(clave, nombre, descripcion, calcular):
+    """Registra un método: `calcular(barras, comun)` -> array de stops por barra"""
+    METODOS_STOP[clave] = {'nombre': nombre, 'descripcion': descripcion, 'calcular': calcular}
+
+
+def intermedios(barras):
+    """Series compartidas por todos los métodos, calculadas una vez"""
+    maximos, minimos, cierres = barras['High'], barras['Low'], barras['Close']
+    cierre_previo = cierres.shift(1)
+    rango_verdadero = pd.concat([maximos - minimos, (maximos - cierre_previo).abs(),
+                                 (minimos - cierre_previo).abs()], axis=1).max(axis=1)
+    return {
+        'cierres': cierres,
+        'minimos': minimos,
+        'rango_verdadero': rango_verdadero,
+        # ATR de Wilder (media exponencial con alfa = 1/periodo)
+        'atr': rango_verdadero.ewm(alpha=1 / PERIODO_ATR, adjust=False, min_periods=PERIODO_ATR).mean(),
+        'atr_chandelier': rango_verdadero.ewm(alpha=1 / PERIODO_CHANDELIER, adjust=False,
+                                              min_periods=PERIODO_CHANDELIER).mean(),
+        'minimo_mes': minimos.rolling(BARRAS_MES, min_periods=1).min(),
+        'maximo_chandelier': maximos.rolling(PERIODO_CHANDELIER, min_periods=1).max(),
+    }
+
+
+# --- MÉTODOS ---
+def _stop_soporte(barras, comun):
+    return comun['minimo_mes'] * COLCHON_STOP
+
+
+def _stop_atr(barras, comun):
+    return comun['cierres'] - MULTIPLO_ATR * comun['atr']
+
+
+def _stop_chandelier(barras, comun):
+    return comun['maximo_chandelier'] - MULTIPLO_CHANDELIER * comun['atr_chandelier']
+
+
+def _stop_pivote(barras, comun):
+    """Último mínimo de swing confirmado (menor que las `BARRAS_PIVOTE` barras a cada lado)"""
+    minimos = comun['minimos']
+    ventana = 2 * BARRAS_PIVOTE + 1
+    es_pivote = minimos.rolling(ventana, center=True).min() == minimos
+    # Un pivote solo se conoce `BARRAS_PIVOTE` barras después
+    return minimos.where(es_pivote).shift(BARRAS_PIVOTE).ffill() * COLCHON_STOP
+
+
+def _stop_porcentaje(barras, comun):
+    return comun['cierres'] * (1 - PCT_STOP)
+
+
+registrar_metodo_stop('soporte_20d', "Soporte 20 Días",
+                      "Mínimo de 4 semanas con colchón del 2%", _stop_soporte)
+registrar_metodo_stop('atr', f"ATR x{MULTIPLO_ATR:g}",
+                      f"Cierre menos {MULTIPLO_ATR:g} ATR({PERIODO_ATR})", _stop_atr)
+registrar_metodo_stop('chandelier', "Chandelier Exit",
+                      f"Máximo de {PERIODO_CHANDELIER} barras menos {MULTIPLO_CHANDELIER:g} ATR({PERIODO_CHANDELIER})",
+                      _stop_chandelier)
+registrar_metodo_stop('pivote', "Pivote Swing",
+                      f"Último mínimo de swing ({BARRAS_PIVOTE} barras a cada lado) con colchón del 2%",
+                      _stop_pivote)
+registrar_metodo_stop('porcentaje', f"Porcentaje {PCT_STOP:.0%}",
+                      f"Cierre menos un {PCT_STOP:.0%} fijo", _stop_porcentaje)
+
+
+def nombres_metodos():
+    return {clave: metodo['nombre'] for clave, metodo in METODOS_STOP.items()}
+
+
+def calcular_stops(barras, metodos=None):
+    """Stops de cada método para todas las barras: {clave: np.ndarray} (NaN sin datos)"""
+    comun = intermedios(barras)
+    return {clave: np.asarray(METODOS_STOP[clave]['calcular'](barras, comun), dtype=np.float64)
+            for clave in (metodos or METODOS_STOP)}
+
+
+def stops_en(stops, i):
+    """Stops de la barra i redondeados (None si no hay datos)"""
+    return {clave: (None if np.isnan(valores[i]) else round(float(valores[i]), 2))
+            for clave, valores in stops.items()}
+
+
+def comparar_stops(stops_barra, precio):
+    """Tabla para la UI: nivel, distancia y validez (stop por debajo del precio) por método"""
+    filas = []
+    for clave, stop in stops_barra.items():
+        valido = stop is not None and 0 < stop < precio
+        filas.append({
+            'clave': clave,
+            'Método': METODOS_STOP[clave]['nombre'],
+            'Stop': stop,
+            'Distancia %': round((precio - stop) / precio * 100, 2) if stop is not None else None,
+            'Riesgo/Acción': round(precio - stop, 2) if valido else None,
+            'Válido': valido,
+        })
+    return pd.DataFrame(filas)
+
+
+def evaluar_universo(barras_por_ticker, fecha=None, metodos=None):
+    """Stops de todos los métodos para cada ticker a una fecha (la última barra si None).
+
+    Trabaja sobre barras ya descargadas (p. ej. `barras_cacheadas`): no hace peticiones.
+    Devuelve un DataFrame con una fila por ticker: cierre y un stop por método.
+    """
+    filas = []
+    for ticker, barras in barras_por_ticker.items():
+        if barras is None or barras.empty:
+            continue
+        i = len(barras) - 1
+        if fecha is not None:
+            fechas = np.asarray(barras.index.strftime('%Y-%m-%d'))
+            i = int(np.searchsorted(fechas, str(fecha)[:10], side='right')) - 1
+            if i < 0:
+                continue
+        fila = {'ticker': ticker, 'fecha': barras.index[i].strftime('%Y-%m-%d'),
+                'cierre': round(float(barras['Close'].iloc[i]), 2)}
+        fila.update(stops_en(calcular_stops(barras, metodos), i))
+        filas.append(fila)
+    return pd.DataFrame(filas)
@@ -0,0 +1,187 @@
+"""Ciclo de vida de los trades: evaluación de Stop Loss / Take Profit y cierre.
+
+Funciones puras sobre los dicts del historial, compartidas por la app de
+Streamlit y los procesos sin UI (streaming, jobs). El portfolio de forward
+testing lo ejecuta el broker simulado (`broker.py`) con estos mismos estados.
+"""
+import numpy as np
+
+from calendario import precios_en_movimiento, ultima_sesion_final
+
+ESTADO_ACTIVA = 'Activa'
+ESTADO_STOP = 'Cerrada (Stop Loss)'
+ESTADO_TP_1_2 = 'Cerrada (TP 1:2)'
+ESTADO_TP_1_3 = 'Cerrada (TP 1:3)'
+ESTADO_TRAILING = 'Cerrada (Trailing Stop)'
+# Órdenes de entrada del broker simulado que aún no se han ejecutado (o caducaron)
+ESTADO_PENDIENTE = 'Pendiente'
+ESTADO_CANCELADA = 'Cancelada'
+
+# Máximo del capital por operación (swing: permite 4-5 posiciones simultáneas)
+LIMITE_POSICION = 0.25
+# Riesgo real admitido sobre el planificado antes de rechazar la operación
+TOLERANCIA_RIESGO = 1.15
+
+
+def evaluar_niveles(trade, precio):
+    """Devuelve el estado de cierre si el precio toca el Stop o el TP 1:2, si no None"""
+    if precio <= trade['stop_loss']:
+        return ESTADO_STOP
+    if precio >= trade['tp_1_2']:
+        return ESTADO_TP_1_2
+    return None
+
+
+def _cerrar_historial(op, estado):
+    op['status'] = estado
+    op['pl_actual'] = -op['riesgo'] if estado == ESTADO_STOP else op['riesgo'] * 2
+
+
+def aplicar_precio_historial(op, precio):
+    """Actualiza precio y P/L de una operación del historial y la cierra si toca SL/TP"""
+    op['precio_actual'] = round(precio, 2)
+    op['pl_actual'] = round((precio - op['entrada']) * op['acciones'], 2)
+
+    estado = evaluar_niveles(op, precio)
+    if estado is not None:
+        _cerrar_historial(op, estado)
+    return estado
+
+
+# --- TAMAÑO DE POSICIÓN ---
+def calcular_posicion(capital, riesgo_pct, entrada, stop_loss):
+    """Acciones para arriesgar `riesgo_pct`% del capital, con el límite de capital por operación.
+
+    'limite' dice qué recortó la posición: 'capital' (no alcanza), 'diversificacion'
+    (más del `LIMITE_POSICION` del capital) o None.
+    """
+    if not (entrada > 0 and 0 < stop_loss < entrada):
+        raise ValueError("El Stop Loss debe ser positivo y menor que la entrada")
+    dinero_en_riesgo = capital * (riesgo_pct / 100)
+    riesgo_por_accion = entrada - stop_loss
+    acciones = dinero_en_riesgo / riesgo_por_accion
+    inversion = acciones * entrada
+    riesgo_real = dinero_en_riesgo
+    maximo = capital * LIMITE_POSICION
+    limite = 'capital' if inversion > capital else 'diversificacion' if inversion > maximo else None
+    if limite is not None:
+        inversion = capital if limite == 'capital' else maximo
+        acciones = inversion / entrada
+        riesgo_real = acciones * riesgo_por_accion
+    return {
+        'acciones': acciones,
+        'inversion': inversion,
+        'riesgo_real': riesgo_real,
+        'entrada': entrada,
+        'stop_loss': stop_loss,
+        'tp_1_2': entrada + riesgo_por_accion * 2,
+        'tp_1_3': entrada + riesgo_por_accion * 3,
+        'riesgo_por_accion': riesgo_por_accion,
+        'dinero_en_riesgo': dinero_en_riesgo,
+        'limite': limite,
+        'aprobada': riesgo_real <= dinero_en_riesgo * TOLERANCIA_RIESGO,
+    }
+
+
+# --- DETECCIÓN POR RANGO DE BARRAS ---
+def inicio_escaneo(trade):
+    """Fecha (YYYY-MM-DD) a partir de la cual hay que pedir barras para el trade"""
+    return trade.get('ultima_barra') or trade['fecha'][:10]
+
+
+def necesita_escaneo(trade, ultima_final=None, en_movimiento=None):
+    """True si el trade puede tener barras nuevas: la sesión está en curso o hay barras
+    definitivas posteriores a su checkpoint. Fuera de sesión, pedir barras no aporta nada."""
+    if en_movimiento is None:
+        en_movimiento = precios_en_movimiento()
+    if en_movimiento:
+        return True
+    ultima_final = ultima_final or ultima_sesion_final()
+    if trade.get('ultima_barra'):
+        return trade['ultima_barra'] < ultima_final
+    return trade['fecha'][:10] <= ultima_final
+
+
+def fechas_barras(barras):
+    """Fechas de las barras como array de strings YYYY-MM-DD (orden cronológico)"""
+    return np.asarray(barras.index.strftime('%Y-%m-%d'))
+
+
+def escanear_barras(trade, barras, fechas=None, ultima_final=None):
+    """Recorre solo las barras nuevas desde el checkpoint del trade buscando un toque de SL/TP.
+
+    Devuelve un dict con el primer toque ('estado', 'barra', 'precio') o estado None,
+    el último cierre ('precio_ultimo') y el nuevo checkpoint ('ultima_barra').
+    Si una misma barra toca Stop y TP se asume el Stop, salvo que abra por encima del TP.
+    Solo se hace checkpoint de barras definitivas (hasta `ultima_final`, según el calendario).
+    """
+    if fechas is None:
+        fechas = fechas_barras(barras)
+    ultima_final = ultima_final or ultima_sesion_final()
+
+    if trade.get('ultima_barra'):
+        desde = np.searchsorted(fechas, trade['ultima_barra'], side='right')
+        entrada = None
+    else:
+        desde = np.searchsorted(fechas, trade['fecha'][:10], side='left')
+        entrada = desde if desde < len(fechas) and fechas[desde] == trade['fecha'][:10] else None
+
+    resultado = {'estado': None, 'barra': None, 'precio': None,
+                 'precio_ultimo': None, 'ultima_barra': trade.get('ultima_barra')}
+    if desde >= len(fechas):
+        return resultado
+
+    aperturas = barras['Open'].to_numpy()[desde:]
+    minimos = barras['Low'].to_numpy()[desde:]
+    maximos = barras['High'].to_numpy()[desde:]
+    if entrada is not None:
+        # La barra del día de entrada incluye precios anteriores a ella: solo cuenta su
+        # cierre (barra plana), que sí es posterior
+        aperturas, minimos, maximos = aperturas.copy(), minimos.copy(), maximos.copy()
+        aperturas[0] = minimos[0] = maximos[0] = barras['Close'].to_numpy()[entrada]
+    stop, tp = trade['stop_loss'], trade['tp_1_2']
+
+    toques = (minimos <= stop) | (maximos >= tp)
+    if toques.any():
+        i = int(np.argmax(toques))
+        if minimos[i] <= stop and not aperturas[i] >= tp:
+            resultado['estado'] = ESTADO_STOP
+            resultado['precio'] = float(min(aperturas[i], stop))
+        else:
+            resultado['estado'] = ESTADO_TP_1_2
+            resultado['precio'] = float(max(aperturas[i], tp))
+        resultado['barra'] = str(fechas[desde + i])
+        resultado['precio_ultimo'] = resultado['precio']
+        resultado['ultima_barra'] = resultado['barra']
+        return resultado
+
+    resultado['precio_ultimo'] = float(barras['Close'].to_numpy()[-1])
+    # Sin checkpoint de la barra de una sesión en curso (se vuelve a escanear en el próximo
+    # refresh) ni de la del día de entrada, evaluada solo por su cierre
+    posteriores = fechas[desde + (entrada is not None):]
+    cerradas = posteriores[posteriores <= ultima_final]
+    if len(cerradas):
+        resultado['ultima_barra'] = str(cerradas[-1])
+    return resultado
+
+
+def _registrar_escaneo(trade, escaneo):
+    if escaneo['ultima_barra']:
+        trade['ultima_barra'] = escaneo['ultima_barra']
+    if escaneo['estado'] is not None:
+        trade['barra_cierre'] = escaneo['barra']
+        trade['precio_cierre'] = round(escaneo['precio'], 2)
+
+
+def aplicar_barras_historial(op, barras, fechas=None):
+    """Evalúa las barras nuevas de una operación del historial"""
+    escaneo = escanear_barras(op, barras, fechas)
+    if escaneo['precio_ultimo'] is None:
+        return None
+    _registrar_escaneo(op, escaneo)
+    if escaneo['estado'] is None:
+        return aplicar_precio_historial(op, escaneo['precio_ultimo'])
+    op['precio_actual'] = round(escaneo['precio'], 2)
+    _cerrar_historial(op, escaneo['estado'])
+    return escaneo['estado']
+
@@ -0,0 +1,172 @@
+"""Precalentamiento de las cachés de mercado antes de la apertura.
+
+Carga la watchlist configurada más los tickers activos de todos los portfolios,
+descarga sus barras y fundamentales a la caché local y precalcula los indicadores
+(que también quedan en disco, junto a las barras), todo en un pool de hilos acotado.
+Al final ajusta los trades abiertos de todos los portfolios a los splits que hayan
+aparecido en las barras descargadas.
+
+Lo que sigue yendo a Yahoo en cada "ANALIZAR TODO": la cotización en vivo
+(`precio_en_vivo`, 15 s) y, con el mercado abierto, la barra de hoy (`barras_desde`,
+compartida 60 s) con la que se recalculan los indicadores. Fuera de sesión el
+análisis sale entero de la caché que deja este script. Lanzado desde la app con el
+mercado abierto también descarga la barra de hoy por lotes y calienta el análisis en curso.
+
+Uso sin UI (por ejemplo desde cron, de lunes a viernes a las 8:30):
+    30 8 * * 1-5  cd /ruta/swing-lab && python precalentar.py --trabajadores 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from acciones_corporativas import ajustar_portfolios
+from almacen_portfolio import cargar_portfolio, listar_portfolios, listar_usuarios
+from analisis import analisis_historico
+from calendario import ahora_ny, precios_en_movimiento
+from datos_mercado import barras_cacheadas, barras_desde, info_cacheada
+from operaciones import ESTADO_ACTIVA
+from regimen import regimen_mercado
+from simbolos import actualizar_indice, indice_vencido
+
+ARCHIVO_WATCHLIST = 'watchlist.txt'
+TRABAJADORES_DEFAULT = 4
+TAMANO_LOTE_BARRAS = 20
+
+
+def leer_watchlist(ruta=ARCHIVO_WATCHLIST):
+    """Tickers de la watchlist: uno por línea, '#' para comentarios"""
+    if not os.path.exists(ruta):
+        return []
+    with open(ruta, 'r') as f:
+        lineas = (linea.split('#')[0].strip().upper() for linea in f)
+        return [t for t in lineas if t]
+
+
+def tickers_activos_portfolios():
+    """Tickers con trades activos en cualquier portfolio de cualquier usuario"""
+    tickers = set()
+    for usuario in listar_usuarios():
+        for nombre in listar_portfolios(usuario):
+            data = cargar_portfolio(usuario, nombre) or {'trades': []}
+            tickers.update(t['ticker'] for t in data['trades'] if t['status'] == ESTADO_ACTIVA)
+    return tickers
+
+
+def tickers_a_precalentar(watchlist=ARCHIVO_WATCHLIST, extra=()):
+    return sorted(set(leer_watchlist(watchlist)) | tickers_activos_portfolios()
+                  | {t.upper() for t in extra})
+
+
+def _cronometrar(funcion, *args):
+    """Ejecuta la función y devuelve (resultado, milisegundos, error)"""
+    inicio = time.perf_counter()
+    try:
+        resultado, error = funcion(*args), ''
+    except Exception as e:
+        resultado, error = None, str(e)
+    return resultado, (time.perf_counter() - inicio) * 1000, error
+
+
+def _barras_lote(lote, refrescar):
+    """Barras cacheadas del lote y, con el mercado abierto, su barra de hoy en la misma pasada"""
+    barras = barras_cacheadas(lote, refrescar)
+    if precios_en_movimiento():
+        barras_desde(lote, ahora_ny().date().isoformat())
+    return barras
+
+
+def precalentar(tickers, trabajadores=TRABAJADORES_DEFAULT, refrescar=False):
+    """Calienta barras (por lotes), fundamentales e indicadores de los tickers.
+
+    Los indicadores se calientan con la misma llamada que hace ANALIZAR TODO
+    (`analisis_historico(ticker, en_curso=True)`), así que la sesión lee lo que se dejó listo.
+
+    Devuelve el informe: una fila por ticker con el resultado y los ms de cada paso
+    (el tiempo de barras es el del lote en el que se descargó el ticker).
+    """
+    inicio = time.perf_counter()
+    filas = {t: {'ticker': t, 'barras': 0, 'barras_ms': None, 'fundamentales': False,
+                 'fundamentales_ms': None, 'indicadores_ms': None, 'error': ''} for t in tickers}
+    lotes = [tickers[i:i + TAMANO_LOTE_BARRAS] for i in range(0, len(tickers), TAMANO_LOTE_BARRAS)]
+
+    with ThreadPoolExecutor(max_workers=max(1, trabajadores)) as pool:
+        futuros_barras = [(lote, pool.submit(_cronometrar, _barras_lote, lote, refrescar))
+                          for lote in lotes]
+        futuros_info = [(t, pool.submit(_cronometrar, info_cacheada, t, refrescar)) for t in tickers]
+
+        # Los indicadores de un lote se encolan en cuanto sus barras están en caché
+        futuros_indicadores = []
+        for lote, futuro in futuros_barras:
+            barras, ms, error = futuro.result()
+            for ticker in lote:
+                filas[ticker]['barras_ms'] = ms
+                if barras and ticker in barras:
+                    filas[ticker]['barras'] = len(barras[ticker])
+                    futuro_ind = pool.submit(_cronometrar, analisis_historico, ticker, True)
+                    futuros_indicadores.append((ticker, futuro_ind))
+                else:
+                    filas[ticker]['error'] = error or "Sin barras"
+
+        for ticker, futuro in futuros_info:
+            info, ms, error = futuro.result()
+            filas[ticker]['fundamentales'] = bool(info)
+            filas[ticker]['fundamentales_ms'] = ms
+        for ticker, futuro in futuros_indicadores:
+            analisis, ms, error = futuro.result()
+            filas[ticker]['indicadores_ms'] = ms
+            if analisis is None:
+                filas[ticker]['error'] = error or "Sin indicadores"
+
+        # Régimen de mercado del día (SPY, VIX y sectores en un lote)
+        regimen, regimen_ms, _ = pool.submit(_cronometrar, regimen_mercado).result()
+
+    # Splits vistos en las barras: los portfolios amanecen ya en la escala nueva
+    splits, _, _ = _cronometrar(ajustar_portfolios)
+    return {'filas': list(filas.values()), 'trabajadores': trabajadores, 'regimen': regimen,
+            'regimen_ms': regimen_ms, 'splits': splits or {},
+            'total_ms': (time.perf_counter() - inicio) * 1000}
+
+
+def formatear_informe(informe):
+    """Informe en texto: una línea por ticker y el total"""
+    def ms(valor):
+        return f"{valor:8.0f}" if valor is not None else "       -"
+
+    lineas = [f"{'Ticker':<8} {'Barras':>6} {'ms':>8} {'Fund.':>5} {'ms':>8} {'Ind. ms':>8}  Error"]
+    for fila in informe['filas']:
+        lineas.append(f"{fila['ticker']:<8} {fila['barras']:>6} {ms(fila['barras_ms'])} "
+                      f"{'sí' if fila['fundamentales'] else 'no':>5} {ms(fila['fundamentales_ms'])} "
+                      f"{ms(fila['indicadores_ms'])}  {fila['error']}")
+    regimen = informe.get('regimen')
+    if regimen:
+        lineas.append(f"🌐 Régimen {regimen['regimen']} al {regimen['fecha']} "
+                      f"(SPY {regimen['spy']}, amplitud {regimen['amplitud_pct']}%, VIX {regimen['vix']}) "
+                      f"en {informe['regimen_ms']:.0f} ms")
+    for ruta, eventos in informe.get('splits', {}).items():
+        lineas.append(f"✂️ {ruta}: " + ", ".join(f"{e['ticker']} {e['evento']} ({e['barra']})" for e in eventos))
+    calientes = sum(1 for f in informe['filas'] if not f['error'])
+    lineas.append(f"✅ {calientes}/{len(informe['filas'])} tickers calientes en "
+                  f"{informe['total_ms'] / 1000:.1f} s con {informe['trabajadores']} trabajadores")
+    return '\n'.join(lineas)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precalienta las cachés de barras y fundamentales")
+    parser.add_argument('--watchlist', default=ARCHIVO_WATCHLIST, help="Archivo con un ticker por línea")
+    parser.add_argument('--tickers', nargs='*', default=[], help="Tickers adicionales")
+    parser.add_argument('--trabajadores', type=int, default=TRABAJADORES_DEFAULT)
+    parser.add_argument('--refrescar', action='store_true', help="Ignora la caché aunque siga vigente")
+    args = parser.parse_args()
+
+    tickers = tickers_a_precalentar(args.watchlist, args.tickers)
+    if not tickers:
+        print(f"⚠️ No hay tickers: crea {args.watchlist} o pasa --tickers")
+    else:
+        print(formatear_informe(precalentar(tickers, args.trabajadores, args.refrescar)))
+    # El índice de símbolos se renueva cada pocos días (después, para recoger los sectores)
+    if indice_vencido():
+        try:
+            print(f"✅ Índice de símbolos actualizado: {actualizar_indice()} símbolos")
+        except Exception as e:
+            print(f"⚠️ No se pudo actualizar el índice de símbolos: {e}")
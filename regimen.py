@@ -0,0 +1,147 @@
+"""Régimen de mercado compartido por todos los análisis, calculado una vez por sesión.
+
+A partir de las barras cacheadas de SPY, VIX y los ETFs sectoriales SPDR se calcula
+para cada fecha:
+  - SPY sobre sus medias de 50 y 200 sesiones
+  - amplitud: % de sectores cerrando sobre su media de 50
+  - nivel del VIX
+y se clasifica en 'Alcista', 'Neutral' o 'Bajista'. El resultado del día se guarda
+en disco, así que cada análisis solo lee un dict: no cuesta nada por ticker.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from calendario import ultima_sesion_final
+from datos_mercado import DIRECTORIO_CACHE_BARRAS, barras_cacheadas
+
+TICKER_MERCADO = 'SPY'
+TICKER_VIX = '^VIX'
+SECTORES = ['XLB', 'XLC', 'XLE', 'XLF', 'XLI', 'XLK', 'XLP', 'XLRE', 'XLU', 'XLV', 'XLY']
+SMA_CORTA = 50
+SMA_LARGA = 200
+VIX_ALTO = 25.0
+AMPLITUD_MINIMA = 50.0
+AMPLITUD_DEBIL = 40.0
+REGIMENES_FAVORABLES = ('Alcista', 'Neutral')
+
+ARCHIVO_REGIMEN = os.path.join(DIRECTORIO_CACHE_BARRAS, 'regimen.json')
+
+_memo = {}
+_memo_guard = threading.Lock()
+
+
+def serie_regimen(barras):
+    """Régimen para cada sesión a partir de {ticker: barras}. DataFrame indexado por fecha."""
+    spy = barras[TICKER_MERCADO]['Close']
+    df = pd.DataFrame({'spy': spy,
+                       'spy_sma50': spy.rolling(SMA_CORTA).mean(),
+                       'spy_sma200': spy.rolling(SMA_LARGA).mean()})
+
+    sectores = [barras[t]['Close'] for t in SECTORES if t in barras]
+    if sectores:
+        cierres = pd.concat(sectores, axis=1).reindex(df.index).ffill()
+        sobre_media = (cierres > cierres.rolling(SMA_CORTA).mean()).where(cierres.notna())
+        df['amplitud_pct'] = sobre_media.mean(axis=1) * 100
+    else:
+        df['amplitud_pct'] = np.nan
+    df['vix'] = barras[TICKER_VIX]['Close'].reindex(df.index).ffill() if TICKER_VIX in barras else np.nan
+
+    sobre_50 = df['spy'] > df['spy_sma50']
+    sobre_200 = df['spy'] > df['spy_sma200']
+    vix_alto = df['vix'] >= VIX_ALTO
+    df['regimen'] = np.select(
+        [sobre_50 & sobre_200 & ~vix_alto & ~(df['amplitud_pct'] < AMPLITUD_MINIMA),
+         ~sobre_200 & (vix_alto | (df['amplitud_pct'] < AMPLITUD_DEBIL))],
+        ['Alcista', 'Bajista'], default='Neutral')
+    df.loc[df['spy_sma200'].isna(), 'regimen'] = 'Neutral'
+    df.index = pd.Index(df.index.strftime('%Y-%m-%d'), name='fecha')
+    return df
+
+
+def _registro(serie, i):
+    fila = serie.iloc[i]
+
+    def valor(x):
+        return None if pd.isna(x) else round(float(x), 2)
+
+    return {
+        'fecha': serie.index[i],
+        'regimen': fila['regimen'],
+        'favorable': fila['regimen'] in REGIMENES_FAVORABLES,
+        'spy': valor(fila['spy']),
+        'spy_sma50': valor(fila['spy_sma50']),
+        'spy_sma200': valor(fila['spy_sma200']),
+        'amplitud_pct': valor(fila['amplitud_pct']),
+        'vix': valor(fila['vix']),
+    }
+
+
+def obtener_serie():
+    """Serie de régimen de las barras vigentes (una descarga por sesión para todo el lote)"""
+    final = ultima_sesion_final()
+    with _memo_guard:
+        if _memo.get('serie_final') == final:
+            return _memo['serie']
+    barras = barras_cacheadas([TICKER_MERCADO, TICKER_VIX] + SECTORES)
+    if TICKER_MERCADO not in barras:
+        return None
+    serie = serie_regimen(barras)
+    with _memo_guard:
+        _memo.update(serie=serie, serie_final=final)
+    return serie
+
+
+def regimen_mercado():
+    """Régimen de la última sesión cerrada: memoria -> regimen.json -> cálculo sobre la caché"""
+    final = ultima_sesion_final()
+    en_memoria = _memo.get('registro')
+    if en_memoria is not None and en_memoria['calculado_para'] == final:
+        return en_memoria
+    try:
+        with open(ARCHIVO_REGIMEN, 'r') as f:
+            registro = json.load(f)
+        if registro.get('calculado_para') == final:
+            _memo['registro'] = registro
+            return registro
+    except (OSError, ValueError):
+        pass
+
+    # Solo barras definitivas: la de una sesión en curso no cuenta
+    registro = regimen_en(final)
+    if registro is None:
+        return None
+    registro['calculado_para'] = final
+    os.makedirs(DIRECTORIO_CACHE_BARRAS, exist_ok=True)
+    temporal = f"{ARCHIVO_REGIMEN}.{os.getpid()}.tmp"
+    with open(temporal, 'w') as f:
+        json.dump(registro, f, indent=2)
+    os.replace(temporal, ARCHIVO_REGIMEN)
+    _memo['registro'] = registro
+    return registro
+
+
+def regimen_en(fecha):
+    """Régimen tal como estaba al cierre de `fecha` (modo as-of)"""
+    serie = obtener_serie()
+    if serie is None:
+        return None
+    i = int(np.searchsorted(serie.index.to_numpy(), str(fecha)[:10], side='right')) - 1
+    return _registro(serie, i) if i >= 0 else None
+
+
+def agregar_columna_regimen(df, columna_fecha='fecha'):
+    """Añade la columna 'regimen' (el de cada fecha de la fila) a un DataFrame de trades o de
+    un barrido de tickers (p. ej. `evaluar_universo`). Búsqueda vectorizada sobre la serie ya calculada."""
+    serie = obtener_serie()
+    df = df.copy()
+    if serie is None or df.empty:
+        df['regimen'] = None
+        return df
+    fechas = serie.index.to_numpy()
+    posiciones = np.searchsorted(fechas, df[columna_fecha].astype(str).str[:10].to_numpy(), side='right') - 1
+    df['regimen'] = np.where(posiciones >= 0, serie['regimen'].to_numpy()[np.maximum(posiciones, 0)], None)
+    return df
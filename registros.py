@@ -0,0 +1,200 @@
+"""Tabla columnar y tipada de trades sobre arrays de numpy.
+
+Los trades se guardan en JSON como dicts con `fecha` en texto y `status` libre.
+`TablaTrades` los convierte a columnas: fechas `datetime64[m]`, estados como
+códigos enteros y textos repetidos (ticker, consenso...) como categorías. Ordenar
+por fecha y filtrar por estado pasan a ser operaciones vectorizadas, y la
+conversión de vuelta a dicts es exacta (mismas claves, mismo orden, mismos valores).
+
+Es una vista de solo lectura: los dicts siguen siendo la representación canónica
+(JSON, broker, edición) y la tabla se construye aparte, memoizada por versión en
+la app. No ahorra memoria, se suma a los dicts (guardar los trades en columnas
+obligaría a cambiar el JSON, el broker y la edición); lo que abarata es ordenar,
+filtrar y agregar.
+"""
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from operaciones import (ESTADO_ACTIVA, ESTADO_CANCELADA, ESTADO_PENDIENTE, ESTADO_STOP,
+                         ESTADO_TP_1_2, ESTADO_TP_1_3, ESTADO_TRAILING)
+
+FORMATO_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$')
+
+# Códigos de estado: fijos para los conocidos, los nuevos se registran al aparecer (solo
+# se añaden, bajo `_BLOQUEO_ESTADOS`: las sesiones de Streamlit corren en hilos paralelos)
+ETIQUETAS_ESTADO = [ESTADO_ACTIVA, ESTADO_STOP, ESTADO_TP_1_2, ESTADO_TP_1_3, ESTADO_TRAILING,
+                    ESTADO_PENDIENTE, ESTADO_CANCELADA]
+_CODIGOS_ESTADO = {etiqueta: i for i, etiqueta in enumerate(ETIQUETAS_ESTADO)}
+CODIGO_ACTIVA = _CODIGOS_ESTADO[ESTADO_ACTIVA]
+_BLOQUEO_ESTADOS = threading.Lock()
+
+COLUMNAS_FLOAT = ('acciones', 'entrada', 'stop_loss', 'tp_1_2', 'tp_1_3', 'inversion',
+                  'riesgo', 'precio_actual', 'pl_actual', 'upside', 'precio_cierre', 'volumen_relativo', 'rsi')
+COLUMNAS_INT = ('smart_score',)
+COLUMNAS_CATEGORIA = ('ticker', 'consensus', 'recomendacion', 'ultima_barra', 'barra_cierre', 'regimen')
+
+
+def codigo_estado(etiqueta):
+    """Código entero de un estado (registra los estados nuevos)"""
+    codigo = _CODIGOS_ESTADO.get(etiqueta)
+    if codigo is not None:
+        return codigo
+    with _BLOQUEO_ESTADOS:
+        codigo = _CODIGOS_ESTADO.get(etiqueta)
+        if codigo is None:
+            # La etiqueta va antes que el código: quien lea el código ya encuentra su etiqueta
+            ETIQUETAS_ESTADO.append(etiqueta)
+            codigo = _CODIGOS_ESTADO[etiqueta] = len(ETIQUETAS_ESTADO) - 1
+        return codigo
+
+
+def codigos_cerradas():
+    return [c for c, etiqueta in enumerate(ETIQUETAS_ESTADO) if etiqueta.startswith('Cerrada')]
+
+
+class TablaTrades:
+    """Trades en columnas de numpy (de solo lectura). Las claves que no encajan en una columna
+    tipada (faltan en algún trade o tienen otro tipo) se guardan por fila en `extras`."""
+    __slots__ = ('n', 'columnas', 'categorias', 'extras', 'ordenes', 'orden')
+
+    def __init__(self, n, columnas, categorias, extras, ordenes, orden):
+        self.n = n
+        # Vista: los cambios se hacen en los dicts y la tabla se reconstruye
+        for array in columnas.values():
+            array.flags.writeable = False
+        self.columnas = columnas        # nombre -> np.ndarray
+        self.categorias = categorias    # nombre -> lista de valores (para columnas de categoría)
+        self.extras = extras            # lista de dicts por fila (o None)
+        self.ordenes = ordenes          # tuplas de claves distintas
+        self.orden = orden              # índice en `ordenes` por fila
+
+    def __len__(self):
+        return self.n
+
+    @classmethod
+    def desde_dicts(cls, trades):
+        n = len(trades)
+        columnas, categorias = {}, {}
+        tipadas = set()
+
+        def todos(clave, tipo):
+            return all(clave in t and type(t[clave]) is tipo for t in trades)
+
+        if n and all(isinstance(t.get('fecha'), str) and FORMATO_FECHA.match(t['fecha']) for t in trades):
+            columnas['fecha'] = np.array([t['fecha'] for t in trades], dtype='datetime64[m]')
+            tipadas.add('fecha')
+        if n and todos('status', str):
+            columnas['status'] = np.array([codigo_estado(t['status']) for t in trades], dtype=np.int16)
+            tipadas.add('status')
+        for clave in COLUMNAS_FLOAT:
+            if n and todos(clave, float):
+                columnas[clave] = np.array([t[clave] for t in trades], dtype=np.float64)
+                tipadas.add(clave)
+        for clave in COLUMNAS_INT:
+            if n and todos(clave, int):
+                columnas[clave] = np.array([t[clave] for t in trades], dtype=np.int64)
+                tipadas.add(clave)
+        for clave in COLUMNAS_CATEGORIA:
+            if n and todos(clave, str):
+                valores, codigos = np.unique(np.array([t[clave] for t in trades], dtype=object),
+                                             return_inverse=True)
+                columnas[clave] = codigos.astype(np.int32)
+                categorias[clave] = list(valores)
+                tipadas.add(clave)
+
+        ordenes, indice_ordenes, orden, extras = [], {}, np.empty(n, dtype=np.int32), [None] * n
+        for i, trade in enumerate(trades):
+            claves = tuple(trade)
+            j = indice_ordenes.get(claves)
+            if j is None:
+                j = indice_ordenes[claves] = len(ordenes)
+                ordenes.append(claves)
+            orden[i] = j
+            resto = {k: v for k, v in trade.items() if k not in tipadas}
+            if resto:
+                extras[i] = resto
+        return cls(n, columnas, categorias, extras, ordenes, orden)
+
+    # --- ACCESO ---
+    def tiene(self, nombre):
+        return nombre in self.columnas or any(e and nombre in e for e in self.extras)
+
+    def columna(self, nombre):
+        """Valores de una columna como array (fechas datetime64, estados como texto)"""
+        if nombre in self.categorias:
+            return np.asarray(self.categorias[nombre], dtype=object)[self.columnas[nombre]]
+        if nombre == 'status' and 'status' in self.columnas:
+            return np.asarray(ETIQUETAS_ESTADO, dtype=object)[self.columnas['status']]
+        if nombre in self.columnas:
+            return self.columnas[nombre]
+        return np.array([(e or {}).get(nombre) for e in self.extras], dtype=object)
+
+    def numerica(self, nombre):
+        """Columna como float64 (NaN donde falte)"""
+        if nombre in self.columnas and nombre not in self.categorias:
+            return self.columnas[nombre].astype(np.float64, copy=False)
+        return pd.to_numeric(pd.Series(self.columna(nombre)), errors='coerce').to_numpy(np.float64)
+
+    def codigos_estado(self):
+        if 'status' in self.columnas:
+            return self.columnas['status']
+        return np.array([codigo_estado(s) for s in self.columna('status')], dtype=np.int16)
+
+    # --- FILTROS Y ORDEN ---
+    def activas(self):
+        return self.codigos_estado() == CODIGO_ACTIVA
+
+    def cerradas(self):
+        return np.isin(self.codigos_estado(), codigos_cerradas())
+
+    def seleccionar(self, indices):
+        """Subtabla con las filas indicadas (máscara booleana o índices)"""
+        indices = np.flatnonzero(indices) if np.asarray(indices).dtype == bool else np.asarray(indices)
+        return TablaTrades(len(indices),
+                           {k: v[indices] for k, v in self.columnas.items()},
+                           self.categorias,
+                           [self.extras[i] for i in indices],
+                           self.ordenes,
+                           self.orden[indices])
+
+    def ordenar_por_fecha(self, descendente=False):
+        if 'fecha' in self.columnas:
+            indices = np.argsort(self.columnas['fecha'], kind='stable')
+        else:
+            indices = np.argsort(self.columna('fecha').astype(str), kind='stable')
+        return self.seleccionar(indices[::-1] if descendente else indices)
+
+    # --- CONVERSIONES ---
+    def fila(self, i):
+        """Trade i como dict, idéntico al original"""
+        valores = dict(self.extras[i] or {})
+        for nombre, array in self.columnas.items():
+            if nombre == 'fecha':
+                valores[nombre] = str(array[i]).replace('T', ' ')
+            elif nombre == 'status':
+                valores[nombre] = ETIQUETAS_ESTADO[array[i]]
+            elif nombre in self.categorias:
+                valores[nombre] = self.categorias[nombre][array[i]]
+            else:
+                valores[nombre] = array[i].item()
+        return {clave: valores[clave] for clave in self.ordenes[self.orden[i]]}
+
+    def a_dicts(self):
+        return [self.fila(i) for i in range(self.n)]
+
+    def a_dataframe(self, columnas=None):
+        """DataFrame para mostrar/analizar: fecha datetime, status como categoría"""
+        if columnas is None:
+            columnas = list(dict.fromkeys(c for orden in self.ordenes for c in orden))
+        datos = {}
+        for nombre in columnas:
+            if nombre == 'status':
+                datos[nombre] = pd.Categorical.from_codes(self.codigos_estado(), ETIQUETAS_ESTADO)
+            elif nombre in self.categorias:
+                datos[nombre] = pd.Categorical.from_codes(self.columnas[nombre], self.categorias[nombre])
+            else:
+                datos[nombre] = self.columna(nombre)
+        return pd.DataFrame(datos)
@@ -0,0 +1,210 @@
+"""Índice local de símbolos (ticker, nombre, exchange, sector) para validar y autocompletar.
+
+El índice vive en `simbolos.csv` y se construye con los listados públicos de
+NASDAQ Trader (NASDAQ + NYSE/NYSE American/Arca/Cboe). Se carga de forma perezosa
+la primera vez que se consulta y las búsquedas por prefijo son búsquedas binarias
+sobre listas ordenadas, así que un ticker que no está se detecta sin tocar la red.
+Solo cubre los listados de EE. UU.: un símbolo de otro mercado (SAP.DE, SHOP.TO,
+^VIX) no aparece aunque Yahoo lo tenga, así que no estar es un aviso, no un veto.
+
+El índice se renueva cada `DIAS_VIGENCIA_SIMBOLOS` días: lo hace precalentar.py y,
+si nadie lo ha hecho, la primera consulta de un proceso con el índice vencido lo
+renueva en segundo plano (mientras tanto se sigue usando el que hay; como mucho un
+intento cada `SEGUNDOS_REINTENTO_SIMBOLOS`).
+
+Uso sin UI:
+    python simbolos.py --actualizar
+    python simbolos.py MSF
+"""
+import argparse
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+ARCHIVO_SIMBOLOS = 'simbolos.csv'
+DIAS_VIGENCIA_SIMBOLOS = 7
+SUGERENCIAS_MAX = 8
+SEGUNDOS_REINTENTO_SIMBOLOS = 3600
+
+URL_NASDAQ = 'https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt'
+URL_OTROS = 'https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt'
+EXCHANGES = {'A': 'NYSE American', 'N': 'NYSE', 'P': 'NYSE Arca', 'Z': 'Cboe BZX', 'V': 'IEX'}
+
+_indice = None
+_indice_guard = threading.Lock()
+_ultima_comprobacion = 0.0
+
+
+class IndiceSimbolos:
+    """Tickers y nombres ordenados para buscar por prefijo con bisect"""
+    __slots__ = ('tickers', 'datos', 'nombres')
+
+    def __init__(self, filas):
+        self.datos = {f['ticker']: f for f in filas}
+        self.tickers = sorted(self.datos)
+        self.nombres = sorted((f['nombre'].lower(), f['ticker']) for f in filas if f['nombre'])
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker.upper() in self.datos
+
+    def info(self, ticker):
+        return self.datos.get(ticker.upper())
+
+    @staticmethod
+    def _por_prefijo(lista, desde, prefijo, limite, clave=lambda x: x):
+        """Hasta `limite` elementos consecutivos desde `desde` cuya clave empieza por `prefijo`"""
+        inicio = bisect.bisect_left(lista, desde)
+        encontrados = []
+        for elemento in lista[inicio:]:
+            if len(encontrados) >= limite or not clave(elemento).startswith(prefijo):
+                break
+            encontrados.append(elemento)
+        return encontrados
+
+    def buscar(self, texto, limite=SUGERENCIAS_MAX):
+        """Símbolos cuyo ticker (primero) o nombre empiezan por `texto`"""
+        texto = texto.strip()
+        if not texto:
+            return []
+        tickers = self._por_prefijo(self.tickers, texto.upper(), texto.upper(), limite)
+        if len(tickers) < limite:
+            nombre = texto.lower()
+            for _, ticker in self._por_prefijo(self.nombres, (nombre,), nombre, limite, clave=lambda x: x[0]):
+                if ticker not in tickers:
+                    tickers.append(ticker)
+                if len(tickers) >= limite:
+                    break
+        return [self.datos[t] for t in tickers]
+
+
+# --- CONSTRUCCIÓN Y CARGA ---
+def _leer_listado(url, columna_ticker, columna_exchange=None):
+    df = pd.read_csv(url, sep='|', dtype=str, keep_default_na=False)
+    df = df[~df[columna_ticker].str.startswith('File Creation Time')]
+    if 'Test Issue' in df:
+        df = df[df['Test Issue'] != 'Y']
+    return pd.DataFrame({
+        # Yahoo usa '-' para las clases de acciones (BRK.B -> BRK-B)
+        'ticker': df[columna_ticker].str.strip().str.replace('.', '-', regex=False),
+        'nombre': df['Security Name'].str.strip(),
+        'exchange': df[columna_exchange].map(EXCHANGES).fillna(df[columna_exchange]) if columna_exchange else 'NASDAQ',
+    })
+
+
+def _sectores_cacheados():
+    """Sector de los tickers cuyos fundamentales ya están en la caché local"""
+    from datos_mercado import DIRECTORIO_CACHE_BARRAS
+
+    sectores = {}
+    for ruta in glob.glob(os.path.join(DIRECTORIO_CACHE_BARRAS, '*.info.json')):
+        try:
+            with open(ruta, 'r') as f:
+                sector = json.load(f).get('sector')
+        except (OSError, ValueError):
+            continue
+        if sector:
+            sectores[os.path.basename(ruta)[:-len('.info.json')]] = sector
+    return sectores
+
+
+def actualizar_indice(ruta=ARCHIVO_SIMBOLOS):
+    """Descarga los listados, añade sectores conocidos y reescribe el índice local"""
+    global _indice
+    df = pd.concat([_leer_listado(URL_NASDAQ, 'Symbol'),
+                    _leer_listado(URL_OTROS, 'ACT Symbol', 'Exchange')], ignore_index=True)
+    df = df[df['ticker'] != ''].drop_duplicates('ticker')
+    df['sector'] = df['ticker'].map(_sectores_cacheados()).fillna('')
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    df.sort_values('ticker').to_csv(temporal, index=False)
+    os.replace(temporal, ruta)
+    with _indice_guard:
+        _indice = None
+    return len(df)
+
+
+def indice_vencido(ruta=ARCHIVO_SIMBOLOS):
+    try:
+        return time.time() - os.path.getmtime(ruta) > DIAS_VIGENCIA_SIMBOLOS * 86400
+    except OSError:
+        return True
+
+
+def _renovar_en_segundo_plano(ruta):
+    """Lanza `actualizar_indice` en un hilo si el índice está vencido (se mira una vez por hora)"""
+    global _ultima_comprobacion
+    ahora = time.time()
+    if ahora - _ultima_comprobacion < SEGUNDOS_REINTENTO_SIMBOLOS:
+        return
+    with _indice_guard:
+        if ahora - _ultima_comprobacion < SEGUNDOS_REINTENTO_SIMBOLOS:
+            return
+        _ultima_comprobacion = ahora
+    if not indice_vencido(ruta):
+        return
+
+    def renovar():
+        try:
+            actualizar_indice(ruta)
+        except Exception:
+            pass  # sin red se sigue con el índice que hay
+
+    threading.Thread(target=renovar, name='renovar_simbolos', daemon=True).start()
+
+
+def obtener_indice(ruta=ARCHIVO_SIMBOLOS):
+    """Índice cargado en la primera consulta (None si todavía no existe el archivo).
+
+    Si el archivo está vencido se renueva en segundo plano y la consulta siguiente ya lo ve.
+    """
+    global _indice
+    _renovar_en_segundo_plano(ruta)
+    if _indice is None:
+        with _indice_guard:
+            if _indice is None and os.path.exists(ruta):
+                df = pd.read_csv(ruta, dtype=str, keep_default_na=False)
+                _indice = IndiceSimbolos(df.to_dict('records'))
+    return _indice
+
+
+def validar_ticker(ticker):
+    """(True, info) si el ticker está en el índice; (False, sugerencias) si no.
+
+    Sin índice local no se puede decidir y se deja pasar: (True, None).
+    """
+    indice = obtener_indice()
+    if indice is None or not len(indice):
+        return True, None
+    info = indice.info(ticker)
+    if info is not None:
+        return True, info
+    # Sugerencias: el prefijo más largo del texto que coincida con algo
+    for largo in range(len(ticker), 0, -1):
+        sugerencias = indice.buscar(ticker[:largo])
+        if sugerencias:
+            return False, sugerencias
+    return False, []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Índice local de símbolos")
+    parser.add_argument('--actualizar', action='store_true', help="Descarga los listados de NASDAQ Trader")
+    parser.add_argument('texto', nargs='?', help="Prefijo a buscar")
+    args = parser.parse_args()
+
+    if args.actualizar:
+        print(f"✅ {actualizar_indice()} símbolos en {ARCHIVO_SIMBOLOS}")
+    if args.texto:
+        indice = obtener_indice()
+        if indice is None:
+            print(f"⚠️ No existe {ARCHIVO_SIMBOLOS}: ejecuta con --actualizar")
+        else:
+            for fila in indice.buscar(args.texto):
+                print(f"{fila['ticker']:<8} {fila['exchange']:<14} {fila['sector']:<22} {fila['nombre']}")
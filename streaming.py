@@ -0,0 +1,370 @@
+"""Ingesta de cotizaciones en streaming con evaluación de Stop/TP tick a tick.
+
+Flujo: proveedor (websocket de Yahoo o servidor de replay local) -> ingesta
+asyncio -> coalescencia del último precio por ticker -> evaluación contra el
+índice de alertas -> cierre del trade.
+
+Uso sin UI:
+    python streaming.py --yahoo
+    python streaming.py --replay ticks.csv
+    python streaming.py --servidor-replay ticks.csv --puerto 8766
+"""
+import abc
+import argparse
+import asyncio
+import csv
+import json
+import threading
+import time
+from collections import deque
+
+from acciones_corporativas import ajustar_trades
+from alertas import IndiceAlertas, clave_trade
+from almacen_portfolio import (PORTFOLIO_DEFAULT, USUARIO_DEFAULT, leer, migrar_legacy,
+                               modificar, ruta_portfolio)
+from broker import procesar_precio
+from operaciones import ESTADO_ACTIVA
+
+PUERTO_REPLAY = 8766
+
+
+# --- PROVEEDORES ---
+class ProveedorCotizaciones(abc.ABC):
+    """Interfaz de un feed continuo de cotizaciones"""
+
+    @abc.abstractmethod
+    async def suscribir(self, tickers):
+        """Empieza (o amplía) la suscripción a los tickers"""
+
+    @abc.abstractmethod
+    async def cotizaciones(self):
+        """Generador asíncrono de (ticker, precio)"""
+
+    async def cerrar(self):
+        pass
+
+
+class ProveedorYahoo(ProveedorCotizaciones):
+    """Feed de Yahoo Finance vía `yfinance.AsyncWebSocket`"""
+
+    def __init__(self):
+        self._cola = asyncio.Queue()
+        self._ws = None
+        self._tarea = None
+
+    def _recibir(self, mensaje):
+        ticker = mensaje.get('id')
+        precio = mensaje.get('price')
+        if ticker and precio:
+            self._cola.put_nowait((ticker, float(precio)))
+
+    async def suscribir(self, tickers):
+        import yfinance as yf
+        if self._ws is None:
+            self._ws = yf.AsyncWebSocket(verbose=False)
+        await self._ws.subscribe(list(tickers))
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ws.listen(self._recibir))
+
+    async def cotizaciones(self):
+        while True:
+            yield await self._cola.get()
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+
+
+class ProveedorReplay(ProveedorCotizaciones):
+    """Cliente del servidor de replay local (una cotización JSON por línea)"""
+
+    def __init__(self, host='127.0.0.1', puerto=PUERTO_REPLAY):
+        self.host = host
+        self.puerto = puerto
+        self._reader = None
+        self._writer = None
+
+    async def suscribir(self, tickers):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.puerto)
+        self._writer.write((json.dumps({'suscribir': sorted(tickers)}) + '\n').encode())
+        await self._writer.drain()
+
+    async def cotizaciones(self):
+        while True:
+            linea = await self._reader.readline()
+            if not linea:
+                return
+            tick = json.loads(linea)
+            yield tick['ticker'], float(tick['precio'])
+
+    async def cerrar(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def cargar_ticks_csv(ruta):
+    """Lee ticks grabados (columnas ticker, precio) para el servidor de replay"""
+    with open(ruta, newline='') as f:
+        return [(fila['ticker'], float(fila['precio'])) for fila in csv.DictReader(f)]
+
+
+class ServidorReplay:
+    """Servidor TCP local que reproduce ticks grabados a cada cliente suscrito"""
+
+    def __init__(self, ticks, host='127.0.0.1', puerto=PUERTO_REPLAY, ticks_por_segundo=None):
+        self.ticks = ticks
+        self.host = host
+        self.puerto = puerto
+        self.ticks_por_segundo = ticks_por_segundo
+        self._servidor = None
+
+    async def _atender(self, reader, writer):
+        suscripcion = json.loads(await reader.readline())
+        tickers = set(suscripcion.get('suscribir') or [])
+        pausa = 1 / self.ticks_por_segundo if self.ticks_por_segundo else 0
+        try:
+            for ticker, precio in self.ticks:
+                if tickers and ticker not in tickers:
+                    continue
+                writer.write((json.dumps({'ticker': ticker, 'precio': precio}) + '\n').encode())
+                await writer.drain()
+                await asyncio.sleep(pausa)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+        return self.puerto
+
+    async def detener(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+
+
+# --- PIPELINE ---
+class PipelineCotizaciones:
+    """Ingesta, coalescencia por ticker y evaluación de Stop/TP a medida que llegan los ticks.
+
+    `al_cerrar(cierres)` recibe la lista de (trade, precio) que tocaron su Stop u
+    objetivo en cada ronda de evaluación y devuelve el estado resultante de cada uno
+    (None si el trade ya no estaba abierto). Los que siguen activos (salida parcial
+    en el TP 1:2) se reindexan con su nuevo stop y el TP 1:3; solo los cerrados
+    cuentan como cierres. Sin `al_cerrar` cada toque cuenta como cierre.
+    """
+
+    def __init__(self, proveedor, al_cerrar=None, indice=None):
+        self.proveedor = proveedor
+        self.al_cerrar = al_cerrar
+        self.indice = indice or IndiceAlertas()
+        self.ultimos_precios = {}
+        self.latencias = deque(maxlen=10000)
+        self.cierres = deque(maxlen=1000)
+        self.ticks_recibidos = 0
+        self.evaluaciones = 0
+        self._pendientes = {}
+        self._hay_pendientes = None
+        self._fin = False
+        self._loop = None
+        self._tarea = None
+        self._detenido = False
+
+    def cargar_trades(self, trades):
+        self.indice.sincronizar([t for t in trades if t['status'] == ESTADO_ACTIVA], 'portfolio')
+
+    async def _ingerir(self):
+        try:
+            async for ticker, precio in self.proveedor.cotizaciones():
+                self.ticks_recibidos += 1
+                self.ultimos_precios[ticker] = precio
+                # Coalescencia: solo importa el último precio pendiente de cada ticker
+                self._pendientes[ticker] = (precio, time.perf_counter())
+                self._hay_pendientes.set()
+        finally:
+            self._fin = True
+            self._hay_pendientes.set()
+
+    async def _evaluar(self):
+        while True:
+            await self._hay_pendientes.wait()
+            self._hay_pendientes.clear()
+            pendientes, self._pendientes = self._pendientes, {}
+            tocados = []
+            for ticker, (precio, recibido) in pendientes.items():
+                self.evaluaciones += 1
+                for alerta in self.indice.evaluar(ticker, precio):
+                    if alerta['tocado']:
+                        tocados.append((alerta, recibido))
+            if tocados:
+                # Los cierres de una ronda se persisten juntos
+                if self.al_cerrar is not None:
+                    estados = self.al_cerrar([(a['trade'], a['precio']) for a, _ in tocados])
+                else:
+                    estados = [None] * len(tocados)
+                ahora = time.perf_counter()
+                for (alerta, recibido), estado in zip(tocados, estados):
+                    self.latencias.append(ahora - recibido)
+                    if estado == ESTADO_ACTIVA:
+                        # Salida parcial: sigue abierto con otros niveles
+                        self.indice.agregar(alerta['trade'], alerta['id'][0])
+                        continue
+                    self.indice.quitar(alerta['trade'], alerta['id'][0])
+                    if estado is None and self.al_cerrar is not None:
+                        continue
+                    self.cierres.append({'ticker': alerta['ticker'], 'precio': alerta['precio'],
+                                         'tipo': alerta['tipo'], 'trade': alerta['id'][1],
+                                         'estado': estado})
+            if self._fin and not self._pendientes:
+                return
+            await asyncio.sleep(0)
+
+    async def ejecutar(self, tickers=None):
+        """Corre el pipeline hasta que el proveedor termine (el de Yahoo no termina)"""
+        self._loop = asyncio.get_running_loop()
+        self._hay_pendientes = asyncio.Event()
+        await self.proveedor.suscribir(tickers or self.indice.tickers())
+        self._tarea = asyncio.gather(self._ingerir(), self._evaluar())
+        # Detenido antes de arrancar del todo
+        if self._detenido:
+            self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.proveedor.cerrar()
+
+    def detener(self):
+        """Para el pipeline desde otro hilo: no se evalúan ni se cierran más trades"""
+        self._detenido = True
+        if self._loop is not None and self._tarea is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._tarea.cancel)
+            except RuntimeError:
+                # El bucle ya terminó
+                pass
+
+    def actualizar_trades(self, trades):
+        """Reindexa los trades desde otro hilo y suscribe los tickers nuevos"""
+        if self._loop is None:
+            self.cargar_trades(trades)
+            return
+        def _recargar():
+            antes = set(self.indice.tickers())
+            self.cargar_trades(trades)
+            nuevos = set(self.indice.tickers()) - antes
+            if nuevos:
+                asyncio.ensure_future(self.proveedor.suscribir(nuevos))
+
+        self._loop.call_soon_threadsafe(_recargar)
+
+    def estadisticas(self):
+        latencias = sorted(self.latencias)
+        if latencias:
+            p50 = latencias[len(latencias) // 2] * 1000
+            p95 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))] * 1000
+            maxima = latencias[-1] * 1000
+        else:
+            p50 = p95 = maxima = None
+        return {
+            'ticks': self.ticks_recibidos,
+            'evaluaciones': self.evaluaciones,
+            'coalescidos': self.ticks_recibidos - self.evaluaciones,
+            'cierres': len(self.cierres),
+            'latencia_p50_ms': p50,
+            'latencia_p95_ms': p95,
+            'latencia_max_ms': maxima
+        }
+
+
+def iniciar_en_segundo_plano(pipeline, tickers=None):
+    """Arranca el pipeline en un hilo daemon con su propio event loop"""
+    hilo = threading.Thread(target=asyncio.run, args=(pipeline.ejecutar(tickers),),
+                            name='swing-lab-streaming', daemon=True)
+    hilo.start()
+    return hilo
+
+
+class CierreEnArchivo:
+    """Aplica cada ronda de cierres sobre el portfolio en disco, bajo el bloqueo de ese portfolio.
+
+    Cada trade tocado recibe el resultado del broker (estado, stop, salida parcial)
+    para que el pipeline lo reindexe. Devuelve el estado de cada uno.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def __call__(self, cierres):
+        estados = []
+        with modificar(self.ruta) as portfolio:
+            activos = {clave_trade(t): t for t in portfolio['trades'] if t['status'] == ESTADO_ACTIVA}
+            for trade, precio in cierres:
+                guardado = activos.get(clave_trade(trade))
+                if guardado is None:
+                    # Cerrado por otro proceso (o ya archivado)
+                    estados.append(None)
+                    continue
+                # Un split posterior a la carga de los trades cambia la escala de los niveles
+                ajustar_trades([guardado])
+                # El broker decide si el toque es salida parcial, trailing o cierre
+                procesar_precio(portfolio, guardado, precio)
+                trade.update(guardado)
+                estados.append(guardado['status'])
+        return estados
+
+
+async def _main(args):
+    migrar_legacy()
+    ruta = ruta_portfolio(args.usuario, args.portfolio)
+    trades = leer(ruta)['trades']
+    servidor = None
+    if args.replay:
+        servidor = ServidorReplay(cargar_ticks_csv(args.replay), puerto=0)
+        proveedor = ProveedorReplay(puerto=await servidor.iniciar())
+    elif args.yahoo:
+        proveedor = ProveedorYahoo()
+    else:
+        proveedor = ProveedorReplay(args.host, args.puerto)
+
+    pipeline = PipelineCotizaciones(proveedor, al_cerrar=CierreEnArchivo(ruta))
+    pipeline.cargar_trades(trades)
+    try:
+        await pipeline.ejecutar()
+    finally:
+        if servidor is not None:
+            await servidor.detener()
+        print(json.dumps(pipeline.estadisticas(), indent=2))
+        for cierre in pipeline.cierres:
+            print(f"{cierre['ticker']}: {cierre['estado'] or cierre['tipo']} @ ${cierre['precio']:.2f}")
+
+
+async def _servir(args):
+    servidor = ServidorReplay(cargar_ticks_csv(args.servidor_replay), puerto=args.puerto,
+                              ticks_por_segundo=args.ticks_por_segundo)
+    puerto = await servidor.iniciar()
+    print(f"Servidor de replay en {servidor.host}:{puerto}")
+    await servidor._servidor.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluación de Stop/TP en streaming")
+    parser.add_argument('--usuario', default=USUARIO_DEFAULT)
+    parser.add_argument('--portfolio', default=PORTFOLIO_DEFAULT)
+    parser.add_argument('--yahoo', action='store_true', help="Usar el websocket de Yahoo Finance")
+    parser.add_argument('--replay', help="CSV de ticks a reproducir con un servidor local embebido")
+    parser.add_argument('--servidor-replay', help="Solo levantar el servidor de replay con este CSV")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=PUERTO_REPLAY)
+    parser.add_argument('--ticks-por-segundo', type=float, default=None)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_servir(args) if args.servidor_replay else _main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,92 @@
+"""Análisis multi-temporalidad a partir de una sola descarga intradía.
+
+Se pide a Yahoo solo la granularidad más fina (30m o 1h) y el resto de
+temporalidades (1h, diaria, semanal) se construye localmente remuestreando
+esas barras. Sobre cada una se calculan los mismos indicadores de la pestaña de
+análisis: soporte de 20 barras, volumen relativo y RSI(14), más la tendencia
+respecto a su media de 20.
+"""
+import time
+
+import pandas as pd
+
+from analisis import PERIODO_RSI, rsi_serie
+from cache_compartida import CACHE
+from calendario import precios_en_movimiento
+from datos_mercado import COLUMNAS_OHLCV, descargar_barras
+from metodos_stop import BARRAS_MES, COLCHON_STOP
+
+# Intervalo base -> periodo máximo que Yahoo sirve para ese intervalo
+INTERVALOS_BASE = {'30m': '60d', '1h': '730d'}
+INTERVALO_BASE_DEFAULT = '1h'
+BARRAS_TENDENCIA = 20
+TTL_INTRADIA = 300  # en sesión las barras intradía se renuevan cada 5 min
+
+ETIQUETAS = {'30m': "30 min", '1h': "1 hora", '1d': "Diario", '1wk': "Semanal"}
+AGREGACION = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+
+def _vigencia_intradia(creado):
+    return not precios_en_movimiento() or time.time() - creado < TTL_INTRADIA
+
+
+def descargar_intradia(ticker, intervalo=INTERVALO_BASE_DEFAULT):
+    """Barras intradía (una sola petición, compartida entre sesiones); fuera de sesión
+    se reutilizan sin caducar"""
+    def cargar():
+        barras = descargar_barras([ticker], periodo=INTERVALOS_BASE[intervalo],
+                                  intervalo=intervalo).get(ticker.upper())
+        return None if barras is None else (time.time(), barras)
+
+    return CACHE.obtener('intradia', (ticker.upper(), intervalo), cargar, _vigencia_intradia)
+
+
+def remuestrear(barras, regla, **kwargs):
+    """Agrega barras OHLCV a una temporalidad mayor (descarta los huecos sin operaciones)"""
+    return barras[COLUMNAS_OHLCV].resample(regla, **kwargs).agg(AGREGACION).dropna(subset=['Close'])
+
+
+def construir_temporalidades(intradia, intervalo_base=INTERVALO_BASE_DEFAULT):
+    """{temporalidad: barras} a partir de las barras del intervalo base"""
+    temporalidades = {intervalo_base: intradia}
+    if intervalo_base == '30m':
+        # Las velas horarias de Yahoo empiezan a las 9:30: mismo anclaje
+        temporalidades['1h'] = remuestrear(intradia, '60min', offset='30min')
+    diario = remuestrear(intradia, '1D')
+    temporalidades['1d'] = diario
+    temporalidades['1wk'] = remuestrear(diario, 'W-FRI')
+    return temporalidades
+
+
+def indicadores(barras):
+    """Indicadores de la última barra de una temporalidad"""
+    if barras is None or len(barras) < 2:
+        return None
+    ventana = barras.iloc[-BARRAS_MES:]
+    soporte = float(ventana['Low'].min())
+    volumen_medio = ventana['Volume'].mean()
+    rsi = rsi_serie(barras['Close']).iloc[-1] if len(barras) > PERIODO_RSI else float('nan')
+    media = barras['Close'].rolling(BARRAS_TENDENCIA).mean().iloc[-1]
+    cierre = float(barras['Close'].iloc[-1])
+    return {
+        'cierre': round(cierre, 2),
+        'soporte': round(soporte, 2),
+        'stop': round(soporte * COLCHON_STOP, 2),
+        'volumen_relativo': round(float(barras['Volume'].iloc[-1] / volumen_medio * 100), 0) if volumen_medio > 0 else None,
+        'rsi': None if pd.isna(rsi) else round(float(rsi), 1),
+        'tendencia': None if pd.isna(media) else ('Alcista' if cierre > media else 'Bajista'),
+        'barras': len(barras),
+    }
+
+
+def analizar_temporalidades(ticker, intervalo_base=INTERVALO_BASE_DEFAULT):
+    """DataFrame con una fila por temporalidad (de la más fina a la semanal); None sin datos"""
+    intradia = descargar_intradia(ticker, intervalo_base)
+    if intradia is None or intradia.empty:
+        return None
+    filas = []
+    for temporalidad, barras in construir_temporalidades(intradia, intervalo_base).items():
+        valores = indicadores(barras)
+        if valores is not None:
+            filas.append(dict(temporalidad=ETIQUETAS[temporalidad], **valores))
+    return pd.DataFrame(filas)